@@ -0,0 +1,236 @@
+"""
+benchmarks/fakes.py
+
+Deterministic stand-ins for the two network/disk-bound dependencies of the loop,
+so its own overhead can be measured offline and for free:
+
+  - FakeChatClient: duck-types `client.chat.completions.create(...)` (streaming
+    and non-streaming) with configurable latency, injected slow calls, output
+    length, and the SDK's per-request `timeout`.
+  - install_fake_vector_store(): an in-memory module registered as `vector_store`
+    before memory_manager/main are imported.
+  - FakeLlama: stand-in for llama_cpp.Llama behind gaslighting/light_model.py,
+    with the same KV-cache prefix reuse and a per-token eval cost.
+"""
+
+import random
+import sys
+import threading
+import time
+import types
+from typing import List
+
+_VOCAB = (
+    "history future technology society century invention strategy insight trend "
+    "figure empire science culture network energy machine archive memory signal"
+).split()
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.total_tokens = prompt_tokens + completion_tokens
+        self.prompt_tokens_details = types.SimpleNamespace(cached_tokens=0)
+
+
+def _ns(**kwargs):
+    return types.SimpleNamespace(**kwargs)
+
+
+class APITimeoutError(Exception):
+    """
+    Same name as openai.APITimeoutError, which is all ratelimit/hedging look at.
+    """
+
+
+def _wait(seconds: float, timeout: float) -> None:
+    if timeout is not None and seconds > timeout:
+        time.sleep(timeout)
+        raise APITimeoutError(f"no response within {timeout:.2f}s")
+    time.sleep(seconds)
+
+
+class _FakeStream:
+    def __init__(self, words: List[str], usage: _Usage, ttft: float, per_token: float, timeout: float = None):
+        self._words, self._usage = words, usage
+        self._ttft, self._per_token = ttft, per_token
+        self._timeout = timeout  # per read, like httpx's read timeout
+        self.closed = False
+
+    def __iter__(self):
+        _wait(self._ttft, self._timeout)
+        for i, word in enumerate(self._words):
+            if self.closed:
+                return
+            if i and self._per_token:
+                _wait(self._per_token, self._timeout)
+            yield _ns(usage=None, choices=[_ns(delta=_ns(content=word + " "), finish_reason=None)])
+        yield _ns(usage=self._usage, choices=[])
+
+    def close(self):
+        self.closed = True
+
+
+class _FakeCompletions:
+    def __init__(self, owner: "FakeChatClient"):
+        self._owner = owner
+
+    def create(self, model=None, messages=None, max_tokens=512, stream=False, timeout=None, **_):
+        owner = self._owner
+        with owner._lock:
+            owner.calls += 1
+            rng = random.Random(owner.seed * 1_000_003 + owner.calls)
+        latency = owner.latency
+        if owner.slow_fraction and rng.random() < owner.slow_fraction:
+            latency = owner.slow_latency
+        n = max_tokens if owner.output_tokens is None else min(max_tokens, owner.output_tokens)
+        words = [rng.choice(_VOCAB) for _ in range(n)]
+        prompt = "".join(m["content"] for m in messages or [])
+        usage = _Usage(max(1, len(prompt) // 4), n)  # ~4 chars per token
+        per_token = 1.0 / owner.tokens_per_sec if owner.tokens_per_sec else 0.0
+
+        if stream:
+            return _FakeStream(words, usage, latency, per_token, timeout)
+        _wait(latency + per_token * n, timeout)
+        message = _ns(role="assistant", content=" ".join(words))
+        return _ns(choices=[_ns(message=message, finish_reason="length")], usage=usage)
+
+
+class FakeChatClient:
+    """
+    FakeChatClient(latency=0.0, tokens_per_sec=None, output_tokens=None, seed=0,
+                   slow_fraction=0.0, slow_latency=0.0)
+
+    `latency` is the time to first token, `tokens_per_sec` the decode rate (None =
+    instant), `output_tokens` caps the completion length (None = always max_tokens).
+    A `slow_fraction` of the calls takes `slow_latency` to the first token instead
+    (tail latency). Waits longer than the request's `timeout` raise APITimeoutError.
+    """
+    def __init__(self, latency: float = 0.0, tokens_per_sec: float = None,
+                 output_tokens: int = None, seed: int = 0,
+                 slow_fraction: float = 0.0, slow_latency: float = 0.0):
+        self.latency = latency
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = _ns(completions=_FakeCompletions(self))
+
+
+class FakeLlama:
+    """
+    FakeLlama(prefill_sec=0.0, decode_sec=0.0, seed=0)
+
+    Word-level tokenizer, random output. `generate(reset=True)` keeps the longest
+    cached prefix like llama_cpp.Llama.generate; every evaluated token costs
+    `prefill_sec` (batched prompt) or `decode_sec` (one token at a time) and is
+    counted in `evaluated`.
+    """
+    BOS, EOS = 0, 1
+
+    def __init__(self, prefill_sec: float = 0.0, decode_sec: float = 0.0, seed: int = 0):
+        self.prefill_sec, self.decode_sec = prefill_sec, decode_sec
+        self._words = ["<s>", "</s>"] + list(_VOCAB)
+        self._ids = {w: i for i, w in enumerate(self._words)}
+        self._rng = random.Random(seed)
+        self.input_ids: List[int] = []  # what the "KV cache" holds
+        self.evaluated = 0
+
+    def token_eos(self) -> int:
+        return self.EOS
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        ids = [self.BOS] if add_bos else []
+        for word in text.decode("utf-8").split():
+            if word not in self._ids:
+                self._ids[word] = len(self._words)
+                self._words.append(word)
+            ids.append(self._ids[word])
+        return ids
+
+    def detokenize(self, tokens: List[int]) -> bytes:
+        return "".join(self._words[t] + " " for t in tokens if t > self.EOS).encode("utf-8")
+
+    def _eval(self, tokens: List[int]) -> None:
+        time.sleep((self.prefill_sec if len(tokens) > 1 else self.decode_sec) * len(tokens))
+        self.evaluated += len(tokens)
+        self.input_ids.extend(tokens)
+
+    def generate(self, tokens, temp=0.8, top_p=0.95, reset=True, logits_processor=None, **_):
+        tokens = list(tokens)
+        if reset:
+            prefix = 0
+            for a, b in zip(self.input_ids, tokens[:-1]):
+                if a != b:
+                    break
+                prefix += 1
+            del self.input_ids[prefix:]
+            tokens = tokens[prefix:]
+        while True:
+            self._eval(tokens)
+            token = self._rng.randrange(2, len(_VOCAB) + 2)
+            yield token
+            tokens = [token]
+
+    def save_state(self) -> List[int]:
+        return list(self.input_ids)
+
+    def load_state(self, state: List[int]) -> None:
+        self.input_ids = list(state)
+
+
+def install_fake_vector_store() -> types.ModuleType:
+    """
+    install_fake_vector_store() -> module
+
+    Register an in-memory `vector_store` with the same functions the project
+    imports. Retrieval returns the k most recent documents of the namespace, after
+    sleeping `module.retrieval_latency` seconds (0 by default).
+    """
+    module = types.ModuleType("vector_store")
+    namespaces = {None: []}  # namespace -> [(id, text, metadata)], oldest first
+    module.namespaces = namespaces
+    module.retrieval_latency = 0.0
+    module.cache_stats = {"result_hits": 0, "result_misses": 0, "embedding_hits": 0, "embedding_misses": 0}
+
+    def add_to_vector_store(text, metadata=None, doc_id=None, namespace=None):
+        rows = namespaces.setdefault(namespace, [])
+        rows.append((doc_id or str(len(rows)), text, metadata or {}))
+
+    def retrieve_similar_memories(query, k=3, namespace=None):
+        module.cache_stats["result_misses"] += 1
+        time.sleep(module.retrieval_latency)
+        hits = namespaces.get(namespace, [])[-k:][::-1]
+        return {"ids": [[h[0] for h in hits]], "documents": [[h[1] for h in hits]],
+                "metadatas": [[h[2] for h in hits]], "distances": [[1.0 for _ in hits]]}
+
+    def get_memories(ids, namespace=None):
+        return {h[0]: h[1] for h in namespaces.get(namespace, []) if h[0] in ids}
+
+    def delete_memories(ids, namespace=None):
+        namespaces[namespace] = [h for h in namespaces.get(namespace, []) if h[0] not in ids]
+
+    def embed_documents(texts):
+        from embeddings import HashingEmbedder
+        return HashingEmbedder(64)(list(texts))
+
+    def flush_vector_store():
+        pass
+
+    module.add_to_vector_store = add_to_vector_store
+    module.retrieve_similar_memories = retrieve_similar_memories
+    module.get_memories = get_memories
+    module.delete_memories = delete_memories
+    module.embed_documents = embed_documents
+    module.flush_vector_store = flush_vector_store
+    sys.modules["vector_store"] = module
+    return module
+
+
+def fake_text(n_words: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(_VOCAB) for _ in range(n_words))
@@ -0,0 +1,495 @@
+"""
+benchmarks/run.py
+
+Offline benchmark suite for the loop's own overhead (no OpenAI calls, no Chroma).
+
+    python benchmarks/run.py                          # print JSON results
+    python benchmarks/run.py --out bench.json         # save them
+    python benchmarks/run.py --compare bench.json     # diff against a saved run
+
+Everything runs inside a temporary working directory, so logs/checkpoints from
+the benchmarked code never touch the real ones.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
+
+from benchmarks.fakes import FakeChatClient, FakeLlama, install_fake_vector_store, fake_text  # noqa: E402
+
+# `import main` must stay under this (no API key, no network, no Chroma/tiktoken load)
+IMPORT_TIME_TARGET_SEC = 0.5
+
+
+class _StopLoop(Exception):
+    pass
+
+
+# ==============================================================================
+# 0) startup: cold `import main` in a fresh interpreter
+# ==============================================================================
+def bench_import(runs: int = 3) -> dict:
+    env = dict(os.environ)
+    env.pop("OPENAI_API_KEY", None)  # importing must not need the key
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [CODE_DIR, env.get("PYTHONPATH")]))
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    samples = sorted(
+        float(subprocess.check_output([sys.executable, "-c", code], env=env, text=True).strip().splitlines()[-1])
+        for _ in range(runs)
+    )
+    median = samples[len(samples) // 2]
+    return {"import_main_sec": median, "target_sec": IMPORT_TIME_TARGET_SEC, "within_target": median <= IMPORT_TIME_TARGET_SEC}
+
+
+def _setup(workdir: str) -> None:
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    os.environ["METRICS_EXPORT"] = ""  # no exporter thread while measuring
+    os.environ["RATE_LIMIT_RPM"] = os.environ["RATE_LIMIT_TPM"] = str(10 ** 12)  # fakes have no quota
+    os.chdir(workdir)
+    install_fake_vector_store()
+
+
+def _per_op(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+# ==============================================================================
+# 1) utils: tokenizer throughput
+# ==============================================================================
+def bench_tokenizer(words: int = 100_000) -> dict:
+    import utils
+    text = fake_text(words)
+    start = time.perf_counter()
+    n_tokens = utils.count_tokens(text)
+    count_sec = time.perf_counter() - start
+    start = time.perf_counter()
+    chunks = utils.chunk_text_by_tokens(text, 4_000)
+    chunk_sec = time.perf_counter() - start
+    return {
+        "tokens": n_tokens,
+        "count_tokens_per_sec": n_tokens / count_sec,
+        "chunk_text_by_tokens_per_sec": n_tokens / chunk_sec,
+        "chunks": len(chunks),
+    }
+
+# ==============================================================================
+# 2) memory_manager: add_to_STM / build_context vs STM size
+# ==============================================================================
+def bench_memory(stm_sizes=(100, 1_000, 10_000), piece_words: int = 50, repeat: int = 200) -> dict:
+    import memory_manager
+    saved = memory_manager.SUMMARIZE_THRESHOLD_TOKENS, memory_manager.CONTEXT_WINDOW_TOKENS
+    # no compression and no eviction, so the STM really reaches each size
+    memory_manager.SUMMARIZE_THRESHOLD_TOKENS = float("inf")
+    memory_manager.CONTEXT_WINDOW_TOKENS = 10 ** 12
+
+    results = {}
+    try:
+        for size in stm_sizes:
+            m = memory_manager.MemoryManager(background=False)
+            pieces = [fake_text(piece_words, seed=i) for i in range(size)]
+            start = time.perf_counter()
+            for p in pieces:
+                m.add_to_STM(p)
+            add_us = (time.perf_counter() - start) / size * 1e6
+            build_us = _per_op(lambda: m.build_context("benchmark prompt"), repeat) * 1e6
+            results[str(size)] = {"add_to_STM_us": add_us, "build_context_us": build_us}
+    finally:
+        memory_manager.SUMMARIZE_THRESHOLD_TOKENS, memory_manager.CONTEXT_WINDOW_TOKENS = saved
+    return results
+
+# ==============================================================================
+# 2b) lexical_index: archive build rate, exact-recall search latency
+# ==============================================================================
+def bench_archive(docs: int = 100_000, piece_words: int = 150, queries: int = 200, batch: int = 4) -> dict:
+    from lexical_index import LexicalIndex
+    # every piece carries one fact only it mentions: a name, a date and a number
+    def fact(i: int) -> str:
+        return f"Dr. Varga{i} filed patent {i * 7919 % 1_000_003} on {1025 + i % 2000}-{i % 12 + 1:02d}-{i % 28 + 1:02d}."
+
+    index = LexicalIndex("bench_archive")
+    words = fake_text(piece_words * 64, seed=5).split()
+    start = time.perf_counter()
+    for first in range(0, docs, batch):
+        index.add([" ".join(words[(i * 37) % (len(words) - piece_words):][:piece_words]) + " " + fact(i)
+                   for i in range(first, min(docs, first + batch))])
+    build = time.perf_counter() - start
+
+    results = {"docs": docs, "build_docs_per_sec": docs / build, "segments": len(index.segments),
+               "disk_mb": sum(os.path.getsize(os.path.join("bench_archive", f))
+                              for f in os.listdir("bench_archive")) / 2 ** 20}
+    rng = __import__("random").Random(3)
+    targets = [rng.randrange(docs) for _ in range(queries)]
+    for name, make in (
+        ("name", lambda i: f"what did Varga{i} file"),
+        ("number", lambda i: f"patent {i * 7919 % 1_000_003}"),
+        # an STM piece that happens to mention the fact: the query memory_manager sends
+        ("stm_piece", lambda i: fake_text(200, seed=i) + " " + fact(i)),
+    ):
+        samples, hits = [], 0
+        for i in targets:
+            query = make(i)
+            start = time.perf_counter()
+            found = index.search(query, k=3)
+            samples.append(time.perf_counter() - start)
+            hits += bool(found["ids"]) and found["ids"][0] == i
+        samples.sort()
+        results[name] = {"p50_ms": samples[len(samples) // 2] * 1e3, "p99_ms": samples[int(len(samples) * 0.99)] * 1e3,
+                         "recall_at_1": hits / queries}
+    return results
+
+# ==============================================================================
+# 3) summarizer: fan-out latency against a fake model
+# ==============================================================================
+def bench_summarize(sizes=(10_000, 50_000, 100_000), latency: float = 0.05) -> dict:
+    import summarizer
+    from clients import set_openai_client
+    fake = FakeChatClient(latency=latency, output_tokens=200)
+    set_openai_client(fake, "summary")
+    results = {}
+    for words in sizes:
+        text = fake_text(words)
+        calls_before = fake.calls
+        start = time.perf_counter()
+        levels = []
+        summarizer.summarize_text(text, level_timings=levels)
+        results[str(words)] = {
+            "seconds": time.perf_counter() - start,
+            "calls": fake.calls - calls_before,
+            "levels": len(levels),
+            "per_call_latency": latency,
+        }
+    return results
+
+# ==============================================================================
+# 4) main: end-to-end iterations/sec
+# ==============================================================================
+def bench_main_loop(iterations: int = 200, latency: float = 0.0, output_tokens: int = 200,
+                    pipeline: bool = False) -> dict:
+    import main
+    from clients import set_openai_client
+    set_openai_client(FakeChatClient(latency=latency, output_tokens=200), "summary")
+    fake = FakeChatClient(latency=latency, output_tokens=output_tokens)
+    create = fake.chat.completions.create
+
+    def limited_create(*args, **kwargs):
+        if fake.calls >= iterations:
+            raise _StopLoop()
+        return create(*args, **kwargs)
+
+    fake.chat.completions.create = limited_create
+    set_openai_client(fake, "generation")
+    main.API_CALL_SLEEP_SEC = 0  # measure the loop, not the politeness sleep
+    main.OPENAI_WARMUP_CONNECTIONS = 0
+
+    start = time.perf_counter()
+    try:
+        main.main_loop(pipeline=pipeline)
+    except _StopLoop:
+        pass
+    main.memory.wait_for_compression()
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": fake.calls,
+        "seconds": elapsed,
+        "iterations_per_sec": fake.calls / elapsed,
+        "per_call_latency": latency,
+    }
+
+# ==============================================================================
+# 4b) main: time between generations, sequential vs pipelined planning
+# ==============================================================================
+def bench_pipeline(iterations: int = 100, latency: float = 0.02, retrieval_latency: float = 0.01) -> dict:
+    import vector_store  # the fake from _setup
+    saved = vector_store.retrieval_latency
+    vector_store.retrieval_latency = retrieval_latency
+    results = {}
+    try:
+        for mode in ("sequential", "pipelined"):
+            run = bench_main_loop(iterations, latency, pipeline=mode == "pipelined")
+            per_iteration = run["seconds"] / run["iterations"]
+            results[mode] = {
+                "iterations_per_sec": run["iterations_per_sec"],
+                # the fake's whole generation time is `latency`; the rest is the loop's own
+                "gap_ms": (per_iteration - latency) * 1e3,
+                "per_call_latency": latency,
+                "retrieval_latency": retrieval_latency,
+            }
+    finally:
+        vector_store.retrieval_latency = saved
+    return results
+
+# ==============================================================================
+# 4c) hedging: per-call latency with injected slow calls, with and without hedges
+# ==============================================================================
+def bench_hedging(calls: int = 200, latency: float = 0.02, slow_fraction: float = 0.05,
+                  slow_latency: float = 0.5, max_tokens: int = 128) -> dict:
+    import hedging
+    import main
+    from clients import set_openai_client
+    saved = hedging.HEDGE_REQUESTS, hedging.latencies
+    results = {}
+    try:
+        for mode in ("off", "hedged"):
+            hedging.HEDGE_REQUESTS = mode == "hedged"
+            hedging.latencies = hedging.LatencyWindow()
+            for key in hedging.hedge_stats:
+                hedging.hedge_stats[key] = 0
+            fake = FakeChatClient(latency=latency, output_tokens=50, slow_fraction=slow_fraction,
+                                  slow_latency=slow_latency, seed=7)
+            set_openai_client(fake, "generation")
+            samples = []
+            for i in range(calls):
+                start = time.perf_counter()
+                main.generate_next_chunk("benchmark prompt " * 50, max_tokens, iteration=i, stats={})
+                samples.append(time.perf_counter() - start)
+            samples.sort()
+            stats = dict(hedging.hedge_stats)
+            results[mode] = {
+                "p50_sec": samples[len(samples) // 2],
+                "p99_sec": samples[int(len(samples) * 0.99)],
+                "max_sec": samples[-1],
+                "hedge_rate": stats["hedged"] / max(stats["calls"], 1),
+                "hedge_wins": stats["hedge_wins"],
+                "wasted_tokens": stats["wasted_tokens"],
+                "api_calls": fake.calls,
+            }
+    finally:
+        hedging.HEDGE_REQUESTS, hedging.latencies = saved
+    return results
+
+# ==============================================================================
+# 4d) repetition: per-token cost of the streaming detector, and an early stop
+# ==============================================================================
+def bench_repetition(tokens: int = 20_000, reference_words: int = 4_000, degenerate_after: int = 300) -> dict:
+    from repetition import RepetitionDetector
+    from utils import shingle_hashes
+    reference = shingle_hashes(fake_text(reference_words, seed=1))
+    healthy = [w + " " for w in fake_text(tokens, seed=2).split()]
+    loop = fake_text(40, seed=3).split()
+    degenerate = healthy[:degenerate_after] + [loop[i % len(loop)] + " " for i in range(tokens - degenerate_after)]
+
+    def stream(deltas, should_stop) -> tuple:
+        # the same per-delta work as main.stream_next_chunk
+        text, count = "", 0
+        start = time.perf_counter()
+        for delta in deltas:
+            count += 1
+            if should_stop is not None:
+                text += delta
+                if should_stop(text):
+                    break
+        return time.perf_counter() - start, count
+
+    results = {}
+    baseline, _ = stream(healthy, lambda text: False)
+    elapsed, count = stream(healthy, RepetitionDetector(reference))
+    results["healthy"] = {
+        "tokens": count,
+        "baseline_us_per_token": baseline / tokens * 1e6,
+        "detector_us_per_token": elapsed / count * 1e6,
+        "overhead_us_per_token": (elapsed - baseline) / count * 1e6,
+        "false_stop": count < tokens,
+    }
+    detector = RepetitionDetector(reference)
+    _, count = stream(degenerate, detector)
+    results["degenerate"] = {
+        "tokens": tokens,
+        "stopped_after": count,
+        "repetition_starts": degenerate_after,
+        "kept_words": len("".join(degenerate)[:detector.trim_at].split()) if detector.triggered else None,
+        "tokens_saved": tokens - count,
+    }
+    return results
+
+# ==============================================================================
+# 4e) output_length: max_tokens policies on a simulated model (no sleeping)
+# ==============================================================================
+def bench_output_length(iterations: int = 2_000, ttft: float = 0.4, tokens_per_sec: float = 80.0,
+                        cached_fraction: float = 0.75, head_tokens: int = 2_500) -> dict:
+    import random
+    import config
+    from output_length import OutputLengthScheduler
+    random.seed(11)
+    results = {}
+    for name, policy, target in (("random", "random", "tokens_per_dollar"),
+                                 ("adaptive_per_dollar", "adaptive", "tokens_per_dollar"),
+                                 ("adaptive_per_sec", "adaptive", "tokens_per_sec")):
+        scheduler = OutputLengthScheduler(policy, target)
+        stm, output, cost, seconds, latencies, choices = 500, 0, 0.0, 0.0, [], []
+        for _ in range(iterations):
+            context = head_tokens + stm  # pinned prompt + LTM block, then STM
+            max_tokens = scheduler.next_max_tokens(context, config.SUMMARIZE_THRESHOLD_TOKENS - stm)
+            choices.append(max_tokens)
+            latency = ttft + max_tokens / tokens_per_sec  # the prompt asks to use every token
+            cached = int(context * cached_fraction)
+            cost += ((context - cached) * config.INPUT_COST_PER_TOKEN + cached * config.CACHED_INPUT_COST_PER_TOKEN
+                     + max_tokens * config.OUTPUT_COST_PER_TOKEN)
+            seconds += latency
+            output += max_tokens
+            latencies.append(latency)
+            scheduler.observe({"ttft": ttft, "latency": latency, "tokens_per_sec": tokens_per_sec,
+                               "prompt_tokens": context, "completion_tokens": max_tokens, "cached_tokens": cached},
+                              max_tokens)
+            stm += max_tokens
+            while stm > config.SUMMARIZE_THRESHOLD_TOKENS:
+                stm -= min(stm, config.MEMORY_CHUNK_TOKENS)
+        latencies.sort()
+        results[name] = {
+            "output_tokens_per_dollar": output / cost,
+            "output_tokens_per_sec": output / seconds,
+            "calls_per_1k_output_tokens": iterations / output * 1e3,
+            "mean_max_tokens": sum(choices) / iterations,
+            "max_max_tokens": max(choices),
+            "p99_call_sec": latencies[int(iterations * 0.99)],
+        }
+    return results
+
+# ==============================================================================
+# 5) runner: aggregate iterations/sec with N sessions in one process
+# ==============================================================================
+def bench_sessions(counts=(1, 4, 16), iterations: int = 200, latency: float = 0.05) -> dict:
+    import asyncio
+    import runner
+    from clients import set_openai_client
+    set_openai_client(FakeChatClient(latency=latency, output_tokens=200), "summary")
+    results = {}
+    for count in counts:
+        fake = FakeChatClient(latency=latency, output_tokens=200, seed=count)
+        set_openai_client(fake, "generation")
+        sessions = [runner.Session(f"bench-{count}-{i}") for i in range(count)]
+        budget = runner.CostBudget(float("inf"))
+        generations = asyncio.Semaphore(count)
+
+        async def run():
+            for s in sessions:
+                s.start()
+            tasks = [asyncio.create_task(runner.run_session(s, budget, generations)) for s in sessions]
+            while fake.calls < iterations:
+                await asyncio.sleep(0.01)
+            budget.cap = 0  # every session stops after its current iteration
+            await asyncio.gather(*tasks)
+
+        start = time.perf_counter()
+        asyncio.run(run())
+        elapsed = time.perf_counter() - start
+        results[str(count)] = {"iterations": fake.calls, "seconds": elapsed,
+                               "iterations_per_sec": fake.calls / elapsed, "per_call_latency": latency}
+    return results
+
+# ==============================================================================
+# 6) light_model: KV-cache reuse vs re-prefilling the whole conversation
+# ==============================================================================
+def bench_local_generation(rounds: int = 40, chunk_tokens: int = 100, n_ctx: int = 2048,
+                           prefill_sec: float = 20e-6, decode_sec: float = 200e-6) -> dict:
+    from gaslighting.light_model import LlamaBackend
+    results = {}
+    for mode in ("reprefill", "kv_reuse"):
+        llm = FakeLlama(prefill_sec=prefill_sec, decode_sec=decode_sec)
+        backend = LlamaBackend(n_ctx=n_ctx, system_prefix="you are a super intelligence", llm=llm)
+        history = ""
+        start = time.perf_counter()
+        for _ in range(rounds):
+            if mode == "reprefill":
+                llm.input_ids.clear()  # what create_chat_completion on the whole history costs
+            history += backend.complete(history + "continue", chunk_tokens, stop_at_eos=False)
+        elapsed = time.perf_counter() - start
+        generated = rounds * chunk_tokens
+        results[mode] = {
+            "seconds": elapsed,
+            "evaluated_tokens": llm.evaluated,
+            "prefill_tokens_per_output_token": (llm.evaluated - generated) / generated,
+            "tokens_per_sec": generated / elapsed,
+        }
+    return results
+
+# ==============================================================================
+# driver
+# ==============================================================================
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=CODE_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _flatten(d: dict, prefix: str = "") -> dict:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)):
+            out[key] = v
+    return out
+
+
+def compare(old: dict, new: dict) -> None:
+    old_flat, new_flat = _flatten(old["results"]), _flatten(new["results"])
+    print(f"{'metric':<55} {old.get('commit', '?'):>12} {new.get('commit', '?'):>12} {'ratio':>8}")
+    for key in sorted(new_flat):
+        if key in old_flat and old_flat[key]:
+            ratio = new_flat[key] / old_flat[key]
+            print(f"{key:<55} {old_flat[key]:>12.4g} {new_flat[key]:>12.4g} {ratio:>8.2f}")
+
+
+BENCHMARKS = {
+    "import": bench_import,
+    "tokenizer": bench_tokenizer,
+    "memory": bench_memory,
+    "archive": bench_archive,
+    "summarize": bench_summarize,
+    "main_loop": bench_main_loop,
+    "pipeline": bench_pipeline,
+    "hedging": bench_hedging,
+    "repetition": bench_repetition,
+    "output_length": bench_output_length,
+    "sessions": bench_sessions,
+    "local_generation": bench_local_generation,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the infinite loop")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="run a subset")
+    parser.add_argument("--out", help="write the JSON results here")
+    parser.add_argument("--compare", help="previous JSON results to diff against")
+    args = parser.parse_args()
+
+    out_path = os.path.abspath(args.out) if args.out else None
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    report = {"commit": _git_commit(), "python": platform.python_version(), "time": time.time(), "results": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        _setup(workdir)
+        for name in args.only or BENCHMARKS:
+            with contextlib.redirect_stdout(io.StringIO()):  # the loop is chatty
+                report["results"][name] = BENCHMARKS[name]()
+            print(f"✅ {name}", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if out_path:
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    if baseline is not None:
+        compare(baseline, report)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
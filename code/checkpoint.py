@@ -0,0 +1,134 @@
+"""
+checkpoint.py
+
+Periodic, atomic snapshots of the loop state so `main.py --resume` can continue
+where a stopped or crashed run left off.
+
+Snapshot format (JSONL, one record per line):
+  {"kind": "header", "version": 2, "iteration": ..., "counters": {...}, "saved_at": ...}
+  {"kind": "stm", "text": ..., "tokens": ...}        # oldest first
+  {"kind": "ltm", "chunk_id": ..., "tier": ...}      # LTM_index entries (texts live in the vector store)
+  {"kind": "pending", "chunk_id": ..., "pieces": n}  # the first STM records, in chunks still being
+                                                     # compressed, and the LTM id each will be stored as
+
+Token counts are stored as-is, so resuming never re-tokenizes or re-embeds anything,
+and a pending chunk is summarized again only if its summary never reached the vector
+store. Version 1 files (with the summary text) still load, as tier 0.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from config import CHECKPOINT_PATH, CHECKPOINT_EVERY_ITERATIONS
+from utils import ensure_dir_exists
+
+CHECKPOINT_VERSION = 2
+
+
+def save_checkpoint(state: dict, path: str = CHECKPOINT_PATH) -> None:
+    """
+    save_checkpoint(state, path) -> None
+
+    Write `state` (see Checkpointer.save) to `path` atomically: temp file, fsync, rename.
+    """
+    ensure_dir_exists(os.path.dirname(path) or ".")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        header = {
+            "kind": "header",
+            "version": CHECKPOINT_VERSION,
+            "iteration": state["iteration"],
+            "counters": state["counters"],
+            "saved_at": time.time(),
+        }
+        f.write(json.dumps(header) + "\n")
+        for text, tokens in state["memory"]["STM"]:
+            f.write(json.dumps({"kind": "stm", "text": text, "tokens": tokens}, ensure_ascii=False) + "\n")
+        for chunk_id, tier in state["memory"]["LTM_index"]:
+            f.write(json.dumps({"kind": "ltm", "chunk_id": chunk_id, "tier": tier}) + "\n")
+        for chunk_id, pieces in state["memory"].get("pending", ()):
+            f.write(json.dumps({"kind": "pending", "chunk_id": chunk_id, "pieces": pieces}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path: str = CHECKPOINT_PATH) -> Optional[dict]:
+    """
+    load_checkpoint(path) -> state dict, or None if there is no checkpoint.
+    """
+    if not os.path.exists(path):
+        return None
+    state = {"iteration": 0, "counters": {}, "memory": {"STM": [], "LTM_index": []}}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            kind = record["kind"]
+            if kind == "header":
+                if record["version"] not in (1, CHECKPOINT_VERSION):
+                    raise ValueError(f"Unsupported checkpoint version {record['version']} in {path}")
+                state["iteration"] = record["iteration"]
+                state["counters"] = record["counters"]
+            elif kind == "stm":
+                state["memory"]["STM"].append((record["text"], record["tokens"]))
+            elif kind == "ltm":
+                state["memory"]["LTM_index"].append((record["chunk_id"], record.get("tier", 0)))
+            elif kind == "pending":
+                state["memory"].setdefault("pending", []).append((record["chunk_id"], record["pieces"]))
+    return state
+
+
+class Checkpointer:
+    """
+    Takes a cheap in-memory snapshot on the loop thread every `every` iterations
+    and hands it to a background thread for the (slow) disk write. If a write is
+    still running, only the newest snapshot is kept.
+    """
+    def __init__(self, path: str = CHECKPOINT_PATH, every: int = CHECKPOINT_EVERY_ITERATIONS, before_write=None):
+        self.path = path
+        self.every = every
+        self.before_write = before_write  # e.g. flush the vector store so LTM_index is durable
+        self._cond = threading.Condition()
+        self._latest = None
+        self._writing = False
+        self._thread = threading.Thread(target=self._writer, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def maybe_save(self, iteration: int, memory, counters: dict) -> None:
+        if self.every > 0 and iteration % self.every == 0:
+            self.save(iteration, memory, counters)
+
+    def save(self, iteration: int, memory, counters: dict) -> None:
+        state = {"iteration": iteration, "counters": dict(counters), "memory": memory.snapshot()}
+        with self._cond:
+            self._latest = state
+            self._cond.notify_all()
+
+    def wait(self) -> None:
+        """
+        Block until the most recent snapshot is on disk.
+        """
+        with self._cond:
+            while self._latest is not None or self._writing:
+                self._cond.wait()
+
+    def _writer(self) -> None:
+        while True:
+            with self._cond:
+                while self._latest is None:
+                    self._cond.wait()
+                state, self._latest = self._latest, None
+                self._writing = True
+            try:
+                if self.before_write is not None:
+                    self.before_write()
+                save_checkpoint(state, self.path)
+            except Exception as e:
+                print(f"⚠️  checkpoint write failed: {e}")
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
@@ -0,0 +1,123 @@
+"""
+clients.py
+
+Lazily constructed, process-wide API clients. Nothing here runs at import time:
+the OpenAI SDK is imported, the API key is checked and the HTTP connection pool
+is created on the first get_openai_client() call, and every caller (generation,
+summarization) shares that one keep-alive pool. The local llama.cpp model
+(GENERATION_BACKEND = "llama") is likewise loaded once, by get_llama_backend().
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from config import (
+    require_openai_api_key,
+    INFINITE_MODEL,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_KEEPALIVE_SEC,
+    OPENAI_TIMEOUT_SEC,
+    LLAMA_MODEL_PATH,
+    LLAMA_N_CTX,
+    LLAMA_N_THREADS,
+    LLAMA_N_GPU_LAYERS,
+)
+
+_lock = threading.Lock()
+_shared = None
+_overrides: Dict[str, object] = {}  # role -> client, e.g. fakes in benchmarks
+_llama_backend = None
+
+
+def _build_client():
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+            keepalive_expiry=OPENAI_KEEPALIVE_SEC,
+        ),
+        timeout=OPENAI_TIMEOUT_SEC,
+    )
+    # retries are done by ratelimit.scheduled_create, which also paces them
+    return OpenAI(api_key=require_openai_api_key(), http_client=http_client, max_retries=0)
+
+
+def get_openai_client(role: str = "default"):
+    """
+    get_openai_client(role="default") -> OpenAI
+
+    The shared client, unless set_openai_client() installed one for `role`
+    ("generation", "summary", ...).
+    """
+    global _shared
+    override = _overrides.get(role)
+    if override is not None:
+        return override
+    with _lock:
+        if _shared is None:
+            _shared = _build_client()
+        return _shared
+
+
+def set_openai_client(client, role: str = "default") -> None:
+    """
+    set_openai_client(client, role="default") -> None
+
+    Replace the client for `role` (or the shared one for "default"); None removes an override.
+    """
+    global _shared
+    with _lock:
+        if role == "default":
+            _shared = client
+        elif client is None:
+            _overrides.pop(role, None)
+        else:
+            _overrides[role] = client
+
+
+def get_llama_backend(llm=None):
+    """
+    get_llama_backend(llm=None) -> LlamaBackend
+
+    The process-wide local model. `llm` (first call only) replaces the llama.cpp
+    model with a stand-in such as benchmarks.fakes.FakeLlama.
+    """
+    global _llama_backend
+    with _lock:
+        if _llama_backend is None:
+            from gaslighting.light_model import LlamaBackend
+            _llama_backend = LlamaBackend(
+                model_path=LLAMA_MODEL_PATH,
+                n_ctx=LLAMA_N_CTX,
+                n_threads=LLAMA_N_THREADS,
+                n_gpu_layers=LLAMA_N_GPU_LAYERS,
+                llm=llm,
+            )
+        return _llama_backend
+
+
+def warm_up(connections: int = 1, model: str = INFINITE_MODEL) -> float:
+    """
+    warm_up(connections, model) -> seconds
+
+    Open `connections` pooled keep-alive connections ahead of the first real call
+    (DNS + TCP + TLS), using cheap concurrent model lookups. Failures are reported,
+    not raised: the loop works without a warm pool.
+    """
+    client = get_openai_client()
+    start = time.time()
+
+    def touch(_):
+        client.models.retrieve(model)
+
+    try:
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            list(pool.map(touch, range(connections)))
+    except Exception as e:
+        print(f"⚠️  connection warm-up failed: {e}")
+    return time.time() - start
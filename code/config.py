@@ -15,12 +15,52 @@ load_dotenv()
 # ==============================================================================
 # key stuff
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", None)
-if not OPENAI_API_KEY:
-    raise ValueError("Missing OPENAI_API_KEY in environment.")
+
+def require_openai_api_key() -> str:
+    # checked when the first client is built (clients.py), not at import time
+    if not OPENAI_API_KEY:
+        raise ValueError("Missing OPENAI_API_KEY in environment.")
+    return OPENAI_API_KEY
 
 # models
 INFINITE_MODEL = "gpt-4.1-nano"
 SUMMARY_MODEL = "gpt-4.1-nano"
+
+# one shared keep-alive HTTP pool for every API call (see clients.py)
+OPENAI_MAX_CONNECTIONS = 16
+OPENAI_KEEPALIVE_SEC = 60.0
+OPENAI_TIMEOUT_SEC = 600.0
+# connections to pre-open before the first iteration (0 disables warm-up)
+OPENAI_WARMUP_CONNECTIONS = 2
+
+# generation backend: "openai", or "llama" for a free local llama.cpp model on CPU
+# (gaslighting/light_model.py), loaded once and continued from its KV cache
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "openai")
+LLAMA_MODEL_PATH = os.getenv("LLAMA_MODEL_PATH", "gaslighting/tinyllama-q4.gguf")
+LLAMA_N_CTX = 2048
+LLAMA_N_THREADS = None   # None = llama.cpp default
+LLAMA_N_GPU_LAYERS = 0   # CPU only
+
+# client-side rate limits (see ratelimit.py); re-calibrated from x-ratelimit-* headers
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "500"))
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "200000"))
+# retries on 429 / 5xx / connection errors, with full-jitter exponential backoff
+API_MAX_RETRIES = 6
+API_BACKOFF_BASE_SEC = 0.5
+API_BACKOFF_MAX_SEC = 60.0
+# per-call deadlines and hedging (see hedging.py). Latencies are kept per (model,
+# max_tokens bucket) over the last HEDGE_WINDOW calls (time to first token for streams).
+# Once HEDGE_MIN_SAMPLES are in, a call times out after HEDGE_TIMEOUT_MULTIPLIER * p99
+# (clamped to [HEDGE_TIMEOUT_MIN_SEC, OPENAI_TIMEOUT_SEC]) and, with HEDGE_REQUESTS, a
+# duplicate goes to HEDGE_FALLBACK_MODEL (None = same model) once the first one has
+# been waiting longer than the HEDGE_QUANTILE latency; the slower one is cancelled
+HEDGE_REQUESTS = False
+HEDGE_FALLBACK_MODEL = None
+HEDGE_QUANTILE = 0.95
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_TIMEOUT_MULTIPLIER = 3.0
+HEDGE_TIMEOUT_MIN_SEC = 10.0
 # ==============================================================================
 # ==============================================================================
 
@@ -31,10 +71,65 @@ SUMMARY_MODEL = "gpt-4.1-nano"
 # How many tokens can our LLM context window hold?
 CONTEXT_WINDOW_TOKENS = 32_000
 
+# context layout: "classic" = prompt, LTM, STM; "cache" = pinned INITIAL_PROMPT, LTM block
+# (re-queried only when LTM changes), STM, then the per-iteration prompt last, so
+# consecutive requests share a byte-identical prefix for the provider's prompt cache
+CONTEXT_LAYOUT = "classic"
+
 # stm
 SUMMARIZE_THRESHOLD_TOKENS = 4096
 # much much summaries to hold from the og size in stm
 MEMORY_CHUNK_TOKENS = SUMMARIZE_THRESHOLD_TOKENS // 2
+
+# background stm -> ltm compression
+COMPRESS_IN_BACKGROUND = True
+# how many evicted chunks may wait for the summarizer thread
+COMPRESSION_QUEUE_SIZE = 4
+# evicted-but-not-yet-in-ltm tokens at which add_to_STM blocks (backpressure)
+COMPRESSION_HIGH_WATER_TOKENS = SUMMARIZE_THRESHOLD_TOKENS * 2
+# a chunk whose summary or LTM insert fails is retried (it stays in STM_pending, so in
+# context) with backoff doubling from COMPRESSION_RETRY_BACKOFF_SEC, then dropped
+COMPRESSION_MAX_RETRIES = 3
+COMPRESSION_RETRY_BACKOFF_SEC = 2.0
+
+# summarizer: inputs under SUMMARY_INPUT_LIMIT_TOKENS go in one call, larger ones are
+# split into SUMMARY_CHUNK_TOKENS shards, summarized in parallel, and tree-reduced
+SUMMARY_INPUT_LIMIT_TOKENS = 6_000
+SUMMARY_CHUNK_TOKENS = 4_000
+SUMMARY_CONCURRENCY = 8
+
+# LTM tiers: new summaries are tier 0; once a tier holds more than LTM_CONSOLIDATION_FANOUT
+# summaries, its oldest FANOUT are summarized into one summary of the next tier, so the
+# store stays ~FANOUT * log_FANOUT(run length) entries
+LTM_CONSOLIDATION_FANOUT = 8
+# a new summary at least this similar (cosine) to a stored one replaces it
+LTM_DUPLICATE_SIMILARITY = 0.95
+# retrieval prefers higher tiers: over k * LTM_RETRIEVAL_OVERFETCH candidates, the
+# distance of a tier-t summary is scaled by LTM_TIER_DISCOUNT ** t before ranking
+LTM_RETRIEVAL_OVERFETCH = 3
+LTM_TIER_DISCOUNT = 0.85
+# the LTM block in build_context: at most LTM_TOP_K summaries and LTM_TOKEN_BUDGET tokens,
+# picked by maximal marginal relevance (LTM_MMR_LAMBDA = 1 is plain relevance, lower
+# values favour summaries unlike the ones already picked)
+LTM_TOP_K = 3
+LTM_TOKEN_BUDGET = 1_500
+LTM_MMR_LAMBDA = 0.7
+# a candidate with at least this share of its LTM_SHINGLE_WORDS-word shingles already
+# in the context's STM pieces repeats them and is dropped
+LTM_SHINGLE_WORDS = 5
+LTM_STM_OVERLAP_MAX = 0.5
+# vector and archive (BM25) candidates are fused by reciprocal rank, sum of 1 / (LTM_RRF_K + rank)
+LTM_RRF_K = 60
+
+# degeneration check on the generation stream (see repetition.py): a generation is cut
+# once REPETITION_THRESHOLD of its last REPETITION_WINDOW word REPETITION_NGRAM-grams
+# repeat itself or the reference (the LTM block + the newest REPETITION_REFERENCE_TOKENS
+# of STM), and the repeated tail is trimmed before it reaches STM
+REPETITION_DETECTION = False
+REPETITION_NGRAM = LTM_SHINGLE_WORDS  # same hashing as the STM shingles
+REPETITION_WINDOW = 64
+REPETITION_THRESHOLD = 0.8
+REPETITION_REFERENCE_TOKENS = 4_000
 # ==============================================================================
 # ==============================================================================
 
@@ -43,6 +138,38 @@ MEMORY_CHUNK_TOKENS = SUMMARIZE_THRESHOLD_TOKENS // 2
 # 3) CHROMA VECTOR STORE CONFIGURATION
 # ==============================================================================
 CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chromadb_data")
+
+# LTM store: "chroma" (PersistentClient) or "numpy" (in-process mmap index, see numpy_index.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_INDEX_DIR = os.getenv("NUMPY_INDEX_DIR", "./numpy_index")
+NUMPY_INDEX_QUANTIZE = False  # store int8 rows + per-row scale (~4x smaller)
+
+# (query, k) -> results cache; flushed whenever a new memory is added
+RETRIEVAL_CACHE_SIZE = 256
+RETRIEVAL_CACHE_TTL_SEC = 300
+# query -> embedding cache; survives result invalidation
+EMBEDDING_CACHE_SIZE = 1024
+
+# embeddings: "chroma" (Chroma's default model), "hashing" (offline NumPy feature hashing),
+# or any callable(texts) -> vectors; results are cached on disk by content hash
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "chroma")
+EMBEDDING_DIM = 384  # hashing backend only
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "./embedding_cache")
+
+# write-behind inserts: flush pending memories as one batched add at N items or T seconds
+VECTOR_FLUSH_BATCH_SIZE = 16
+VECTOR_FLUSH_INTERVAL_SEC = 30.0
+
+# verbatim archive of the STM pieces compressed into LTM (see lexical_index.py): BM25 over
+# memory-mapped segments, searched next to the vector store for exact names/dates/numbers
+LEXICAL_ARCHIVE = False
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "./lexical_index")
+LEXICAL_SEGMENT_DOCS = 256   # documents indexed in RAM before they are written as a segment
+LEXICAL_MERGE_FANOUT = 8     # this many segments of one size tier are merged into one
+LEXICAL_QUERY_TERMS = 16     # a query scores only its rarest terms ...
+LEXICAL_MAX_DF = 0.5         # ... and skips those in more than this share of documents
+BM25_K1 = 1.2
+BM25_B = 0.75
 # ==============================================================================
 # ==============================================================================
 
@@ -52,6 +179,24 @@ CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chromadb_data")
 # ==============================================================================
 LOG_DIR = "./logs"
 STREAM_LOG_FILE = os.path.join(LOG_DIR, "stream.txt")
+# iteration -> (segment, byte offset) index, see logger.py
+LOG_INDEX_FILE = os.path.join(LOG_DIR, "stream.index.jsonl")
+LOG_BUFFER_ENTRIES = 1024          # queued writes before callers block
+LOG_FSYNC_POLICY = "interval"      # "always", "interval" or "never"
+LOG_FSYNC_INTERVAL_SEC = 5.0
+LOG_ROTATE_BYTES = 64 * 1024 * 1024  # 0 disables size-based rotation
+LOG_ROTATE_SEC = 24 * 60 * 60        # 0 disables time-based rotation
+LOG_COMPRESSION = "gzip"           # closed segments: "gzip", "zstd" (needs zstandard) or None
+
+# stage latency / counter export (see metrics.py): "prometheus", "jsonl" or None
+METRICS_EXPORT = os.getenv("METRICS_EXPORT") or None
+METRICS_PATH = os.getenv("METRICS_PATH", os.path.join(LOG_DIR, "metrics.prom"))
+METRICS_EXPORT_INTERVAL_SEC = 15.0
+METRICS_PREFIX = "infinite_"
+
+# memory/loop snapshots for `main.py --resume`
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", "./checkpoints/memory.jsonl")
+CHECKPOINT_EVERY_ITERATIONS = 10
 # ==============================================================================
 # ==============================================================================
 
@@ -59,7 +204,31 @@ STREAM_LOG_FILE = os.path.join(LOG_DIR, "stream.txt")
 # ==============================================================================
 # 5) OTHER SETTINGS
 # ==============================================================================
-API_CALL_SLEEP_SEC = 0.01
+# pause between iterations; pacing is otherwise left to the rate limiter
+API_CALL_SLEEP_SEC = 0.0
+# gpt-4.1-nano pricing per token, and the spend at which main.py stops
+INPUT_COST_PER_TOKEN = 0.10 / 1_000_000
+CACHED_INPUT_COST_PER_TOKEN = 0.025 / 1_000_000
+OUTPUT_COST_PER_TOKEN = 0.40 / 1_000_000
+COST_CAP_USD = 1.00
+# multi-session runner (runner.py): generations in flight across all sessions, and
+# the combined spend at which every session stops
+RUNNER_MAX_CONCURRENT_GENERATIONS = 8
+RUNNER_COST_CAP_USD = 10.00
+# max_tokens per generation (see output_length.py): "adaptive" picks the shortest output
+# that reaches the OUTPUT_LENGTH_TARGET rate, within the room left in the context window,
+# the next STM compression and OUTPUT_LENGTH_MAX_SEC; "random" is the old weighted draw
+OUTPUT_LENGTH_POLICY = os.getenv("OUTPUT_LENGTH_POLICY", "random")
+OUTPUT_LENGTH_TARGET = "tokens_per_dollar"   # or "tokens_per_sec"
+OUTPUT_TOKENS_PER_DOLLAR_TARGET = 1_500_000  # per call, prompt included (< 1 / OUTPUT_COST_PER_TOKEN)
+OUTPUT_TOKENS_PER_SEC_TARGET = 60.0          # per call, time to first token included
+OUTPUT_LENGTH_MIN_TOKENS = 128
+OUTPUT_LENGTH_MAX_TOKENS = 32_768            # the model's completion limit
+OUTPUT_LENGTH_MAX_SEC = 120.0
+# stream completions token-by-token (incremental logging, time-to-first-token)
+STREAM_GENERATION = True
+# plan iteration N+1 (prompt, max_tokens, LTM probe, context head) while N is generating
+PIPELINE_ITERATIONS = False
 # ==============================================================================
 # ==============================================================================
 
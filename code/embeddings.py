@@ -0,0 +1,216 @@
+"""
+embeddings.py
+
+Pluggable embedding backends for the LTM vector store, plus a persistent on-disk
+cache so identical texts are never embedded twice (not even across restarts).
+
+Backends (config.EMBEDDING_BACKEND):
+  - "chroma":  Chroma's default embedding function (downloaded on first use).
+  - "hashing": deterministic NumPy feature-hashing embedder; fast and fully offline.
+  - a callable(texts) -> vectors supplied by the user (a lambda needs a `name` attribute).
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from config import EMBEDDING_BACKEND, EMBEDDING_DIM, EMBEDDING_CACHE_DIR
+from utils import ensure_dir_exists
+
+_WORD_RE = re.compile(r"\w+")
+_UNSAFE_NAME_RE = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+# ==============================================================================
+# 1) backends
+# ==============================================================================
+class HashingEmbedder:
+    """
+    Signed feature hashing of word unigrams and bigrams into `dim` buckets,
+    L2-normalized. Deterministic across processes and machines.
+    """
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.dim = dim
+        self._bucket_cache: Dict[str, int] = {}  # feature -> signed bucket (sign in the low bit)
+
+    def _bucket(self, feature: str) -> int:
+        b = self._bucket_cache.get(feature)
+        if b is None:
+            b = zlib.crc32(feature.encode("utf-8"))
+            if len(self._bucket_cache) < 1_000_000:
+                self._bucket_cache[feature] = b
+        return b
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        rows, buckets = [], []
+        for row, text in enumerate(texts):
+            words = _WORD_RE.findall(text.lower())
+            features = words + [a + " " + b for a, b in zip(words, words[1:])]
+            buckets.extend(self._bucket(f) for f in features)
+            rows.extend([row] * len(features))
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if buckets:
+            h = np.asarray(buckets, dtype=np.uint32)
+            signs = np.where(h & 1, 1.0, -1.0).astype(np.float32)
+            np.add.at(out, (np.asarray(rows), (h >> 1) % self.dim), signs)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-12)
+
+
+def _chroma_default() -> Callable:
+    from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+    return DefaultEmbeddingFunction()
+
+
+def _make_backend(spec):
+    """
+    Resolve EMBEDDING_BACKEND into (name, callable). The name is part of the cache
+    directory and of the Chroma collection name, so a callable's own name (its
+    `name` attribute, else `__name__` or its class name) is reduced to
+    [A-Za-z0-9_-]; anonymous callables must be given a `name`.
+    """
+    if callable(spec):
+        name = getattr(spec, "name", None) or getattr(spec, "__name__", type(spec).__name__)
+        safe = _UNSAFE_NAME_RE.sub("_", str(name)).strip("_-")[:40]
+        if name == "<lambda>" or not safe:
+            raise ValueError(f"Embedding backend {spec!r} needs a `name` attribute: "
+                             "it keys the embedding cache and the vector collection")
+        return safe, spec
+    if spec == "hashing":
+        return f"hashing{EMBEDDING_DIM}", HashingEmbedder(EMBEDDING_DIM)
+    if spec == "chroma":
+        return "chroma", _chroma_default()
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {spec!r}")
+
+
+# ==============================================================================
+# 2) persistent cache: <dir>/keys.bin (16-byte blake2b digests) + vectors.f32
+# ==============================================================================
+class EmbeddingCache:
+    """
+    Append-only, content-addressed float32 store. Vectors are read through a
+    memory map, so opening a large cache costs one mmap plus reading the keys.
+    """
+    KEY_BYTES = 16
+
+    def __init__(self, directory: str):
+        ensure_dir_exists(directory)
+        self.keys_path = os.path.join(directory, "keys.bin")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self._lock = threading.Lock()
+        self.dim = None
+        self._rows: Dict[bytes, int] = {}
+        self._mmap = None
+        self._mapped_rows = 0
+
+        # meta.json is written last, after the first rows: without it the cache is empty
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                self.dim = json.load(f)["dim"]
+            keys = b""
+            if os.path.exists(self.keys_path) and os.path.exists(self.vectors_path):
+                with open(self.keys_path, "rb") as f:
+                    keys = f.read()
+            # a crash between the two appends leaves extra keys; trust only complete rows
+            n = len(keys) // self.KEY_BYTES
+            if n:
+                n = min(n, os.path.getsize(self.vectors_path) // (4 * self.dim))
+            for i in range(n):
+                self._rows[keys[i * self.KEY_BYTES:(i + 1) * self.KEY_BYTES]] = i
+            self._truncate_to(n)
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=EmbeddingCache.KEY_BYTES).digest()
+
+    def _truncate_to(self, n: int) -> None:
+        for path, row_bytes in ((self.keys_path, self.KEY_BYTES), (self.vectors_path, 4 * self.dim)):
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.truncate(n * row_bytes)
+
+    def _vectors(self) -> np.ndarray:
+        if self._mapped_rows != len(self._rows):
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                   shape=(len(self._rows), self.dim))
+            self._mapped_rows = len(self._rows)
+        return self._mmap
+
+    def get_many(self, keys: List[bytes]) -> List:
+        """
+        Cached vector (np.ndarray) or None for each key.
+        """
+        with self._lock:
+            if not self._rows:
+                return [None] * len(keys)
+            vectors = self._vectors()
+            return [None if (r := self._rows.get(k)) is None else np.array(vectors[r]) for k in keys]
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        with self._lock:
+            fresh = {}
+            for k, v in zip(keys, vectors):
+                if k not in self._rows and k not in fresh:
+                    fresh[k] = v
+            if not fresh:
+                return
+            first = self.dim is None
+            if first:
+                self.dim = int(vectors.shape[1])
+            block = np.asarray(list(fresh.values()), dtype=np.float32)
+            # vectors first, keys second: a torn write is dropped on the next open.
+            # The first write starts both files over (leftovers from a crash before
+            # meta.json existed have no known dim) and only then records the dim.
+            mode = "wb" if first else "ab"
+            with open(self.vectors_path, mode) as f:
+                f.write(block.tobytes())
+            with open(self.keys_path, mode) as f:
+                f.write(b"".join(fresh.keys()))
+            if first:
+                tmp = self.meta_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim}, f)
+                os.replace(tmp, self.meta_path)
+            for k in fresh:
+                self._rows[k] = len(self._rows)
+
+
+# ==============================================================================
+# 3) the embedder used by vector_store
+# ==============================================================================
+class CachedEmbedder:
+    """
+    embedder(texts) -> np.ndarray of shape (len(texts), dim), float32.
+    Cache hits are read from disk; all misses go to the backend in one batch.
+    """
+    def __init__(self, backend=EMBEDDING_BACKEND, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.name, self.backend = _make_backend(backend)
+        self.cache = EmbeddingCache(os.path.join(cache_dir, self.name)) if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        if self.cache is None:
+            return np.asarray(self.backend(list(texts)), dtype=np.float32)
+
+        keys = [EmbeddingCache.key(t) for t in texts]
+        found = self.cache.get_many(keys)
+        missing = [i for i, v in enumerate(found) if v is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            unique = list({keys[i]: i for i in missing}.values())  # embed repeats once
+            fresh = np.asarray(self.backend([texts[i] for i in unique]), dtype=np.float32)
+            self.cache.put_many([keys[i] for i in unique], fresh)
+            by_key = {keys[i]: v for i, v in zip(unique, fresh)}
+            for i in missing:
+                found[i] = by_key[keys[i]]
+        return np.stack(found) if found else np.zeros((0, self.cache.dim or 0), dtype=np.float32)
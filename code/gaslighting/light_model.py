@@ -1,65 +1,215 @@
 # =============================================================================
-# light_model.py — forced-length generation with llama-cpp-python
+# light_model.py — continuous local generation with llama-cpp-python
 # =============================================================================
-from llama_cpp import Llama
-import os, sys
+# The model is loaded once and its KV cache is reused between calls: every
+# request is tokenized, the longest prefix already in the cache is kept, and
+# only the new suffix is prefilled. When the sequence outgrows n_ctx, the
+# pinned system prefix stays and the oldest half of the rest is evicted, so
+# the window is re-prefilled once per n_ctx/2 tokens instead of every round.
+#
+# Runs on CPU by default (n_gpu_layers=0). `llm=` accepts any object with the
+# same tokenize/detokenize/token_eos/generate/save_state/load_state methods,
+# e.g. benchmarks.fakes.FakeLlama.
+# =============================================================================
+import codecs
+import os
+import pickle
+import sys
+import time
+from typing import Callable, Iterator, List, Optional
+
+
+class LlamaBackend:
+    """
+    LlamaBackend(model_path, n_ctx=2048, n_threads=None, n_gpu_layers=0, system_prefix="", llm=None)
+    """
+    def __init__(self, model_path: str = "tinyllama-q4.gguf", n_ctx: int = 2048,
+                 n_threads: Optional[int] = None, n_gpu_layers: int = 0,
+                 system_prefix: str = "", llm=None):
+        if llm is None:
+            from llama_cpp import Llama
+            llm = Llama(
+                model_path=model_path,
+                n_ctx=n_ctx,
+                n_threads=n_threads,
+                n_gpu_layers=n_gpu_layers,
+                verbose=False,
+            )
+        self.llm = llm
+        self.n_ctx = n_ctx
+        self.tokens: List[int] = []  # sequence the KV cache currently holds (or will, after the next eval)
+        self.system_prefix = system_prefix
+        self.last_stats = {}
+
+    # ---- pinned prefix -----------------------------------------------------------
+    @property
+    def system_prefix(self) -> str:
+        return self._system_prefix
+
+    @system_prefix.setter
+    def system_prefix(self, text: str) -> None:
+        self._system_prefix = text or ""
+        self._prefix_tokens = self._tokenize(self._system_prefix, add_bos=True)
+        if len(self._prefix_tokens) >= self.n_ctx // 2:
+            raise ValueError(f"system prefix is {len(self._prefix_tokens)} tokens, n_ctx is {self.n_ctx}")
+
+    def _tokenize(self, text: str, add_bos: bool = False) -> List[int]:
+        return list(self.llm.tokenize(text.encode("utf-8"), add_bos=add_bos)) if text else []
+
+    # ---- window --------------------------------------------------------------------
+    def _fit(self, body: List[int], reserve: int) -> List[int]:
+        """
+        Pinned prefix + the tail of `body` that leaves `reserve` free slots. The cut
+        moves in steps of half the room, so a prompt that only grows at the end keeps
+        the same window start (and its cached KV) for many calls.
+        """
+        room = self.n_ctx - len(self._prefix_tokens) - reserve
+        if len(body) <= room:
+            return self._prefix_tokens + body
+        step = max(1, room // 2)
+        start = -(-(len(body) - room) // step) * step
+        return self._prefix_tokens + body[start:]
+
+    def _evict(self, tokens: List[int]) -> List[int]:
+        """
+        Keep the pinned prefix and the newest half of the rest.
+        """
+        body = tokens[len(self._prefix_tokens):]
+        return self._prefix_tokens + body[len(body) // 2:]
+
+    def _reused(self, tokens: List[int]) -> int:
+        # same rule as llama.generate(reset=True): the last token is always re-evaluated
+        n = 0
+        for a, b in zip(self.tokens, tokens[:-1]):
+            if a != b:
+                break
+            n += 1
+        return n
 
-# Silence all Metal/backend logging
-sys.stderr = open(os.devnull, "w")
+    # ---- generation ------------------------------------------------------------------
+    def stream(self, prompt: str, max_tokens: int = 512, temperature: float = 0.7, top_p: float = 0.9,
+               should_stop: Optional[Callable[[str], bool]] = None, stop_at_eos: bool = True,
+               continue_sequence: bool = False) -> Iterator[str]:
+        """
+        stream(prompt, max_tokens, ...) -> iterator of text deltas
 
-def main(prompt: str, target_tokens: int = 200):
-    llm = Llama(
+        `prompt` replaces everything after the pinned prefix (a leading copy of the
+        prefix is stripped); with `continue_sequence` it is appended to the current
+        sequence instead, so earlier output is never re-tokenized. With
+        `stop_at_eos=False` EOS is masked out and exactly `max_tokens` are produced.
+        Stats end up in `last_stats`.
+        """
+        if prompt.startswith(self._system_prefix):
+            prompt = prompt[len(self._system_prefix):]
+        if continue_sequence and self.tokens:
+            body = self.tokens[len(self._prefix_tokens):] + self._tokenize(prompt)
+        else:
+            body = self._tokenize(prompt)
+        reserve = min(max_tokens, (self.n_ctx - len(self._prefix_tokens)) // 2)
+        tokens = self._fit(body, reserve)
+
+        eos = self.llm.token_eos()
+        logits_processor = None
+        if not stop_at_eos:
+            def logits_processor(_input_ids, scores):
+                scores[eos] = -float("inf")
+                return scores
+
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        start = time.time()
+        first_token = None
+        prompt_tokens, reused = len(tokens), self._reused(tokens)
+        prefilled = len(tokens) - reused
+        produced, evictions = 0, 0
+        text = ""  # grown in place for should_stop
+        try:
+            while produced < max_tokens:
+                restart = False
+                for token in self.llm.generate(tokens, temp=temperature, top_p=top_p, reset=True,
+                                               logits_processor=logits_processor):
+                    if token == eos:
+                        return
+                    if first_token is None:
+                        first_token = time.time()
+                    tokens.append(token)
+                    produced += 1
+                    delta = decoder.decode(self.llm.detokenize([token]))
+                    if delta:
+                        yield delta
+                        if should_stop is not None:
+                            text += delta
+                            if should_stop(text):
+                                return
+                    if produced >= max_tokens:
+                        return
+                    if len(tokens) >= self.n_ctx:
+                        # window full: drop the oldest half after the prefix, resume from the prefix's cache
+                        tokens = self._evict(tokens)
+                        prefilled += len(tokens) - len(self._prefix_tokens)
+                        evictions += 1
+                        restart = True
+                        break
+                if not restart:
+                    return
+        finally:
+            self.tokens = list(tokens)
+            end = time.time()
+            decode_time = end - (first_token or end)
+            self.last_stats = {
+                "prompt_tokens": prompt_tokens,
+                "reused_tokens": reused,
+                "prefilled_tokens": prefilled,
+                "completion_tokens": produced,
+                "evictions": evictions,
+                "ttft": (first_token or end) - start,
+                "latency": end - start,
+                "tokens_per_sec": produced / decode_time if decode_time > 0 else 0.0,
+            }
+
+    def complete(self, prompt: str, max_tokens: int = 512, **kwargs) -> str:
+        return "".join(self.stream(prompt, max_tokens, **kwargs))
+
+    # ---- state -----------------------------------------------------------------------
+    def save(self, path: str) -> None:
+        """
+        Save the KV cache and token sequence so a new process continues without a prefill.
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"tokens": self.tokens, "state": self.llm.save_state()}, f)
+        os.replace(tmp, path)
+
+    def load(self, path: str) -> None:
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+        self.llm.load_state(saved["state"])
+        self.tokens = saved["tokens"]
+
+
+def main(prompt: str, target_tokens: int = 200, state_path: Optional[str] = None):
+    backend = LlamaBackend(
         model_path="tinyllama-q4.gguf",
-        n_gpu_layers=1,
-        use_metal=True,
-        chat_format="chatml",
-        verbose=False,     # no llama-cpp Python debug
-        n_ctx=2048,        # ensure full context window is available
+        n_ctx=2048,
+        system_prefix="<|im_start|>system\nYou are a super intelligence—share your wisdom.<|im_end|>\n",
     )
+    if state_path and os.path.exists(state_path):
+        backend.load(state_path)
+
+    print(f"⏳ Generating {target_tokens} tokens...\n")
+    user_turn = f"<|im_start|>user\n{prompt}<|im_end|>\n<|im_start|>assistant\n"
+    for delta in backend.stream(user_turn, target_tokens, stop_at_eos=False, continue_sequence=True):
+        print(delta, end="", flush=True)
 
-    messages = [
-        {"role": "system", "content": "You are a super intelligence—share your wisdom."},
-        {"role": "user",   "content": prompt}
-    ]
-    output = ""
-    generated = 0
-
-    print(f"⏳ Generating up to {target_tokens} tokens...\n")
-
-    while generated < target_tokens:
-        remaining = target_tokens - generated
-        response = llm.create_chat_completion(
-            messages=messages,
-            max_tokens=remaining,  # ask for exactly the leftover tokens
-            stop=None,             # no early stop sequences
-            temperature=0.7,
-            top_p=0.9,
-        )
-
-        # Extract the new text chunk
-        chunk = response["choices"][0]["message"]["content"]
-        if not chunk:
-            print("\n🚩 No more tokens generated; breaking out.")
-            break  # prevents infinite loop on empty chunk
-
-        # Print it immediately so we see progress
-        print(chunk, end="", flush=True)
-
-        # Update counters
-        # 1) parse reported usage
-        usage = response.get("usage", {})
-        out_toks = usage.get("completion_tokens")
-        if out_toks is None:
-            # fallback to manual token counting
-            out_toks = len(llm.tokenize(chunk))
-        generated += out_toks
-
-        # 2) append to context for coherent continuation
-        messages.append({"role": "assistant", "content": chunk})
-
-    print(f"\n\n✅ Done — generated {generated} tokens.")
+    stats = backend.last_stats
+    print(f"\n\n✅ Done — generated {stats['completion_tokens']} tokens "
+          f"at {stats['tokens_per_sec']:.1f} tok/s ({stats['evictions']} window eviction(s), "
+          f"{stats['prefilled_tokens']} tokens prefilled).")
+    if state_path:
+        backend.save(state_path)
 
 if __name__ == "__main__":
+    # Silence llama.cpp backend logging
+    sys.stderr = open(os.devnull, "w")
     user_prompt = "2 + 2 = "
     print(f"prompt: {user_prompt}\n")
     main(user_prompt, target_tokens=20000)
@@ -0,0 +1,208 @@
+"""
+hedging.py
+
+Tail-latency control for API calls, on top of ratelimit.py:
+  - a rolling latency window per (model, max_tokens bucket, phase), where phase is
+    "total" for plain completions and "ttft" (time to first token) for streams;
+  - a per-call deadline of HEDGE_TIMEOUT_MULTIPLIER * p99, sent as the request timeout
+    (for streams the SDK applies it to every read, so a stalled stream fails too);
+  - a hedged duplicate, optionally to HEDGE_FALLBACK_MODEL, once a call has waited
+    longer than the HEDGE_QUANTILE latency. The first answer wins; the other call
+    is cancelled (or closed as soon as it answers) and its tokens count as wasted.
+
+    response = hedged_create(client, "summary", est_tokens, model=..., messages=..., max_tokens=...)
+    stream, events = hedged_stream(client, "generation", est_tokens, model=..., ...)
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Optional
+
+from config import (
+    OPENAI_TIMEOUT_SEC,
+    HEDGE_REQUESTS,
+    HEDGE_FALLBACK_MODEL,
+    HEDGE_QUANTILE,
+    HEDGE_WINDOW,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_TIMEOUT_MULTIPLIER,
+    HEDGE_TIMEOUT_MIN_SEC,
+)
+from metrics import inc
+from ratelimit import get_rate_limiter, scheduled_create, scheduled_stream
+
+# since start: calls, calls that got a duplicate, duplicates that won, and prompt +
+# completion tokens of the cancelled side (timeouts are retried by ratelimit.py and
+# counted in api_retries_total{status="timeout"})
+hedge_stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "wasted_tokens": 0}
+_stats_lock = threading.Lock()
+
+
+class LatencyWindow:
+    """
+    The last `size` latencies per key; quantile() needs HEDGE_MIN_SAMPLES of them.
+    """
+    def __init__(self, size: int = HEDGE_WINDOW):
+        self.size = size
+        self._samples: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, key: tuple, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=self.size)).append(seconds)
+
+    def quantile(self, key: tuple, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+latencies = LatencyWindow()
+
+
+def latency_key(model: str, max_tokens: int, phase: str) -> tuple:
+    # max_tokens rounded up to a power of two, so calls of similar length share a window
+    return (model, 1 << max(0, int(max_tokens) - 1).bit_length(), phase)
+
+
+def call_timeout(key: tuple) -> float:
+    """
+    call_timeout(key) -> seconds: HEDGE_TIMEOUT_MULTIPLIER * p99, or OPENAI_TIMEOUT_SEC
+    until the window has enough samples.
+    """
+    p99 = latencies.quantile(key, 0.99)
+    if p99 is None:
+        return OPENAI_TIMEOUT_SEC
+    return min(OPENAI_TIMEOUT_SEC, max(HEDGE_TIMEOUT_MIN_SEC, HEDGE_TIMEOUT_MULTIPLIER * p99))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+        return _executor
+
+
+def _count(key: str, amount: int = 1) -> None:
+    with _stats_lock:
+        hedge_stats[key] += amount
+
+
+def _race(attempt: Callable, kwargs: dict, phase: str, priority: str, cancel: Callable):
+    """
+    attempt(kwargs, on_latency, on_send) with a deadline, plus a duplicate after the
+    hedge delay. Returns the first successful result; `cancel(result)` disposes of
+    the other one and returns how many tokens it wasted.
+
+    The hedge delay counts from when the primary's current attempt was sent (see
+    scheduled_create's on_send). Waiting for a pool worker, for the rate limiter or
+    in a retry's backoff is not the call being slow, and a duplicate would only
+    add load while the client is throttled; no hedge goes out while the limiter
+    is paused either.
+    """
+    model, max_tokens = kwargs["model"], kwargs.get("max_tokens", 0)
+    key = latency_key(model, max_tokens, phase)
+    kwargs = dict(kwargs, timeout=call_timeout(key))
+    hedge_after = latencies.quantile(key, HEDGE_QUANTILE) if HEDGE_REQUESTS else None
+    _count("calls")
+
+    def timed_attempt(kw: dict, on_send: Optional[Callable] = None):
+        # only successful attempts are sampled: retries and rate-limit waits would
+        # push the p99 (and with it the deadline) up after every slow call
+        observed = latency_key(kw["model"], max_tokens, phase)
+        return attempt(kw, lambda seconds: latencies.observe(observed, seconds), on_send)
+
+    if hedge_after is None:
+        return timed_attempt(kwargs)
+
+    clock = threading.Condition()
+    sent = [None]  # time.monotonic() when the primary's current attempt went out, None while it is not out
+
+    def on_send(stamp: Optional[float]) -> None:
+        with clock:
+            sent[0] = stamp
+            clock.notify_all()
+
+    limiter = get_rate_limiter()
+    primary = _pool().submit(timed_attempt, kwargs, on_send)
+    primary.add_done_callback(lambda _: on_send(None))
+    with clock:
+        while not primary.done():
+            if sent[0] is None:
+                clock.wait()
+                continue
+            left = max(sent[0] + hedge_after - time.monotonic(), limiter.paused_for())
+            if left <= 0:
+                break
+            clock.wait(left)
+    if primary.done():
+        return primary.result()
+    hedge = _pool().submit(timed_attempt, dict(kwargs, model=HEDGE_FALLBACK_MODEL or model))
+    _count("hedged")
+    inc("hedged_calls_total", priority=priority)
+
+    def dispose(future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            wasted = cancel(future.result())
+            _count("wasted_tokens", wasted)
+            inc("hedge_wasted_tokens_total", wasted, priority=priority)
+
+    pending, error = {primary, hedge}, None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = future.exception()
+                continue
+            for other in {primary, hedge} - {future}:
+                other.cancel()  # still waiting on the rate limiter: never sent
+                other.add_done_callback(dispose)
+            if future is hedge:
+                _count("hedge_wins")
+                inc("hedge_wins_total", priority=priority)
+            return future.result()
+    raise error
+
+
+def hedged_create(client, priority: str, est_tokens: int, **kwargs):
+    """
+    hedged_create(client, priority, est_tokens, **create_kwargs) -> completion
+
+    scheduled_create() with a latency-derived timeout and a hedged duplicate.
+    """
+    def cancel(response) -> int:
+        usage = getattr(response, "usage", None)
+        return usage.prompt_tokens + usage.completion_tokens if usage is not None else est_tokens
+
+    return _race(lambda kw, on_latency, on_send: scheduled_create(client, priority, est_tokens, on_latency,
+                                                                  on_send, **kw),
+                 kwargs, "total", priority, cancel)
+
+
+def hedged_stream(client, priority: str, est_tokens: int, **kwargs):
+    """
+    hedged_stream(client, priority, est_tokens, **create_kwargs) -> (stream, events)
+
+    scheduled_stream() raced on time to first token: the stream that produces
+    content first is returned, the other is closed.
+    """
+    prompt_tokens = max(0, est_tokens - kwargs.get("max_tokens", 0))
+
+    def cancel(opened) -> int:
+        opened[0].close()
+        # the prompt was processed and one token generated; the limiter charged est_tokens
+        get_rate_limiter().settle(est_tokens, prompt_tokens + 1)
+        return prompt_tokens + 1
+
+    return _race(lambda kw, on_latency, on_send: scheduled_stream(client, priority, est_tokens, on_latency,
+                                                                  on_send, **kw),
+                 kwargs, "ttft", priority, cancel)
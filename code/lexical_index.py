@@ -0,0 +1,393 @@
+"""
+lexical_index.py
+
+Append-only BM25 index over the raw text of evicted STM pieces, so exact names,
+dates and numbers stay recallable after their summary has paraphrased them away.
+memory_manager archives every piece it compresses and fuses search() hits with
+the vector store's (see MemoryManager._select_LTM).
+
+On disk:
+  - docs.jsonl    {"text", "metadata"} per document (row number = document id)
+  - ends.u64      byte offset just past each row of docs.jsonl (a row counts once this is written)
+  - lengths.u32   terms per document, for BM25 length normalization
+  - manifest.json the segments and the documents each covers
+  - <seg>.terms / <seg>.ptr / <seg>.post  one immutable segment: sorted int64 term hashes,
+    int64 offsets into the postings, and uint32 (document, term frequency) pairs
+
+New documents are indexed in RAM and written as a segment every LEXICAL_SEGMENT_DOCS;
+once LEXICAL_MERGE_FANOUT segments of the same size pile up they are merged into
+one, through a memory-mapped output file. Everything is opened as mmaps, so a query
+only touches the pages of the postings it reads; only the rarest LEXICAL_QUERY_TERMS
+terms of a query are scored, and never ones in more than LEXICAL_MAX_DF of the documents. Documents that were not in a segment yet when the
+process stopped are re-indexed from docs.jsonl on open.
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from config import (
+    LEXICAL_INDEX_DIR,
+    LEXICAL_SEGMENT_DOCS,
+    LEXICAL_MERGE_FANOUT,
+    LEXICAL_QUERY_TERMS,
+    LEXICAL_MAX_DF,
+    BM25_K1,
+    BM25_B,
+)
+from utils import ensure_dir_exists
+
+_TERM_RE = re.compile(r"\w+")
+_MERGE_CHUNK_POSTINGS = 1 << 20  # postings copied per step of a merge
+
+
+@lru_cache(maxsize=1 << 16)
+def _term_hash(term: str) -> int:
+    # stable across processes (unlike hash()), since it is stored on disk
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+
+def _term_counts(text: str) -> Dict[int, int]:
+    counts: Dict[int, int] = {}
+    for term in _TERM_RE.findall(text.lower()):
+        h = _term_hash(term)
+        counts[h] = counts.get(h, 0) + 1
+    return counts
+
+
+def _map(path: str, dtype, columns: int = 1, rows: int = None):
+    """
+    Read-only mmap of `path` as (rows, columns), or (rows,) for one column; `rows`
+    defaults to everything in the file.
+    """
+    if rows is None:
+        rows = os.path.getsize(path) // (np.dtype(dtype).itemsize * columns) if os.path.exists(path) else 0
+    shape = (rows,) if columns == 1 else (rows, columns)
+    if rows == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+
+class _Segment:
+    """
+    One immutable segment covering documents [start, end).
+    """
+    def __init__(self, directory: str, name: str, start: int, end: int):
+        self.name, self.start, self.end = name, start, end
+        self.paths = [os.path.join(directory, name + ext) for ext in (".terms", ".ptr", ".post")]
+        self.terms = _map(self.paths[0], np.int64)
+        self.ptr = _map(self.paths[1], np.int64)
+        self.post = _map(self.paths[2], np.uint32, columns=2)
+
+    @property
+    def docs(self) -> int:
+        return self.end - self.start
+
+    def find(self, h: int) -> int:
+        """
+        Row of term hash `h` in terms, or -1.
+        """
+        j = int(np.searchsorted(self.terms, h))
+        return j if j < len(self.terms) and self.terms[j] == h else -1
+
+
+def _write_segment(directory: str, name: str, terms: np.ndarray, ptr: np.ndarray, post: np.ndarray) -> None:
+    for ext, array in ((".terms", terms), (".ptr", ptr), (".post", post)):
+        array.tofile(os.path.join(directory, name + ext))
+
+
+class LexicalIndex:
+    """
+    Append-only BM25 index in `directory`. add() is meant for one writer thread
+    (flushes and merges run on it); search() can run concurrently.
+    """
+    def __init__(self, directory: str, segment_docs: int = LEXICAL_SEGMENT_DOCS,
+                 merge_fanout: int = LEXICAL_MERGE_FANOUT):
+        ensure_dir_exists(directory)
+        self.directory = directory
+        self.segment_docs = segment_docs
+        self.merge_fanout = merge_fanout
+        self.docs_path = os.path.join(directory, "docs.jsonl")
+        self.ends_path = os.path.join(directory, "ends.u64")
+        self.lengths_path = os.path.join(directory, "lengths.u32")
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self._lock = threading.Lock()        # segments, buffer and counts
+        self._write_lock = threading.Lock()  # one add / flush / merge at a time
+        self._open()
+
+    def _open(self) -> None:
+        for path in (self.docs_path, self.ends_path, self.lengths_path):
+            open(path, "ab").close()
+        # a crash mid-add can leave the files at different lengths; keep complete rows
+        n = min(os.path.getsize(self.ends_path) // 8, os.path.getsize(self.lengths_path) // 4)
+        ends = np.fromfile(self.ends_path, dtype=np.uint64, count=n)
+        n = int(np.searchsorted(ends, os.path.getsize(self.docs_path), side="right"))
+        for path, size in ((self.ends_path, 8 * n), (self.lengths_path, 4 * n),
+                           (self.docs_path, int(ends[n - 1]) if n else 0)):
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+        manifest = {"segments": [], "next": 0}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        self._next_segment = manifest["next"]
+        self.segments = [_Segment(self.directory, s["name"], s["start"], s["end"])
+                         for s in manifest["segments"] if s["end"] <= n]
+        # files of flushes / merges that never made it into the manifest
+        live = {os.path.basename(p) for s in self.segments for p in s.paths}
+        for name in os.listdir(self.directory):
+            if name.startswith("seg-") and name not in live:
+                os.remove(os.path.join(self.directory, name))
+
+        self._count = n
+        self._mapped = -1
+        self._map()
+        self._total_length = int(self._lengths.sum(dtype=np.int64)) if n else 0
+        # documents not in a segment yet: term hash -> ([document], [term frequency])
+        self._buffer: Dict[int, Tuple[List[int], List[int]]] = {}
+        self._buffer_start = self.segments[-1].end if self.segments else 0
+        if self._buffer_start < n:
+            for doc, row in zip(range(self._buffer_start, n), self._read_rows(range(self._buffer_start, n))):
+                self._buffer_add(doc, _term_counts(row["text"]))
+
+    # ==============================================================================
+    # 1) files
+    # ==============================================================================
+    def _map(self) -> None:
+        if self._mapped != self._count:
+            self._ends = _map(self.ends_path, np.uint64, rows=self._count)
+            self._lengths = _map(self.lengths_path, np.uint32, rows=self._count)
+            self._mapped = self._count
+
+    def _read_rows(self, docs) -> List[dict]:
+        out = []
+        with open(self.docs_path, "rb") as f:
+            for doc in docs:
+                f.seek(int(self._ends[doc - 1]) if doc else 0)
+                out.append(json.loads(f.readline()))
+        return out
+
+    def _write_manifest(self, segments: List[_Segment]) -> None:
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segments": [{"name": s.name, "start": s.start, "end": s.end} for s in segments],
+                       "next": self._next_segment}, f)
+        os.replace(tmp, self.manifest_path)
+
+    def _new_segment_name(self) -> str:
+        self._next_segment += 1
+        return f"seg-{self._next_segment:06d}"
+
+    # ==============================================================================
+    # 2) writes
+    # ==============================================================================
+    def count(self) -> int:
+        return self._count
+
+    def _buffer_add(self, doc: int, counts: Dict[int, int]) -> None:
+        for h, tf in counts.items():
+            docs, tfs = self._buffer.setdefault(h, ([], []))
+            docs.append(doc)
+            tfs.append(tf)
+
+    def add(self, texts: List[str], metadatas: List[dict] = None) -> List[int]:
+        """
+        add(texts, metadatas=None) -> document ids
+
+        Append documents; they are searchable as soon as this returns.
+        """
+        if metadatas is None:
+            metadatas = [{} for _ in texts]
+        counts = [_term_counts(text) for text in texts]
+        lines = [(json.dumps({"text": t, "metadata": m}, ensure_ascii=False) + "\n").encode("utf-8")
+                 for t, m in zip(texts, metadatas)]
+        with self._write_lock:
+            with open(self.docs_path, "ab") as f:
+                end = f.tell()
+                f.write(b"".join(lines))
+            ends = np.cumsum([len(line) for line in lines], dtype=np.uint64) + np.uint64(end)
+            lengths = np.asarray([sum(c.values()) for c in counts], dtype=np.uint32)
+            # lengths before ends: rows only count once their end offset is written
+            with open(self.lengths_path, "ab") as f:
+                f.write(lengths.tobytes())
+            with open(self.ends_path, "ab") as f:
+                f.write(ends.tobytes())
+
+            with self._lock:
+                first = self._count
+                for doc, c in enumerate(counts, first):
+                    self._buffer_add(doc, c)
+                self._count += len(texts)
+                self._total_length += int(lengths.sum(dtype=np.int64))
+            if self._count - self._buffer_start >= self.segment_docs:
+                self._flush()
+        return list(range(first, first + len(texts)))
+
+    def _flush(self) -> None:
+        """
+        Write the buffered documents as a new segment, then merge if a tier is full.
+        """
+        with self._lock:
+            buffer, start, end = self._buffer, self._buffer_start, self._count
+        terms = np.asarray(sorted(buffer), dtype=np.int64)
+        sizes = np.asarray([len(buffer[h][0]) for h in terms.tolist()], dtype=np.int64)
+        ptr = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+        post = np.empty((int(ptr[-1]), 2), dtype=np.uint32)
+        for j, h in enumerate(terms.tolist()):
+            docs, tfs = buffer[h]
+            post[ptr[j]:ptr[j + 1], 0] = docs
+            post[ptr[j]:ptr[j + 1], 1] = tfs
+        name = self._new_segment_name()
+        _write_segment(self.directory, name, terms, ptr, post)
+
+        segment = _Segment(self.directory, name, start, end)
+        with self._lock:
+            self._write_manifest(self.segments + [segment])
+            self.segments = self.segments + [segment]
+            # documents added meanwhile would be in buffer too; there are none (one writer)
+            self._buffer, self._buffer_start = {}, end
+        self._merge()
+
+    def _level(self, segment: _Segment) -> int:
+        level, size = 0, self.segment_docs * self.merge_fanout
+        while segment.docs >= size:
+            level, size = level + 1, size * self.merge_fanout
+        return level
+
+    def _merge(self) -> None:
+        """
+        While the newest merge_fanout segments share a size tier, merge them into one.
+        """
+        while len(self.segments) >= self.merge_fanout:
+            group = self.segments[-self.merge_fanout:]
+            if len({self._level(s) for s in group}) != 1:
+                return
+            merged = self._merge_segments(group)
+            with self._lock:
+                segments = self.segments[:-self.merge_fanout] + [merged]
+                self._write_manifest(segments)
+                self.segments = segments
+            for segment in group:
+                segment.terms = segment.ptr = segment.post = None  # drop the mmaps first
+                for path in segment.paths:
+                    os.remove(path)
+
+    def _merge_segments(self, group: List[_Segment]) -> _Segment:
+        """
+        One segment with the postings of `group` (consecutive, oldest first). Postings
+        are copied per term block into a memory-mapped output, at most
+        _MERGE_CHUNK_POSTINGS at a time, so a merge never holds its inputs in RAM.
+        """
+        terms = np.unique(np.concatenate([np.asarray(s.terms) for s in group]))
+        where = [np.searchsorted(terms, s.terms) for s in group]
+        sizes = np.zeros(len(terms), dtype=np.int64)
+        for s, rows in zip(group, where):
+            sizes[rows] += np.diff(s.ptr)
+        ptr = np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+
+        name = self._new_segment_name()
+        path = os.path.join(self.directory, name + ".post")
+        total = int(ptr[-1])
+        with open(path, "wb") as f:
+            f.truncate(total * 8)
+        if total:
+            post = np.memmap(path, dtype=np.uint32, mode="r+", shape=(total, 2))
+            filled = ptr[:-1].copy()  # next free slot per term; older segments first keeps documents sorted
+            for s, rows in zip(group, where):
+                a = 0
+                while a < len(s.terms):
+                    b = max(a + 1, int(np.searchsorted(s.ptr, s.ptr[a] + _MERGE_CHUNK_POSTINGS, side="right")) - 1)
+                    b = min(b, len(s.terms))
+                    lengths = np.diff(s.ptr[a:b + 1])
+                    block_start = np.repeat(s.ptr[a:b] - s.ptr[a], lengths)
+                    dest = np.repeat(filled[rows[a:b]], lengths) + np.arange(int(lengths.sum())) - block_start
+                    post[dest] = s.post[s.ptr[a]:s.ptr[b]]
+                    filled[rows[a:b]] += lengths
+                    a = b
+            post.flush()
+            del post
+        terms.tofile(os.path.join(self.directory, name + ".terms"))
+        ptr.tofile(os.path.join(self.directory, name + ".ptr"))
+        return _Segment(self.directory, name, group[0].start, group[-1].end)
+
+    # ==============================================================================
+    # 3) search
+    # ==============================================================================
+    def search(self, query: str, k: int = 10, max_terms: int = LEXICAL_QUERY_TERMS,
+               max_df: float = LEXICAL_MAX_DF) -> dict:
+        """
+        search(query, k=10) -> {"ids", "documents", "metadatas", "scores"}, best BM25 first
+
+        Only the `max_terms` query terms with the fewest documents are scored, leaving
+        out those in more than `max_df` of all documents (unless that is all of them):
+        common words barely move BM25 but have the longest postings.
+        """
+        out = {"ids": [], "documents": [], "metadatas": [], "scores": []}
+        with self._lock:
+            n = self._count
+            if n == 0:
+                return out
+            self._map()
+            sources = []  # (df, [(documents, term frequencies)]) per query term
+            for h in set(_term_counts(query)):
+                postings = []
+                for s in self.segments:
+                    j = s.find(h)
+                    if j >= 0:
+                        block = s.post[s.ptr[j]:s.ptr[j + 1]]
+                        postings.append((block[:, 0], block[:, 1]))
+                if h in self._buffer:
+                    docs, tfs = self._buffer[h]
+                    postings.append((np.asarray(docs, dtype=np.uint32), np.asarray(tfs, dtype=np.uint32)))
+                if postings:
+                    sources.append((sum(len(d) for d, _ in postings), postings))
+            if not sources:
+                return out
+            sources.sort(key=lambda source: source[0])
+            sources = [source for source in sources if source[0] <= max_df * n] or sources[:1]
+
+            avg_length = self._total_length / n
+            doc_parts, score_parts = [], []
+            for df, postings in sources[:max_terms]:
+                idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+                docs = np.concatenate([d for d, _ in postings])
+                tfs = np.concatenate([t for _, t in postings]).astype(np.float32)
+                norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._lengths[docs].astype(np.float32) / avg_length)
+                doc_parts.append(docs)
+                score_parts.append(idf * tfs * (BM25_K1 + 1.0) / (tfs + norm))
+            docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            k = min(k, len(docs))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            rows = self._read_rows(docs[top].tolist())
+
+        out["ids"] = docs[top].tolist()
+        out["documents"] = [r["text"] for r in rows]
+        out["metadatas"] = [r["metadata"] for r in rows]
+        out["scores"] = scores[top].tolist()
+        return out
+
+
+_archives = {}  # namespace -> LexicalIndex; None is the single-loop default
+_archives_lock = threading.Lock()
+
+
+def get_archive(namespace: str = None) -> LexicalIndex:
+    """
+    The archive of the `namespace` (one per session, like the vector collections).
+    """
+    with _archives_lock:
+        archive = _archives.get(namespace)
+        if archive is None:
+            name = "archive" if namespace is None else f"archive-{namespace}"
+            archive = _archives[namespace] = LexicalIndex(os.path.join(LEXICAL_INDEX_DIR, name))
+        return archive
@@ -1,26 +1,343 @@
+"""
+logger.py
+
+Stream log for generated text. Entries are handed to a dedicated writer thread
+through a bounded queue; the writer keeps one file handle open, applies the
+LOG_FSYNC_POLICY, rotates logs/stream.txt by size/age (optionally compressing
+closed segments) and maintains an offset index so a tool can jump straight to
+any iteration:
+
+  logs/stream.index.jsonl
+    {"iteration": 12, "segment": 3, "offset": 10234}   # entry start, uncompressed bytes
+    {"segment": 3, "file": "stream.3.txt.gz"}           # segment 3 was closed
+
+Every `session` (see runner.py) gets its own writer, stream and index under
+logs/<session>/; session=None is the single-loop stream above.
+"""
+
+import atexit
+import gzip
+import json
 import os
+import queue
+import shutil
+import threading
+import time
 from datetime import datetime
-from config import LOG_DIR, STREAM_LOG_FILE
+from typing import Iterable, Optional, Tuple
+from config import (
+    LOG_DIR,
+    STREAM_LOG_FILE,
+    LOG_INDEX_FILE,
+    LOG_BUFFER_ENTRIES,
+    LOG_FSYNC_POLICY,
+    LOG_FSYNC_INTERVAL_SEC,
+    LOG_ROTATE_BYTES,
+    LOG_ROTATE_SEC,
+    LOG_COMPRESSION,
+)
 from utils import ensure_dir_exists
+from metrics import timed
 
 
 ensure_dir_exists(LOG_DIR)
 
-def log_text(text: str) -> None:
-    from datetime import datetime
-    now = datetime.now()
-    time_str = now.strftime("%I:%M%p").lower()
-    day_str = now.strftime("%m-%d")
+# ==============================================================================
+# 1) timestamps (formatted once per minute)
+# ==============================================================================
+_stamp_minute = None
+_stamp = ""
+
+def _time_and_date() -> str:
+    global _stamp_minute, _stamp
+    minute = int(time.time() // 60)
+    if minute != _stamp_minute:
+        now = datetime.now()
+        time_str = now.strftime("%I:%M%p").lower()
+        day_str = now.strftime("%m-%d")
+        _stamp, _stamp_minute = f"time: {time_str}\nday: {day_str}\n", minute
+    return _stamp
+
+# ==============================================================================
+# 2) writer thread
+# ==============================================================================
+_START, _DATA, _FLUSH, _CLOSE = range(4)
+
+
+class LogWriter:
+    """
+    Owns the active segment (STREAM_LOG_FILE) and the offset index.
+    Only the writer thread touches the files; callers just enqueue.
+    """
+    def __init__(self, path: str = STREAM_LOG_FILE, index_path: str = LOG_INDEX_FILE):
+        self.path = path
+        self.index_path = index_path
+        self._queue = queue.Queue(maxsize=LOG_BUFFER_ENTRIES)
+        self._segment = self._last_segment()
+        self._file = open(self.path, "ab")
+        self._index = open(self.index_path, "a", encoding="utf-8")
+        self._offset = self._file.tell()
+        self._opened_at = time.time()
+        self._last_fsync = time.time()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def _last_segment(self) -> int:
+        # segment ids keep counting across restarts; the active file is the newest one
+        segment = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line
+                    segment = max(segment, record.get("segment", 0) + ("file" in record))
+        return segment
+
+    # ---- caller side ------------------------------------------------------------
+    def start_entry(self, header: str, iteration: Optional[int]) -> None:
+        self._queue.put((_START, header.encode("utf-8"), iteration))
+
+    def write(self, text: str) -> None:
+        self._queue.put((_DATA, text.encode("utf-8"), None))
+
+    def flush(self) -> None:
+        """
+        Block until everything queued so far is written (and fsynced).
+        """
+        done = threading.Event()
+        self._queue.put((_FLUSH, None, done))
+        done.wait()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            self._queue.put((_CLOSE, None, None))
+            self._thread.join()
+
+    # ---- writer side ------------------------------------------------------------
+    def _run(self) -> None:
+        while True:
+            kind, data, extra = self._queue.get()
+            if kind == _START:
+                self._maybe_rotate()
+                if extra is not None:
+                    self._index.write(json.dumps({"iteration": extra, "segment": self._segment, "offset": self._offset}) + "\n")
+                self._write(data)
+            elif kind == _DATA:
+                self._write(data)
+            elif kind == _FLUSH:
+                self._sync(force=True)
+                extra.set()
+                continue
+            else:
+                self._sync(force=True)
+                self._file.close()
+                self._index.close()
+                return
+
+            if LOG_FSYNC_POLICY == "always":
+                self._sync(force=True)
+            elif self._queue.empty():
+                # idle: make the text visible to `tail -f`, fsync on the interval policy
+                self._sync(force=False)
+
+    def _write(self, data: bytes) -> None:
+        self._file.write(data)
+        self._offset += len(data)
+
+    def _sync(self, force: bool) -> None:
+        self._file.flush()
+        self._index.flush()
+        now = time.time()
+        due = LOG_FSYNC_POLICY == "interval" and now - self._last_fsync >= LOG_FSYNC_INTERVAL_SEC
+        if (force and LOG_FSYNC_POLICY != "never") or due:
+            with timed("log_fsync"):
+                os.fsync(self._file.fileno())
+                os.fsync(self._index.fileno())
+            self._last_fsync = now
+
+    def _maybe_rotate(self) -> None:
+        too_big = LOG_ROTATE_BYTES and self._offset >= LOG_ROTATE_BYTES
+        too_old = LOG_ROTATE_SEC and time.time() - self._opened_at >= LOG_ROTATE_SEC
+        if not (too_big or too_old) or self._offset == 0:
+            return
+        self._sync(force=True)
+        self._file.close()
+
+        root, ext = os.path.splitext(self.path)
+        closed = f"{root}.{self._segment}{ext}"
+        os.replace(self.path, closed)
+        if LOG_COMPRESSION:
+            final = f"{closed}.{'zst' if LOG_COMPRESSION == 'zstd' else 'gz'}"
+            threading.Thread(target=_compress, args=(closed, final), daemon=True).start()
+        else:
+            final = closed
+        self._index.write(json.dumps({"segment": self._segment, "file": os.path.basename(final)}) + "\n")
+
+        self._segment += 1
+        self._file = open(self.path, "ab")
+        self._offset = 0
+        self._opened_at = time.time()
 
-    time_and_date = f"time: {time_str}\nday: {day_str}\n"
 
-    # Save to file
-    with open(STREAM_LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(time_and_date + "\n" + text + "\n\n")
+def _compress(src: str, dst: str) -> None:
+    """
+    Compress a closed segment to `dst` (.zst needs the optional `zstandard` package).
+    """
+    tmp = dst + ".tmp"
+    if dst.endswith(".zst"):
+        import zstandard
+        with open(src, "rb") as fin, open(tmp, "wb") as fout:
+            zstandard.ZstdCompressor().copy_stream(fin, fout)
+    else:
+        with open(src, "rb") as fin, gzip.open(tmp, "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+    os.replace(tmp, dst)
+    os.remove(src)
+
+
+def session_log_paths(session: Optional[str] = None) -> Tuple[str, str]:
+    """
+    session_log_paths(session) -> (stream path, index path)
+    """
+    if session is None:
+        return STREAM_LOG_FILE, LOG_INDEX_FILE
+    directory = os.path.join(LOG_DIR, session)
+    return (os.path.join(directory, os.path.basename(STREAM_LOG_FILE)),
+            os.path.join(directory, os.path.basename(LOG_INDEX_FILE)))
+
+
+_writers = {}  # session -> LogWriter
+_writer_lock = threading.Lock()
+
+def _get_writer(session: Optional[str] = None) -> LogWriter:
+    with _writer_lock:
+        writer = _writers.get(session)
+        if writer is None:
+            path, index_path = session_log_paths(session)
+            ensure_dir_exists(os.path.dirname(path))
+            writer = _writers[session] = LogWriter(path, index_path)
+            atexit.register(writer.close)
+        return writer
+
+def flush_log() -> None:
+    """
+    flush_log() -> None
+
+    Wait until every queued log entry (of every session) is on disk.
+    """
+    with _writer_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.flush()
+
+# ==============================================================================
+# 3) public logging API
+# ==============================================================================
+@timed("logging")
+def log_text(text: str, iteration: Optional[int] = None, session: Optional[str] = None) -> None:
+    time_and_date = _time_and_date()
+
+    # Save to file (on the writer thread)
+    writer = _get_writer(session)
+    writer.start_entry(time_and_date + "\n", iteration)
+    writer.write(text + "\n\n")
+    if session is not None:
+        return  # sessions share the terminal: only their own log gets the text
 
     # Print cleanly to terminal
     print(text.strip())      # ✅ Prints your log content
     print("=" * 40)
     print(time_and_date)     # ✅ Prints on two lines
-    
 
+def log_stream(deltas: Iterable[str], iteration: Optional[int] = None, session: Optional[str] = None) -> str:
+    """
+    log_stream(deltas, iteration=None, session=None) -> str
+
+    Same entry layout as log_text, but each delta is written (and printed) as soon as
+    it arrives instead of after the whole completion. Returns the joined text.
+    """
+    time_and_date = _time_and_date()
+    parts = []
+
+    writer = _get_writer(session)
+    writer.start_entry(time_and_date + "\n", iteration)
+    for delta in deltas:
+        writer.write(delta)
+        if session is None:
+            print(delta, end="", flush=True)
+        parts.append(delta)
+    writer.write("\n\n")
+    if session is not None:
+        return "".join(parts)
+
+    print()
+    print("=" * 40)
+    print(time_and_date)
+    return "".join(parts)
+
+def log_note(text: str, session: Optional[str] = None) -> None:
+    """
+    log_note(text, session=None) -> None
+
+    Append `text` to the latest entry of the stream log, e.g. a remark about output
+    that was already streamed. No new index entry: the iteration still starts where
+    its text does.
+    """
+    _get_writer(session).write(text + "\n\n")
+
+# ==============================================================================
+# 4) random access for tools
+# ==============================================================================
+def find_iteration(iteration: int, index_path: str = LOG_INDEX_FILE) -> Optional[Tuple[str, int, Optional[int]]]:
+    """
+    find_iteration(iteration) -> (segment_path, start, end) or None
+
+    Offsets are in uncompressed bytes; `end` is None for the last entry of a segment.
+    If an iteration was logged more than once, the latest entry wins.
+    """
+    location, files = None, {}
+    with open(index_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line
+            if "file" in record:
+                files[record["segment"]] = record["file"]
+            elif record["iteration"] == iteration:
+                location = [record["segment"], record["offset"], None]
+            elif location is not None and location[2] is None and record["segment"] == location[0]:
+                location[2] = record["offset"]
+    if location is None:
+        return None
+    segment, start, end = location
+    directory = os.path.dirname(index_path)
+    path = os.path.join(directory, files.get(segment, os.path.basename(STREAM_LOG_FILE)))
+    return path, start, end
+
+def _open_segment(path: str):
+    if not os.path.exists(path) and path.endswith((".gz", ".zst")):
+        path = path.rsplit(".", 1)[0]  # compression still running: the plain file is there
+    if path.endswith(".zst"):
+        import zstandard
+        return zstandard.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+def read_iteration(iteration: int, index_path: str = LOG_INDEX_FILE) -> Optional[str]:
+    """
+    read_iteration(iteration) -> str or None
+
+    Text of one logged entry, read by seeking instead of scanning the log.
+    """
+    found = find_iteration(iteration, index_path)
+    if found is None:
+        return None
+    path, start, end = found
+    with _open_segment(path) as f:
+        f.seek(start)  # compressed segments decompress up to here, never the whole run
+        data = f.read() if end is None else f.read(end - start)
+    return data.decode("utf-8", errors="replace").rstrip("\n")
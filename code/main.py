@@ -10,145 +10,474 @@ Infinite loop that:
 """
 # ==============================================================================
 # ==============================================================================
-from openai import OpenAI
-client = OpenAI()
 import time
 from config import (
-    OPENAI_API_KEY,
     INFINITE_MODEL,
+    GENERATION_BACKEND,
     SUMMARIZE_THRESHOLD_TOKENS,
     API_CALL_SLEEP_SEC,
+    STREAM_GENERATION,
+    PIPELINE_ITERATIONS,
+    REPETITION_DETECTION,
+    OUTPUT_LENGTH_POLICY,
+    CONTEXT_LAYOUT,
+    OPENAI_WARMUP_CONNECTIONS,
+    INPUT_COST_PER_TOKEN,
+    CACHED_INPUT_COST_PER_TOKEN,
+    OUTPUT_COST_PER_TOKEN,
+    COST_CAP_USD,
     INITIAL_PROMPT, 
     RAND_POOL,
     DEFAULT_CONTINOUS_PROMPT,
 )
 import random
 from memory_manager import MemoryManager
-from logger import log_text
-import tiktoken
+from checkpoint import Checkpointer, load_checkpoint
+from metrics import timed, inc, observe, set_gauge, collect_durations, stage_durations, start_exporter, export_metrics
+from vector_store import cache_stats, flush_vector_store
+from logger import log_text, log_stream, log_note, flush_log
+from utils import count_tokens
+from clients import get_openai_client, get_llama_backend, warm_up
+from hedging import hedged_create, hedged_stream, hedge_stats
+from ratelimit import get_rate_limiter
+from repetition import RepetitionDetector
+from output_length import OutputLengthScheduler
 import sys
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
 # ==============================================================================
-# 1) init OpenAI & memory manager
+# 1) memory manager, created on first use like the OpenAI client (see clients.py):
+#    importing this module (runner.py does) starts no compression thread
 # ==============================================================================
-OpenAI.api_key = OPENAI_API_KEY
-memory = MemoryManager()
+memory: Optional[MemoryManager] = None
+
+def get_memory() -> MemoryManager:
+    global memory
+    if memory is None:
+        memory = MemoryManager()
+    return memory
 # ==============================================================================
-# 2) prompt
 # ==============================================================================
-memory.add_to_STM(INITIAL_PROMPT)
+# timing/usage of the most recent generation call (see _record_generation)
+last_generation_stats = {}
+
+def _cached_tokens(usage) -> int:
+    """
+    Prompt tokens the provider served from its prompt cache (0 if not reported).
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+def _record_generation(start: float, first_token: float, end: float,
+                       prompt_tokens: int, completion_tokens: int, stopped_early: bool = False,
+                       cached_tokens: int = 0, stats: Optional[dict] = None) -> None:
+    """
+    _record_generation(...) -> None
+
+    Store time-to-first-token, decode tokens/sec, total latency and prompt-cache
+    hits for the last call in `stats` (default: last_generation_stats).
+    """
+    if stats is None:
+        stats = last_generation_stats
+    decode_time = end - first_token
+    stats.clear()
+    stats.update(
+        ttft=first_token - start,
+        latency=end - start,
+        tokens_per_sec=completion_tokens / decode_time if decode_time > 0 else 0.0,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens,
+        stopped_early=stopped_early,
+    )
+
+def generation_cost(input_tokens: int, cached_tokens: int, output_tokens: int) -> float:
+    """
+    generation_cost(input_tokens, cached_tokens, output_tokens) -> USD
+
+    `cached_tokens` is the part of `input_tokens` billed at the cached-input rate.
+    The local llama backend is free.
+    """
+    if GENERATION_BACKEND == "llama":
+        return 0.0
+    return ((input_tokens - cached_tokens) * INPUT_COST_PER_TOKEN
+            + cached_tokens * CACHED_INPUT_COST_PER_TOKEN
+            + output_tokens * OUTPUT_COST_PER_TOKEN)
+
+def with_token_note(context: str, max_tokens: int) -> str:
+    return (
+        context +
+        f"\n(Note: You may use up to {max_tokens} tokens for this response. Use them all)"
+    )
+
+def repetition_guard(memory: MemoryManager) -> Optional[RepetitionDetector]:
+    """
+    A `should_stop` that cuts degenerate generations, checked against `memory`
+    (None when REPETITION_DETECTION is off).
+    """
+    return RepetitionDetector(memory.reference_shingles()) if REPETITION_DETECTION else None
+
+def trim_repetition(text: str, detector: Optional[RepetitionDetector], session: Optional[str] = None,
+                    logged: bool = False) -> str:
+    """
+    trim_repetition(text, detector, session=None, logged=False) -> text without its repeated tail
+
+    Also scans whatever the detector was not fed while streaming (all of `text`
+    for a non-streamed call), and records the event. With `logged` (the text was
+    streamed to the log, tail included) a marker with the cut offset is appended
+    to that log entry.
+    """
+    if detector is None or not detector(text):
+        return text
+    kept, tail = text[:detector.trim_at], text[detector.trim_at:]
+    trimmed_tokens = count_tokens(tail)
+    labels = {"session": session} if session else {}
+    inc("repetition_stops_total", **labels)
+    inc("repetition_trimmed_tokens_total", trimmed_tokens, **labels)
+    print(f"🔁 Repetition detected: trimmed {trimmed_tokens} tokens, kept {len(kept.split())} words")
+    if logged:
+        log_note(f"[repetition: trimmed at character {detector.trim_at}, "
+                 f"{trimmed_tokens} tokens after it were not added to memory]", session)
+    return kept
+
+def plan_iteration(iteration: int) -> dict:
+    """
+    plan_iteration(iteration) -> dict
+
+    Everything `iteration` needs before its API call that does not depend on the
+    previous completion: the prompt, the LTM probe (every other
+    iteration) and the context skeleton (MemoryManager.prefetch_context). With
+    PIPELINE_ITERATIONS it runs while the previous iteration is still generating.
+    """
+    randomized = random.randint(1, 2) == 1
+    system_msg = random.choice(RAND_POOL) if randomized else DEFAULT_CONTINOUS_PROMPT
+    memory = get_memory()
+    with timed("context_prefetch"):
+        probe = None
+        if iteration % 2 == 0:
+            probe = memory.retrieve_relevant_LTM("find something random/ unexpected from ltm", top_k=3)
+        skeleton = memory.prefetch_context(user_prompt=system_msg)
+    return {"system_msg": system_msg, "randomized": randomized, "probe": probe, "skeleton": skeleton}
 # ==============================================================================
 # ==============================================================================
-def generate_next_chunk(context: str, max_tokens: int = 512, temperature: float = 0.9) -> str:
+def stream_next_chunk(
+    context: str,
+    max_tokens: int = 512,
+    temperature: float = 0.9,
+    should_stop: Optional[Callable[[str], bool]] = None,
+    stats: Optional[dict] = None,
+) -> Iterator[str]:
     """
-    Generates the next chunk of tokens using OpenAI's Chat API (v1.0+).
+    Yields the next chunk as text deltas while the completion streams in.
+
+    `should_stop(text_so_far)` is checked after every delta; returning True closes the
+    HTTP stream so the rest of the response is never generated. Usage and timings end
+    up in `stats` (default: last_generation_stats) once the generator is exhausted.
+    The rate limiter charged prompt + max_tokens up front; the difference is
+    refunded from the usage event, or from local counts when the stream is cut.
     """
-    response = client.chat.completions.create(
+    start = time.time()
+    first_token = None
+    prompt_tokens = completion_tokens = None
+    cached_tokens = 0
+    stopped_early = False
+    parts = []
+    text_so_far = ""  # grown in place, so should_stop costs no re-join per delta
+    est_tokens = len(context) // 4 + max_tokens
+
+    # returns once content arrives; a slow start is hedged (see hedging.py)
+    stream, events = hedged_stream(
+        get_openai_client("generation"), "generation",
+        est_tokens=est_tokens,
+        model=INFINITE_MODEL,
+        messages=[{"role": "user", "content": context}],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream_options={"include_usage": True},
+    )
+    try:
+        for event in events:
+            if event.usage is not None:  # final event carries usage and no choices
+                prompt_tokens = event.usage.prompt_tokens
+                completion_tokens = event.usage.completion_tokens
+                cached_tokens = _cached_tokens(event.usage)
+            if not event.choices:
+                continue
+            delta = event.choices[0].delta.content
+            if not delta:
+                continue
+            if first_token is None:
+                first_token = time.time()
+            parts.append(delta)
+            yield delta
+            if should_stop is not None:
+                text_so_far += delta
+                if should_stop(text_so_far):
+                    stopped_early = True
+                    break
+    finally:
+        stream.close()
+        end = time.time()
+        # a cancelled stream never receives the usage event, so count locally
+        if prompt_tokens is None:
+            prompt_tokens = count_tokens(context)
+        if completion_tokens is None:
+            completion_tokens = count_tokens("".join(parts))
+        get_rate_limiter().settle(est_tokens, prompt_tokens + completion_tokens)
+
+    _record_generation(start, first_token or end, end, prompt_tokens, completion_tokens, stopped_early,
+                       cached_tokens, stats)
+# ==============================================================================
+# ==============================================================================
+def local_stream_next_chunk(
+    context: str,
+    max_tokens: int = 512,
+    temperature: float = 0.9,
+    should_stop: Optional[Callable[[str], bool]] = None,
+    stats: Optional[dict] = None,
+) -> Iterator[str]:
+    """
+    stream_next_chunk() for GENERATION_BACKEND = "llama": the local model keeps its
+    KV cache between calls, so only the part of `context` that changed since the
+    last call is prefilled. Reused tokens are reported as cached tokens.
+    """
+    backend = get_llama_backend()
+    yield from backend.stream(context, max_tokens, temperature=temperature, should_stop=should_stop)
+    local = backend.last_stats
+    start = time.time() - local["latency"]
+    inc("llama_evictions_total", local["evictions"])
+    _record_generation(start, start + local["ttft"], start + local["latency"], local["prompt_tokens"],
+                       local["completion_tokens"], cached_tokens=local["reused_tokens"], stats=stats)
+# ==============================================================================
+# ==============================================================================
+def generate_next_chunk(
+    context: str,
+    max_tokens: int = 512,
+    temperature: float = 0.9,
+    stream: bool = STREAM_GENERATION,
+    should_stop: Optional[Callable[[str], bool]] = None,
+    iteration: Optional[int] = None,
+    session: Optional[str] = None,
+    stats: Optional[dict] = None,
+) -> tuple:
+    """
+    Generates the next chunk of tokens using OpenAI's Chat API (v1.0+), or the local
+    llama.cpp model when GENERATION_BACKEND is "llama".
+
+    With `stream` the deltas are written to the stream log (of `session`, if given)
+    as they arrive, so the caller must not log the text again, and `should_stop` can
+    cut the response short. Timings go to `stats` (default: last_generation_stats).
+    """
+    if stats is None:
+        stats = last_generation_stats
+    if GENERATION_BACKEND == "llama":
+        deltas = local_stream_next_chunk(context, max_tokens, temperature, should_stop, stats)
+        content = log_stream(deltas, iteration, session) if stream else "".join(deltas)
+        return content, stats["prompt_tokens"], stats["completion_tokens"]
+    if stream:
+        deltas = stream_next_chunk(context, max_tokens, temperature, should_stop, stats)
+        content = log_stream(deltas, iteration, session)
+        return content, stats["prompt_tokens"], stats["completion_tokens"]
+
+    start = time.time()
+    response = hedged_create(
+        get_openai_client("generation"), "generation",
+        est_tokens=len(context) // 4 + max_tokens,
         model=INFINITE_MODEL,
         messages=[{"role": "user", "content": context}],
         temperature=temperature,
         max_tokens=max_tokens
     )
+    end = time.time()
     content = response.choices[0].message.content
     usage = response.usage  # contains input/output token counts
+    # without streaming the first token only shows up with the last one
+    _record_generation(start, end, end, usage.prompt_tokens, usage.completion_tokens,
+                       cached_tokens=_cached_tokens(usage), stats=stats)
     return content, usage.prompt_tokens, usage.completion_tokens
 # ==============================================================================
 # ==============================================================================
-def main_loop():
+def main_loop(resume: bool = False, pipeline: bool = PIPELINE_ITERATIONS,
+              output_length: str = OUTPUT_LENGTH_POLICY):
     """
+    0. Seed STM with INITIAL_PROMPT (or restore the last checkpoint with `resume`)
     1. Build the current context (LTM summaries + STM_buffer)
     2. Generate the next chunk from GPT
     3. Add generated text to STM
     4. Log it
     5. Sleep a bit to respect rate limits
     6. Repeat forever
+
+    With `pipeline`, the next iteration's plan_iteration() runs on a prefetch thread
+    during step 2, so step 1 of the next iteration only packs the new STM tail.
+    `output_length` is the max_tokens policy (see output_length.py).
     """
     # token tracking
     TOTAL_INPUT_TOKENS = 0
     TOTAL_OUTPUT_TOKENS = 0
-
-    # Pricing per million tokens for gpt-4.1-nano
-    INPUT_COST = 0.10 / 1_000_000
-    OUTPUT_COST = 0.40 / 1_000_000
+    TOTAL_CACHED_TOKENS = 0  # subset of TOTAL_INPUT_TOKENS served from the prompt cache
     iteration = 0
+    memory = get_memory()
 
-    while True:
-        start = time.time()
+    # 0) prompt -- or pick up exactly where the last checkpoint left off
+    if CONTEXT_LAYOUT == "cache":
+        memory.pinned_prefix = INITIAL_PROMPT  # stays first in every context
+    state = load_checkpoint() if resume else None
+    if state is not None:
+        memory.restore(state["memory"])
+        iteration = state["iteration"]
+        TOTAL_INPUT_TOKENS = state["counters"]["input_tokens"]
+        TOTAL_OUTPUT_TOKENS = state["counters"]["output_tokens"]
+        TOTAL_CACHED_TOKENS = state["counters"].get("cached_tokens", 0)
+        print(f"♻️  Resumed at iteration {iteration} | STM: {memory.STM_token_count} tokens | LTM: {len(memory.LTM_index)} summaries")
+    else:
+        if resume:
+            print("♻️  No checkpoint found, starting from INITIAL_PROMPT")
+        if CONTEXT_LAYOUT != "cache":
+            memory.add_to_STM(INITIAL_PROMPT)
+    checkpointer = Checkpointer(before_write=flush_vector_store)
+    start_exporter()
+    if GENERATION_BACKEND == "llama":
+        # the pinned prefix stays at the front of the local model's sliding window
+        get_llama_backend().system_prefix = memory.pinned_prefix or ""
+    elif OPENAI_WARMUP_CONNECTIONS:
+        print(f"🔌 Warmed up {OPENAI_WARMUP_CONNECTIONS} connection(s) in {warm_up(OPENAI_WARMUP_CONNECTIONS):.2f} sec")
+    run_start = time.time()
 
-        iteration += 1
-        if random.randint(1, 2) == 1:
-            system_msg = random.choice(RAND_POOL)
-            print('\n\n****\nRandom prompt triggered:', system_msg)
-            print('****')
-        else:
-            system_msg = DEFAULT_CONTINOUS_PROMPT
+    def counters() -> dict:
+        return {"input_tokens": TOTAL_INPUT_TOKENS, "output_tokens": TOTAL_OUTPUT_TOKENS,
+                "cached_tokens": TOTAL_CACHED_TOKENS}
 
-            
-      
-        if iteration % 2 == 0:
-            print("📜 Top memories in LTM:")
-            summaries = memory.retrieve_relevant_LTM("find something random/ unexpected from ltm", top_k=3)
-            for i, summary in enumerate(summaries):
-                snippet = summary.strip().replace("\n", " ")[:200]
-                print(f"  {i+1}. {snippet}...")
-
-
-
-        # 1) Build context with system prompt BEFORE generating
-        context = memory.build_context(user_prompt=system_msg)
-
-        # 2) Generate the next chunk
-        max_tokens = random.choices(
-                    [128, 512, 1_024, 2_048, 32_000],
-            weights=[0.5, 0.3,  0.15,  0.04,  0.01],  
-            k=1
-        )[0]
-        print('🧠 Max tokens allowed for next output:', max_tokens)
-        context_tokens = (
-            context + 
-            f"\n(Note: You may use up to {max_tokens} tokens for this response. Use them all)"
-        )
-
-        # ==============================================================================
-        # generation here
-        # ==============================================================================
-        next_text, input_tokens, output_tokens = generate_next_chunk(context_tokens + "in this iteration", max_tokens)
-        # ==============================================================================
-
-        TOTAL_INPUT_TOKENS += input_tokens
-        TOTAL_OUTPUT_TOKENS += output_tokens
-
-        # 3) Add it to STM (this allows memory compression and context chaining)
-        memory.add_to_STM(next_text)
-
-        # 4) Log to disk so we can inspect afterward
-        log_text(next_text)  
-
-        cost = (TOTAL_INPUT_TOKENS * INPUT_COST) + (TOTAL_OUTPUT_TOKENS * OUTPUT_COST)
-        if cost >= 1.00:
-            print(f"💸 Reached cost cap of $1.00. Stopping. Total tokens: {TOTAL_INPUT_TOKENS + TOTAL_OUTPUT_TOKENS}")
-            break
-        print(f"[Iteration {iteration}] ✅ {len(next_text.split())} words | STM: {TOTAL_OUTPUT_TOKENS % SUMMARIZE_THRESHOLD_TOKENS} / {SUMMARIZE_THRESHOLD_TOKENS} | 💰 Est. cost: ${cost:.4f}")
-        print('input tokens:', input_tokens, 'total', TOTAL_INPUT_TOKENS)
-        print('output tokens:', output_tokens, 'total', TOTAL_OUTPUT_TOKENS)
-        end = time.time()
-        print(f"⏱️ Iteration time: {end - start:.2f} sec")
-        total_end = time.time()  # ← End total timer
-        duration = total_end - total_start
-        mins, secs = divmod(duration, 60)
-        print(f"⏳ Total runtime: {int(mins)} min {int(secs)} sec")
-        print("-")
-        print("-")
-        print("-")
-        print("=" * 40)
-        # 5) Sleep to avoid hitting rate limits
-        time.sleep(API_CALL_SLEEP_SEC)
+    lengths = OutputLengthScheduler(output_length)
+    prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch") if pipeline else None
+    upcoming = None  # plan_iteration(iteration + 1), in flight on the prefetcher
+    try:
+        while True:
+            start = time.time()
+            collect_durations()
+
+            iteration += 1
+            plan = upcoming.result() if upcoming is not None else plan_iteration(iteration)
+            upcoming = None
+            system_msg = plan["system_msg"]
+            if plan["randomized"]:
+                print('\n\n****\nRandom prompt triggered:', system_msg)
+                print('****')
+
+            if plan["probe"] is not None:
+                print("📜 Top memories in LTM:")
+                for i, summary in enumerate(plan["probe"]):
+                    snippet = summary.strip().replace("\n", " ")[:200]
+                    print(f"  {i+1}. {snippet}...")
+
+            # 1) Build context with system prompt BEFORE generating (only the STM tail
+            #    is packed here when the plan's skeleton is still current)
+            with timed("context_build"):
+                context = memory.build_context(skeleton=plan["skeleton"])
+
+            # 2) Generate the next chunk, planning the next iteration meanwhile
+            max_tokens = lengths.next_max_tokens(memory.last_context_tokens,
+                                                 SUMMARIZE_THRESHOLD_TOKENS - memory.STM_token_count)
+            print(f"🧠 Max tokens allowed for next output: {max_tokens} (limited by {lengths.last_decision['limited_by']})")
+            context_tokens = with_token_note(context, max_tokens)
+            if prefetcher is not None:
+                upcoming = prefetcher.submit(plan_iteration, iteration + 1)
+
+            # ==============================================================================
+            # generation here
+            # ==============================================================================
+            detector = repetition_guard(memory)
+            with timed("generation"):
+                next_text, input_tokens, output_tokens = generate_next_chunk(
+                    context_tokens + "in this iteration", max_tokens, should_stop=detector, iteration=iteration)
+            next_text = trim_repetition(next_text, detector, logged=STREAM_GENERATION)
+            lengths.observe(last_generation_stats, max_tokens)
+            # ==============================================================================
+
+            TOTAL_INPUT_TOKENS += input_tokens
+            TOTAL_OUTPUT_TOKENS += output_tokens
+            cached_tokens = last_generation_stats["cached_tokens"]
+            TOTAL_CACHED_TOKENS += cached_tokens
+            inc("tokens_total", input_tokens - cached_tokens, kind="input")
+            inc("tokens_total", cached_tokens, kind="cached_input")
+            inc("tokens_total", output_tokens, kind="output")
+
+            # 3) Add it to STM (this allows memory compression and context chaining);
+            # a generation that was nothing but repetition leaves nothing to add
+            if next_text.strip():
+                with timed("stm_add"):
+                    memory.add_to_STM(next_text)
+
+            # 3b) Snapshot every CHECKPOINT_EVERY_ITERATIONS (written off the hot path)
+            checkpointer.maybe_save(iteration, memory, counters())
+
+            # 4) Log to disk so we can inspect afterward (streamed output is already logged)
+            if not STREAM_GENERATION:
+                log_text(next_text, iteration)
+
+            cost = generation_cost(TOTAL_INPUT_TOKENS, TOTAL_CACHED_TOKENS, TOTAL_OUTPUT_TOKENS)
+            if cost >= COST_CAP_USD:
+                print(f"💸 Reached cost cap of ${COST_CAP_USD:.2f}. Stopping. Total tokens: {TOTAL_INPUT_TOKENS + TOTAL_OUTPUT_TOKENS}")
+                break
+            print(f"[Iteration {iteration}] ✅ {len(next_text.split())} words | STM: {TOTAL_OUTPUT_TOKENS % SUMMARIZE_THRESHOLD_TOKENS} / {SUMMARIZE_THRESHOLD_TOKENS} | 💰 Est. cost: ${cost:.4f}")
+            print('input tokens:', input_tokens, 'total', TOTAL_INPUT_TOKENS)
+            print('output tokens:', output_tokens, 'total', TOTAL_OUTPUT_TOKENS)
+            print(f"🧊 cached input tokens: {cached_tokens} ({cached_tokens / max(input_tokens, 1):.0%} hit) "
+                  f"| total {TOTAL_CACHED_TOKENS} ({TOTAL_CACHED_TOKENS / max(TOTAL_INPUT_TOKENS, 1):.0%})")
+            stats = last_generation_stats
+            print(f"⚡ TTFT: {stats['ttft']:.2f} sec | {stats['tokens_per_sec']:.1f} tok/s | generation: {stats['latency']:.2f} sec")
+            ltm = memory.last_LTM_stats
+            if ltm:
+                print(f"🧹 LTM block: {ltm['injected']}/{ltm['candidates']} candidates "
+                      f"({ltm['injected_archived']} verbatim from the archive), {ltm['injected_tokens']} tokens "
+                      f"| saved {ltm['saved_tokens']} input tokens ({ltm['stm_duplicates']} repeat STM, "
+                      f"{ltm['similar']} near-duplicate, {ltm['over_budget']} over budget)")
+            if hedge_stats["hedged"]:
+                print(f"🛡️ hedged {hedge_stats['hedged']}/{hedge_stats['calls']} calls "
+                      f"({hedge_stats['hedged'] / max(hedge_stats['calls'], 1):.1%}), {hedge_stats['hedge_wins']} won by "
+                      f"the duplicate | {hedge_stats['wasted_tokens']} tokens wasted")
+            print(f"🗂️ LTM cache: results {cache_stats['result_hits']} hit / {cache_stats['result_misses']} miss | "
+                  f"embeddings {cache_stats['embedding_hits']} hit / {cache_stats['embedding_misses']} miss")
+            end = time.time()
+            observe("iteration_seconds", end - start)
+            inc("iterations_total")
+            set_gauge("cost_usd", cost)
+            print(f"⏱️ Iteration time: {end - start:.2f} sec")
+            print("   stages: " + " | ".join(f"{stage} {sec:.3f}s" for stage, sec in stage_durations().items()))
+            total_end = time.time()  # ← End total timer
+            duration = total_end - run_start
+            mins, secs = divmod(duration, 60)
+            print(f"⏳ Total runtime: {int(mins)} min {int(secs)} sec")
+            print("-")
+            print("-")
+            print("-")
+            print("=" * 40)
+            # 5) optional pause; rate limits are paced by ratelimit.scheduled_create
+            time.sleep(API_CALL_SLEEP_SEC)
+    finally:
+        if prefetcher is not None:
+            prefetcher.shutdown(wait=True, cancel_futures=True)
+        # final snapshot on cost cap / Ctrl+C so --resume loses nothing
+        checkpointer.save(iteration, memory, counters())
+        checkpointer.wait()
+        export_metrics()
 # ==============================================================================
 # ==============================================================================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Infinite LLM loop")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    parser.add_argument("--pipeline", action=argparse.BooleanOptionalAction, default=PIPELINE_ITERATIONS,
+                        help="plan the next iteration while the current one is generating")
+    parser.add_argument("--output-length", choices=("adaptive", "random"), default=OUTPUT_LENGTH_POLICY,
+                        help="how max_tokens is chosen (see output_length.py)")
+    args = parser.parse_args()
     try:
         print("🚀 Infinite GPT loop started. Press Ctrl+C to stop.")
-        total_start = time.time()  # ← Start total timer
-        main_loop()
+        main_loop(resume=args.resume, pipeline=args.pipeline,
+                  output_length=args.output_length)
     except KeyboardInterrupt:
         print("\n⏹️  Keyboard interrupt received. Saving vector store...")
+        flush_vector_store()
+        flush_log()
         print("👋 Goodbye!")
\ No newline at end of file
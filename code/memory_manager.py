@@ -5,54 +5,118 @@ Handles separation of Short-Term Memory (STM) vs. Long-Term Memory (LTM), summar
 and retrieval so that the never-ending GPT loop remains coherent over time.
 """
 
+import queue
+import threading
 import time
 import uuid
-from openai import OpenAI
-from typing import List
+from collections import Counter, deque
+from typing import Deque, List, Optional, Tuple
 from config import (
     CONTEXT_WINDOW_TOKENS,
+    CONTEXT_LAYOUT,
     SUMMARIZE_THRESHOLD_TOKENS,
     MEMORY_CHUNK_TOKENS,
-    OPENAI_API_KEY
+    COMPRESS_IN_BACKGROUND,
+    COMPRESSION_QUEUE_SIZE,
+    COMPRESSION_HIGH_WATER_TOKENS,
+    COMPRESSION_MAX_RETRIES,
+    COMPRESSION_RETRY_BACKOFF_SEC,
+    LTM_CONSOLIDATION_FANOUT,
+    LTM_DUPLICATE_SIMILARITY,
+    LTM_RETRIEVAL_OVERFETCH,
+    LTM_TIER_DISCOUNT,
+    LTM_TOP_K,
+    LTM_TOKEN_BUDGET,
+    LTM_MMR_LAMBDA,
+    LTM_SHINGLE_WORDS,
+    LTM_STM_OVERLAP_MAX,
+    LTM_RRF_K,
+    REPETITION_REFERENCE_TOKENS,
+    LEXICAL_ARCHIVE,
 )
-from utils import count_tokens
+from utils import TokenizedText, count_tokens, shingle_hashes, tokenized
 from summarizer import summarize_text
+from metrics import inc, set_gauge
 from vector_store import add_to_vector_store as add_memory_chunk
 from vector_store import retrieve_similar_memories as query_similar_memory
+from vector_store import get_memories, delete_memories, embed_documents
 
 
-# Initialize OpenAI
-OpenAI.api_key = OPENAI_API_KEY
-
 class MemoryManager:
     """
-      - a short-term buffer (STM_buffer: List[str])
-      - periodically summarizing old STM into LTM
-      - querying LTM for relevant memory given a “query”
+      - a short-term buffer (STM_buffer: Deque[(text, token_count)])
+      - periodically summarizing old STM into LTM (on a background thread)
+      - consolidating LTM into tiers: groups of old summaries are rolled into one
+        summary of the next tier, and near-duplicates replace each other
+      - querying LTM for relevant memory given a “query”, together with a BM25
+        archive of the verbatim pieces that were summarized (lexical_index.py)
+
+    `namespace` selects the vector store collection, so several managers (sessions,
+    see runner.py) can share one process without seeing each other's LTM.
     """
     # ==============================================================================
     # ==============================================================================
-    def __init__(self):
-        self.STM_buffer: List[str] = []  # stores current chats
-        self.STM_token_count = 0
-        self.LTM_index = []  # list of (chunk_id, summary_text)
+    def __init__(self, background: bool = COMPRESS_IN_BACKGROUND, namespace: str = None):
+        self.namespace = namespace
+        # stores current chats as (TokenizedText, token_count); each piece is encoded once,
+        # and the summarizer reuses those ids
+        self.STM_buffer: Deque[Tuple[TokenizedText, int]] = deque()
+        self.STM_token_count = 0  # running sum of the cached per-piece counts
+        self.LTM_index = []  # list of (chunk_id, tier), oldest first; texts live in the vector store
+        self._LTM_version = 0  # bumped whenever LTM_index changes
+
+        # "cache" layout: text pinned at the very start of every context, and the LTM
+        # block reused until LTM changes: (LTM version, parts, token counts)
+        self.pinned_prefix: str = None
+        self._LTM_block = None
+        # what the LTM block of the latest build_context cost and saved (see _select_LTM),
+        # and the tokens of that context
+        self.last_LTM_stats = {}
+        self.last_context_tokens = 0
+        # shingle sets per STM piece (see _STM_shingles) and of the LTM block
+        self._piece_shingles = {}
+        self._piece_shingles_lock = threading.Lock()
+        self._LTM_shingles = (None, frozenset())
+
+        # evicted pieces waiting for their summary to land in LTM; still shown in context
+        self.STM_pending: Deque[Tuple[TokenizedText, int]] = deque()
+        self.STM_pending_token_count = 0
+        # the chunks STM_pending is made of, oldest first: (LTM id their summary will get, piece count)
+        self._pending_chunks: Deque[Tuple[str, int]] = deque()
+
+        self._lock = threading.Condition()
+        self._jobs: "queue.Queue[Tuple[list, str]]" = queue.Queue(maxsize=COMPRESSION_QUEUE_SIZE)
+        self._worker = None
+        if background:
+            self._worker = threading.Thread(target=self._compression_worker, name="stm-compressor", daemon=True)
+            self._worker.start()
     # ==============================================================================
     # ==============================================================================
-    def add_to_STM(self, text: str) -> None:
+    def add_to_STM(self, text) -> None:
         """
         add_to_STM(text) -> None
 
         Add newly generated text into the short-term buffer and update token count.
         If STM exceeds SUMMARIZE_THRESHOLD_TOKENS, “compress” the oldest chunk into LTM.
+        Compression runs on the worker thread; this only blocks when more than
+        COMPRESSION_HIGH_WATER_TOKENS are still waiting to be summarized.
+        `text` may be a str or a TokenizedText that already carries its ids.
         """
-        tokens = count_tokens(text)
-        self.STM_buffer.append(text)
-        self.STM_token_count += tokens
+        text = tokenized(text)
+        tokens = len(text)
+        with self._lock:
+            self.STM_buffer.append((text, tokens))
+            self.STM_token_count += tokens
 
         # exceed STM threshold, move STM --> summarize into LT
-        if self.STM_token_count > SUMMARIZE_THRESHOLD_TOKENS:
+        while self.STM_token_count > SUMMARIZE_THRESHOLD_TOKENS:
             print('\n\n****\nSTM token reached, moving to LTM\n****\n\n')
             self._compress_oldest()
+
+        # backpressure: let the summarizer catch up before generating more
+        with self._lock:
+            while self.STM_pending_token_count > COMPRESSION_HIGH_WATER_TOKENS:
+                self._lock.wait()
     # ==============================================================================
     # ==============================================================================
     def _compress_oldest(self) -> None:
@@ -60,96 +124,577 @@ class MemoryManager:
         _compress_oldest() -> None
 
         When STM becomes too large, pop off roughly MEMORY_CHUNK_TOKENS worth of tokens
-        from the *start* of STM_buffer, summarize that chunk, store it in LTM, and delete them from STM.
+        from the *start* of STM_buffer and move them to STM_pending. The summary and the
+        LTM insert happen in _commit_to_LTM, on the worker thread when one is running.
+        """
+        # 1) Gather pieces until we have ~MEMORY_CHUNK_TOKENS tokens
+        with self._lock:
+            pieces = []
+            collected_tokens = 0
+            for piece, piece_tokens in self.STM_buffer:
+                if collected_tokens + piece_tokens > MEMORY_CHUNK_TOKENS:
+                    break
+                pieces.append((piece, piece_tokens))
+                collected_tokens += piece_tokens
+
+            if not pieces:
+                # In case a single piece exceeds MEMORY_CHUNK_TOKENS (rare),
+                # just summarize that one piece.
+                pieces = [self.STM_buffer[0]]
+                collected_tokens = pieces[0][1]
+
+            # 2) Move those pieces from STM_buffer to STM_pending, with the id of their summary-to-be
+            for _ in pieces:
+                self.STM_buffer.popleft()
+            self.STM_token_count -= collected_tokens
+            self.STM_pending.extend(pieces)
+            self.STM_pending_token_count += collected_tokens
+            chunk_id = self._new_chunk_id()
+            self._pending_chunks.append((chunk_id, len(pieces)))
+
+        # 3) Hand off (blocks only if COMPRESSION_QUEUE_SIZE jobs are already queued)
+        self._hand_off(pieces, chunk_id)
+
+    def _hand_off(self, pieces: List[Tuple[TokenizedText, int]], chunk_id: str) -> None:
+        if self._worker is None:
+            self._commit_to_LTM(pieces, chunk_id)
+        else:
+            self._jobs.put((pieces, chunk_id))
+    # ==============================================================================
+    # ==============================================================================
+    def _commit_to_LTM(self, pieces: List[Tuple[TokenizedText, int]], chunk_id: str = None) -> None:
         """
-        # 1) Gather text until we have ~MEMORY_CHUNK_TOKENS tokens
-        collected_text = ""
-        collected_tokens = 0
-        pieces_to_remove = 0
+        _commit_to_LTM(pieces, chunk_id=None) -> None
 
-        for idx, piece in enumerate(self.STM_buffer):
-            piece_tokens = count_tokens(piece)
-            if collected_tokens + piece_tokens > MEMORY_CHUNK_TOKENS:
+        Summarize `pieces`, store the summary in LTM (as `chunk_id`, the id picked when
+        they were evicted), then release them from STM_pending.
+        A failed summary or insert is retried up to COMPRESSION_MAX_RETRIES times
+        (the pieces stay in context meanwhile); only then are the pieces dropped.
+        """
+        # 0) Keep the verbatim pieces searchable; the summary paraphrases names and numbers away
+        if LEXICAL_ARCHIVE:
+            try:
+                self._archive().add([str(piece) for piece, _ in pieces],
+                                    [{"time": int(time.time()), "tokens": tokens} for _, tokens in pieces])
+                inc("archive_documents_total", len(pieces))
+            except Exception as e:
+                print(f"⚠️  archiving {len(pieces)} evicted piece(s) failed: {e}")
+
+        summary, stored = None, False
+        for attempt in range(COMPRESSION_MAX_RETRIES + 1):
+            if attempt:
+                inc("compression_retries_total")
+                time.sleep(COMPRESSION_RETRY_BACKOFF_SEC * 2 ** (attempt - 1))
+            try:
+                # 1) Create a summary (from the pieces' token ids; nothing is re-encoded)
+                if summary is None:
+                    collected_text = TokenizedText.join([piece for piece, _ in pieces])
+                    summary = summarize_text(collected_text)  # imported function from summarizer.py
+
+                # 2) Add it to LTM as tier 0 (or in place of a near-duplicate)
+                chunk_id, tier, replaced = self._store_LTM(summary, tier=0, chunk_id=chunk_id)
+                stored = True
                 break
-            collected_text += piece + "\n"
-            collected_tokens += piece_tokens
-            pieces_to_remove += 1
+            except Exception as e:
+                print(f"⚠️  STM -> LTM compression failed (attempt {attempt + 1}/{COMPRESSION_MAX_RETRIES + 1}): {e}")
+        if not stored:
+            print(f"⚠️  dropping {len(pieces)} piece(s) that could not be compressed")
+
+        # 3) Pieces are no longer needed in context once their summary is retrievable
+        with self._lock:
+            if stored:
+                if replaced is not None:
+                    self.LTM_index = [entry for entry in self.LTM_index if entry[0] != replaced]
+                self.LTM_index.append((chunk_id, tier))
+                self._LTM_version += 1
+                inc("compressions_total", result="ok")
+            else:
+                inc("compressions_total", result="dropped")
+            for _, piece_tokens in pieces:
+                self.STM_pending.popleft()
+                self.STM_pending_token_count -= piece_tokens
+            if self._pending_chunks:
+                self._pending_chunks.popleft()
+            set_gauge("stm_pending_tokens", self.STM_pending_token_count)
+            self._lock.notify_all()
+
+        # 4) Roll full tiers up (same thread, so never concurrently with another commit)
+        if stored:
+            self._consolidate()
+    # ==============================================================================
+    # ==============================================================================
+    @staticmethod
+    def _new_chunk_id() -> str:
+        return f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
+
+    def _store_LTM(self, summary: str, tier: int, dedupe: bool = True,
+                   chunk_id: str = None) -> Tuple[str, int, Optional[str]]:
+        """
+        _store_LTM(summary, tier, dedupe=True, chunk_id=None) -> (chunk_id, tier, replaced chunk_id or None)
+
+        Add `summary` to the vector store, as `chunk_id` or under a new id. With `dedupe`,
+        a stored summary at least LTM_DUPLICATE_SIMILARITY similar is deleted and the
+        new one takes its place (and keeps its tier, if higher).
+        """
+        replaced = None
+        if dedupe and LTM_DUPLICATE_SIMILARITY < 1:
+            nearest = query_similar_memory(summary, k=1, namespace=self.namespace)
+            if nearest["ids"][0]:
+                # squared L2 between unit vectors = 2 - 2 * cosine
+                similarity = 1.0 - nearest["distances"][0][0] / 2.0
+                if similarity >= LTM_DUPLICATE_SIMILARITY:
+                    replaced = nearest["ids"][0][0]
+                    tier = max(tier, (nearest["metadatas"][0][0] or {}).get("tier", 0))
+
+        chunk_id = chunk_id or self._new_chunk_id()
+        add_memory_chunk(text=summary, metadata={"chunk_id": chunk_id, "tier": tier, "tokens": count_tokens(summary)},
+                         doc_id=chunk_id, namespace=self.namespace)
+        if replaced is not None:
+            delete_memories([replaced], namespace=self.namespace)
+            inc("ltm_merges_total")
+        return chunk_id, tier, replaced
+    # ==============================================================================
+    # ==============================================================================
+    def _consolidate(self) -> None:
+        """
+        _consolidate() -> None
+
+        While some tier holds more than LTM_CONSOLIDATION_FANOUT summaries, summarize
+        its oldest FANOUT into one summary of the next tier and delete them.
+        """
+        while True:
+            with self._lock:
+                counts = Counter(tier for _, tier in self.LTM_index)
+                full = sorted(tier for tier, n in counts.items() if n > LTM_CONSOLIDATION_FANOUT)
+                if not full:
+                    return
+                tier = full[0]
+                group = [chunk_id for chunk_id, t in self.LTM_index if t == tier][:LTM_CONSOLIDATION_FANOUT]
+
+            try:
+                texts = get_memories(group, namespace=self.namespace)
+                parts = [texts[chunk_id] for chunk_id in group if chunk_id in texts]
+                if parts:
+                    chunk_id, _, _ = self._store_LTM(summarize_text("\n".join(parts)), tier + 1, dedupe=False)
+                    delete_memories(group, namespace=self.namespace)
+            except Exception as e:
+                print(f"⚠️  LTM consolidation of tier {tier} failed, will retry: {e}")
+                return
+
+            with self._lock:
+                dropped = set(group)
+                self.LTM_index = [entry for entry in self.LTM_index if entry[0] not in dropped]
+                if parts:  # ids without a stored text (e.g. from a v1 checkpoint) are just dropped
+                    self.LTM_index.append((chunk_id, tier + 1))
+                self._LTM_version += 1
+            inc("ltm_consolidations_total", tier=str(tier + 1))
+            set_gauge("ltm_entries", len(self.LTM_index))
+    # ==============================================================================
+    # ==============================================================================
+    def _compression_worker(self) -> None:
+        """
+        _compression_worker() -> None
+
+        Background loop: commit queued chunks to LTM in FIFO order. A failed job is
+        logged and the loop goes on; add_to_STM would otherwise wait on it forever.
+        """
+        while True:
+            pieces, chunk_id = self._jobs.get()
+            try:
+                self._commit_to_LTM(pieces, chunk_id)
+            except Exception as e:
+                print(f"⚠️  STM -> LTM compression job failed: {e}")
+                inc("compression_worker_errors_total")
+            finally:
+                self._jobs.task_done()
+    # ==============================================================================
+    # ==============================================================================
+    def _archive(self):
+        from lexical_index import get_archive  # numpy and the mmaps load on first use
+        return get_archive(self.namespace)
+    # ==============================================================================
+    # ==============================================================================
+    def wait_for_compression(self) -> None:
+        """
+        wait_for_compression() -> None
+
+        Block until every queued chunk has been summarized and stored in LTM.
+        """
+        if self._worker is not None:
+            self._jobs.join()
+    # ==============================================================================
+    # ==============================================================================
+    def _STM_shingles(self, pieces: List[TokenizedText]) -> set:
+        """
+        _STM_shingles(pieces) -> union of their shingle_hashes
+
+        Pieces never change, so each is hashed once (cached by identity); pieces
+        that have left STM are dropped from the cache.
+        """
+        shingles = set()
+        with self._piece_shingles_lock:
+            cache = self._piece_shingles
+            for piece in pieces:
+                entry = cache.get(id(piece))
+                if entry is None or entry[0] is not piece:
+                    entry = cache[id(piece)] = (piece, shingle_hashes(str(piece), LTM_SHINGLE_WORDS))
+                shingles |= entry[1]
+            with self._lock:
+                live = {id(piece) for piece, _ in self.STM_pending} | {id(piece) for piece, _ in self.STM_buffer}
+            if len(cache) > len(live):
+                self._piece_shingles = {key: entry for key, entry in cache.items() if key in live}
+        return shingles
 
-        if pieces_to_remove == 0:
-            # In case a single piece exceeds MEMORY_CHUNK_TOKENS (rare),
-            # just summarize that one piece.
-            collected_text = self.STM_buffer[0]
-            collected_tokens = count_tokens(collected_text)
-            pieces_to_remove = 1
+    def reference_shingles(self, max_tokens: int = REPETITION_REFERENCE_TOKENS) -> set:
+        """
+        reference_shingles(max_tokens=REPETITION_REFERENCE_TOKENS) -> set of shingle hashes
 
-        # 2) Create a summary
-        summary = summarize_text(collected_text)  # imported function from summarizer.py
+        Shingles of the current LTM block and of the newest STM pieces (about
+        `max_tokens` of them): what a generation should not simply repeat.
+        """
+        with self._lock:
+            pieces, total = [], 0
+            for piece, piece_tokens in list(reversed(self.STM_buffer)) + list(reversed(self.STM_pending)):
+                if total >= max_tokens:
+                    break
+                pieces.append(piece)
+                total += piece_tokens
+            block = self._LTM_block
+        shingles = self._STM_shingles(pieces)
+        if block is not None:
+            if self._LTM_shingles[0] is not block:
+                self._LTM_shingles = (block, frozenset().union(
+                    *(shingle_hashes(text, LTM_SHINGLE_WORDS) for text in block[1])))
+            shingles |= self._LTM_shingles[1]
+        return shingles
+    # ==============================================================================
+    # ==============================================================================
+    def snapshot(self) -> dict:
+        """
+        snapshot() -> dict
 
-        # 3) Create a unique chunk ID (e.g., timestamp + uuid)
-        chunk_id = f"{int(time.time())}_{uuid.uuid4().hex[:8]}"
-        # 4) Add summary to LTM (Chroma) via embedding
-        add_memory_chunk(text=summary, metadata={"chunk_id": chunk_id})
-        self.LTM_index.append((chunk_id, summary))
+        Copy of the state needed to resume: STM (pending pieces first, oldest first)
+        with cached token counts, LTM_index, and the pending chunks as (the LTM id
+        their summary gets, piece count). Cheap enough for the loop thread.
+        """
+        with self._lock:
+            return {
+                "STM": [(str(piece), tokens) for piece, tokens in list(self.STM_pending) + list(self.STM_buffer)],
+                "LTM_index": list(self.LTM_index),
+                "pending": list(self._pending_chunks),
+            }
+    # ==============================================================================
+    # ==============================================================================
+    def restore(self, state: dict) -> None:
+        """
+        restore(state) -> None
+
+        Load a snapshot() back in. A chunk that was still pending compression may have
+        been stored after the snapshot was taken: if its id is in the vector store it
+        only goes (back) into LTM_index; otherwise it is queued for compression again,
+        under the same id. Pending pieces of snapshots without chunk ids go back into
+        STM_buffer and get compressed again on the next add_to_STM.
+        """
+        stm = [(TokenizedText(text, count=tokens), tokens) for text, tokens in state["STM"]]
+        chunks, start = [], 0
+        for chunk_id, count in state.get("pending") or ():
+            chunks.append((chunk_id, stm[start:start + count]))
+            start += count
+        stored = {}
+        if chunks:
+            try:
+                stored = get_memories([chunk_id for chunk_id, _ in chunks], namespace=self.namespace)
+            except Exception as e:
+                print(f"⚠️  could not look up {len(chunks)} pending chunk(s) in LTM, compressing them again: {e}")
 
-        # 5) Remove those pieces from STM_buffer and adjust token count
-        for _ in range(pieces_to_remove):
-            removed = self.STM_buffer.pop(0)
-            self.STM_token_count -= count_tokens(removed)
+        requeue = []
+        with self._lock:
+            self.STM_buffer = deque(stm[start:])
+            self.STM_token_count = sum(tokens for _, tokens in self.STM_buffer)
+            self.LTM_index = list(state["LTM_index"])
+            known = {chunk_id for chunk_id, _ in self.LTM_index}
+            for chunk_id, pieces in chunks:
+                if chunk_id in stored:
+                    if chunk_id not in known:
+                        self.LTM_index.append((chunk_id, 0))
+                    inc("resumed_pending_chunks_total", result="stored")
+                    continue
+                self.STM_pending.extend(pieces)
+                self.STM_pending_token_count += sum(tokens for _, tokens in pieces)
+                self._pending_chunks.append((chunk_id, len(pieces)))
+                requeue.append((pieces, chunk_id))
+                inc("resumed_pending_chunks_total", result="requeued")
+            self._LTM_version += 1
+        for pieces, chunk_id in requeue:
+            self._hand_off(pieces, chunk_id)
     # ==============================================================================
     # ==============================================================================
-    def retrieve_relevant_LTM(self, query_text: str, top_k: int = 3):
-        results = query_similar_memory(query_text, k=top_k)
-        return results["documents"][0]  # returns a list of top-k document texts
+    def retrieve_relevant_LTM(self, query_text: str, top_k: int = 3, token_budget: int = None,
+                              exclude: set = None) -> List[str]:
+        """
+        retrieve_relevant_LTM(query_text, top_k=3, token_budget=None, exclude=None) -> document texts
+
+        Higher tiers first: candidates are ranked by distance * LTM_TIER_DISCOUNT ** tier,
+        so a consolidated summary wins unless a lower-tier one is clearly closer.
+        Verbatim pieces from the archive compete with them (see _select_LTM for the
+        fusion, the MMR re-ranking, `token_budget` and `exclude`).
+        """
+        return self._select_LTM(query_text, top_k, token_budget, exclude)[0]
+
+    def _select_LTM(self, query_text: str, top_k: int, token_budget: int = None,
+                    exclude: set = None) -> Tuple[List[str], List[int], dict]:
+        """
+        _select_LTM(query_text, top_k, token_budget=None, exclude=None) -> (texts, token counts, stats)
+
+        Over top_k * LTM_RETRIEVAL_OVERFETCH candidates from the vector store and as
+        many archived pieces by BM25 (ranked together by reciprocal rank fusion; the
+        fused scores, min-max scaled, are the relevance): drop the ones whose shingles
+        are mostly in `exclude` (shingle_hashes of the STM), then pick greedily by
+        maximal marginal relevance,
+            LTM_MMR_LAMBDA * relevance - (1 - LTM_MMR_LAMBDA) * max similarity to the picks,
+        skipping near-duplicates of a pick and whatever no longer fits `token_budget`.
+        `stats["saved_tokens"]` is measured against the plain top_k by relevance.
+        """
+        import numpy as np
+        results = query_similar_memory(query_text, k=top_k * LTM_RETRIEVAL_OVERFETCH, namespace=self.namespace)
+        documents, metadatas, distances = results["documents"][0], results["metadatas"][0], results["distances"][0]
+        # cosine similarity (squared L2 between unit vectors = 2 - 2 * cosine), tier-discounted
+        relevance = [1.0 - distances[i] * LTM_TIER_DISCOUNT ** (metadatas[i] or {}).get("tier", 0) / 2.0
+                     for i in range(len(documents))]
+        ranked = sorted(range(len(documents)), key=lambda i: -relevance[i])
+        summaries = len(documents)
+        if LEXICAL_ARCHIVE:
+            hits = self._archive().search(query_text, k=top_k * LTM_RETRIEVAL_OVERFETCH)
+            if hits["ids"]:
+                documents, metadatas = list(documents), list(metadatas)
+                fused = {i: 1.0 / (LTM_RRF_K + rank + 1) for rank, i in enumerate(ranked)}
+                for rank, (text, metadata) in enumerate(zip(hits["documents"], hits["metadatas"])):
+                    documents.append(text)
+                    metadatas.append(metadata)
+                    fused[len(documents) - 1] = 1.0 / (LTM_RRF_K + rank + 1)
+                # rescaled to [0, 1], so MMR weighs rank against diversity as it does cosines
+                low, high = min(fused.values()), max(fused.values())
+                relevance = [(fused[i] - low) / ((high - low) or 1.0) for i in range(len(documents))]
+                ranked = sorted(range(len(documents)), key=lambda i: -relevance[i])
+        # summaries are counted once, when stored; older entries are counted here
+        tokens = [(metadatas[i] or {}).get("tokens") or count_tokens(documents[i]) for i in range(len(documents))]
+        stats = {"candidates": len(documents), "archived": len(documents) - summaries,
+                 "stm_duplicates": 0, "similar": 0, "over_budget": 0}
+
+        keep = ranked
+        if exclude:
+            keep = []
+            for i in ranked:
+                shingles = shingle_hashes(documents[i], LTM_SHINGLE_WORDS)
+                if shingles and len(shingles & exclude) / len(shingles) >= LTM_STM_OVERLAP_MAX:
+                    stats["stm_duplicates"] += 1
+                else:
+                    keep.append(i)
+
+        vectors = None
+        if len(keep) > 1 and LTM_MMR_LAMBDA < 1:
+            vectors = np.asarray(embed_documents([documents[i] for i in keep]), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        closest = np.zeros(len(keep))  # max similarity of each candidate to the picks so far
+        remaining = float("inf") if token_budget is None else token_budget
+        left, picked = list(range(len(keep))), []
+        while left and len(picked) < top_k:
+            j = max(left, key=lambda j: LTM_MMR_LAMBDA * relevance[keep[j]] - (1 - LTM_MMR_LAMBDA) * closest[j])
+            left.remove(j)
+            i = keep[j]
+            if closest[j] >= LTM_DUPLICATE_SIMILARITY:
+                stats["similar"] += 1
+            elif tokens[i] + 1 > remaining:
+                stats["over_budget"] += 1
+            else:
+                picked.append(i)
+                remaining -= tokens[i] + 1
+                if vectors is not None:
+                    closest = np.maximum(closest, vectors @ vectors[j])
+
+        baseline = sum(tokens[i] + 1 for i in ranked[:top_k])
+        used = sum(tokens[i] + 1 for i in picked)
+        stats.update(injected=len(picked), injected_archived=sum(i >= summaries for i in picked),
+                     injected_tokens=used, baseline_tokens=baseline, saved_tokens=baseline - used,
+                     archived_picks=[i >= summaries for i in picked])
+        return [documents[i] for i in picked], [tokens[i] for i in picked], stats
     # ==============================================================================
     # ==============================================================================
-    def build_context(self, user_prompt: str = None) -> str:
+    def build_context(self, user_prompt: str = None, layout: str = CONTEXT_LAYOUT, skeleton: dict = None) -> str:
         """
-        build_context(user_prompt=None) -> str
+        build_context(user_prompt=None, layout=CONTEXT_LAYOUT, skeleton=None) -> str
 
-        Compose:
+        Compose ("classic" layout):
           1. A small prompt (optional) reminding the LLM who it is.
           2. The top K relevant LTM summaries for semantic recall.
-          3. The entire STM_buffer (last few thousand tokens).
+          3. As much of STM_pending + STM_buffer (newest first) as still fits.
+
+        The "cache" layout puts pinned_prefix first and `user_prompt` last, and only
+        re-queries LTM when LTM itself changed, so everything before the STM tail is
+        byte-identical between iterations.
+
+        Always ensure total tokens <= CONTEXT_WINDOW_TOKENS. This is a single packing
+        pass over the cached per-piece counts: the prompt and LTM results are tokenized
+        once, LTM is queried at most once, and STM pieces are never re-encoded.
+        STM pieces that no longer fit are dropped from the front of STM_buffer; pending
+        pieces are only skipped, since the compression worker still owns them.
+
+        Everything before the STM packing can be done ahead of time by
+        prefetch_context(); pass its result as `skeleton` (it carries `user_prompt`
+        and `layout`) and only the STM tail is packed here, unless LTM changed since.
+        """
+        if skeleton is None or skeleton["version"] != self._LTM_version:
+            if skeleton is not None:
+                inc("context_prefetch_total", result="stale")
+                user_prompt, layout = skeleton["user_prompt"], skeleton["layout"]
+            skeleton = self.prefetch_context(user_prompt, layout)
+        else:
+            inc("context_prefetch_total", result="used")
+            if skeleton["layout"] != "cache":
+                skeleton = self._recheck_LTM(skeleton)
+        head_parts, tail_parts = list(skeleton["head"]), skeleton["tail"]
+        budget = skeleton["budget"]
+        self.last_LTM_stats = skeleton["LTM_stats"]
+        inc("ltm_tokens_saved_total", self.last_LTM_stats.get("saved_tokens", 0))
+
+        with self._lock:
+            if budget < 0:
+                # Head alone is too big: drop STM and force a final truncate on the head
+                self.STM_buffer.clear()
+                self.STM_token_count = 0
+                tokens = "\n".join(head_parts + tail_parts).split()  # crude: split on whitespace
+                self.last_context_tokens = CONTEXT_WINDOW_TOKENS
+                return " ".join(tokens[-CONTEXT_WINDOW_TOKENS:])
+
+            # 4) Pack STM from newest to oldest until the budget runs out
+            keep = 0
+            for _, piece_tokens in reversed(self.STM_buffer):
+                if piece_tokens + 1 > budget:
+                    break
+                budget -= piece_tokens + 1
+                keep += 1
+
+            everything_fits = keep == len(self.STM_buffer)
 
-        Always ensure total tokens <= CONTEXT_WINDOW_TOKENS by truncation if needed.
+            # 5) Drop whatever no longer fits from the front of STM_buffer
+            while len(self.STM_buffer) > keep:
+                _, dropped_tokens = self.STM_buffer.popleft()
+                self.STM_token_count -= dropped_tokens
+
+            # 6) Older, still-pending pieces fill whatever budget is left
+            pending = []
+            if everything_fits:
+                for piece, piece_tokens in reversed(self.STM_pending):
+                    if piece_tokens + 1 > budget:
+                        break
+                    budget -= piece_tokens + 1
+                    pending.append(str(piece))
+                pending.reverse()
+
+            self.last_context_tokens = CONTEXT_WINDOW_TOKENS - budget
+            return "\n".join(head_parts + pending + [str(piece) for piece, _ in self.STM_buffer] + tail_parts)
+    # ==============================================================================
+    # ==============================================================================
+    def prefetch_context(self, user_prompt: str = None, layout: str = CONTEXT_LAYOUT) -> dict:
+        """
+        prefetch_context(user_prompt=None, layout=CONTEXT_LAYOUT) -> skeleton
+
+        The part of build_context that does not depend on the STM tail: head/tail
+        parts with the LTM block, and the token budget left for STM. Safe to run on
+        another thread while a generation is in flight (see main.py); the skeleton is
+        good for as long as LTM does not change. In the classic layout its LTM block
+        is then the one for the STM tail before that generation's output, and
+        build_context drops the summaries that repeat what was added to STM since.
         """
+        cache_layout = layout == "cache"
+        with self._lock:
+            version = self._LTM_version
+
         # 1) Start with a “system prompt” or user prompt if provided:
-        context_parts = []
-        if user_prompt:
-            context_parts.append(user_prompt)
-
-        # 2) Retrieve relevant LTM based on the last few lines in STM_buffer
-        #    We can join last N pieces to form a “query.” Simpler: query using the most recent piece.
-        if self.STM_buffer:
-            query = self.STM_buffer[-1]
-            relevant_summaries = self.retrieve_relevant_LTM(query, top_k=3)
-            context_parts.extend(relevant_summaries)
-
-        # 3) Append the entire STM_buffer (chronological)
-        context_parts.extend(self.STM_buffer)
-
-        # 4) Join and ensure we don’t exceed CONTEXT_WINDOW_TOKENS
-        full_context = "\n".join(context_parts)
-        # If it’s too large, we can truncate from the front until it fits:
-        while count_tokens(full_context) > CONTEXT_WINDOW_TOKENS:
-            # Drop the earliest element in STM_buffer, rebuild:
-            if self.STM_buffer:
-                dropped = self.STM_buffer.pop(0)
-                self.STM_token_count -= count_tokens(dropped)
-                context_parts = []
-                if user_prompt:
-                    context_parts.append(user_prompt)
-                if self.STM_buffer:
-                    new_query = self.STM_buffer[-1]
-                    new_relevant = self.retrieve_relevant_LTM(new_query, top_k=3)
-                    context_parts.extend(new_relevant)
-                context_parts.extend(self.STM_buffer)
-                full_context = "\n".join(context_parts)
+        head_parts, tail_parts = [], []
+        if cache_layout:
+            if self.pinned_prefix:
+                head_parts.append(self.pinned_prefix)
+            if user_prompt:
+                tail_parts.append(user_prompt)
+        elif user_prompt:
+            head_parts.append(user_prompt)
+        budget = CONTEXT_WINDOW_TOKENS
+        for part in head_parts + tail_parts:
+            budget -= count_tokens(part) + 1  # each "\n" separator counts as 1
+
+        # 2) Retrieve relevant LTM based on the most recent piece in STM_buffer
+        ltm_parts, ltm_tokens, ltm_stats, checked = self._LTM_parts(reuse=cache_layout)
+        head_parts.extend(ltm_parts)
+
+        # 3) Charge the LTM block against the budget
+        budget -= sum(t + 1 for t in ltm_tokens)
+        return {"version": version, "user_prompt": user_prompt, "layout": layout,
+                "head": head_parts, "tail": tail_parts, "budget": budget, "LTM_stats": ltm_stats,
+                "LTM": (ltm_parts, ltm_tokens), "STM_checked": checked}
+    # ==============================================================================
+    # ==============================================================================
+    def _recheck_LTM(self, skeleton: dict) -> dict:
+        """
+        _recheck_LTM(skeleton) -> skeleton
+
+        Drop from a prefetched LTM block the summaries that repeat STM as it is now,
+        when STM gained pieces after the block was selected (the usual case in the
+        pipelined loop: the generation in flight at prefetch time). No new query: the
+        summaries stay the ones retrieved for the previous STM tail.
+        """
+        parts, tokens = skeleton["LTM"]
+        checked = {id(piece) for piece in skeleton["STM_checked"] or ()}
+        with self._lock:
+            stm = [piece for piece, _ in self.STM_pending] + [piece for piece, _ in self.STM_buffer]
+        if not parts or all(id(piece) in checked for piece in stm):
+            return skeleton
+
+        exclude = self._STM_shingles(stm)
+        stats = dict(skeleton["LTM_stats"])
+        archived = stats.get("archived_picks") or [False] * len(parts)
+        keep = []
+        for j, text in enumerate(parts):
+            shingles = shingle_hashes(text, LTM_SHINGLE_WORDS)
+            if shingles and len(shingles & exclude) / len(shingles) >= LTM_STM_OVERLAP_MAX:
+                stats["stm_duplicates"] += 1
+                stats["injected"] -= 1
+                stats["injected_archived"] -= archived[j]
+                stats["injected_tokens"] -= tokens[j] + 1
+                stats["saved_tokens"] += tokens[j] + 1
             else:
-                # If STM is empty but still too big, force a final truncate on full_context string
-                tokens = full_context.split()  # crude: split on whitespace
-                truncated = " ".join(tokens[-CONTEXT_WINDOW_TOKENS:])
-                full_context = truncated
-                break
+                keep.append(j)
+        inc("context_prefetch_rechecked_total", result="dropped" if len(keep) < len(parts) else "kept")
+        if len(keep) == len(parts):
+            return skeleton
+        stats["archived_picks"] = [archived[j] for j in keep]
+        kept_parts, kept_tokens = [parts[j] for j in keep], [tokens[j] for j in keep]
+        head = skeleton["head"][:len(skeleton["head"]) - len(parts)] + kept_parts
+        freed = sum(t + 1 for t in tokens) - sum(t + 1 for t in kept_tokens)
+        return dict(skeleton, head=head, budget=skeleton["budget"] + freed, LTM_stats=stats,
+                    LTM=(kept_parts, kept_tokens))
+    # ==============================================================================
+    # ==============================================================================
+    def _LTM_parts(self, reuse: bool) -> Tuple[List[str], List[int], dict, Optional[list]]:
+        """
+        _LTM_parts(reuse) -> (summaries, token counts, stats, STM pieces checked against)
+
+        Up to LTM_TOP_K summaries (LTM_TOKEN_BUDGET tokens) for the most recent STM
+        piece, leaving out the ones that repeat STM. With `reuse`, the previous block
+        is returned unchanged until LTM_index changes, even once the STM it was
+        checked against has moved on: the cached prefix is worth more (the pieces
+        checked against are then None).
+        """
+        with self._lock:
+            last = self.STM_buffer[-1] if self.STM_buffer else (self.STM_pending[-1] if self.STM_pending else None)
+            stm = [piece for piece, _ in self.STM_pending] + [piece for piece, _ in self.STM_buffer]
+            version = self._LTM_version
+        if reuse and self._LTM_block is not None and self._LTM_block[0] == version:
+            return self._LTM_block[1], self._LTM_block[2], self._LTM_block[3], None
+        if last is None:
+            return [], [], {}, stm
 
-        return full_context
+        exclude = self._STM_shingles(stm)
+        parts, tokens, stats = self._select_LTM(str(last[0]), LTM_TOP_K, LTM_TOKEN_BUDGET, exclude)
+        self._LTM_block = (version, parts, tokens, stats)
+        return parts, tokens, stats, stm
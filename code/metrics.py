@@ -0,0 +1,214 @@
+"""
+metrics.py
+
+Lightweight in-process instrumentation: per-stage latency histograms, counters
+and gauges, exported periodically as a Prometheus text file or a JSONL stream.
+
+Usage:
+    with timed("context_build"):
+        ...
+
+    @timed("summarize")
+    def summarize_text(...): ...
+
+    inc("tokens_total", 512, kind="output")
+    set_gauge("cost_usd", 0.12)
+"""
+
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+from config import METRICS_EXPORT, METRICS_PATH, METRICS_EXPORT_INTERVAL_SEC, METRICS_PREFIX
+from utils import ensure_dir_exists
+
+# seconds; the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_lock = threading.Lock()
+_histograms: Dict[Tuple[str, tuple], list] = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters: Dict[Tuple[str, tuple], float] = {}
+_gauges: Dict[Tuple[str, tuple], float] = {}
+
+# per thread: the dict collecting that thread's stage durations (see collect_durations),
+# so the generation loop's breakdown never picks up a background thread's stages
+_durations = threading.local()
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+# ==============================================================================
+# 1) recording
+# ==============================================================================
+def observe(name: str, value: float, **labels) -> None:
+    """
+    observe(name, value, **labels) -> None
+
+    Add one sample to histogram `name`.
+    """
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 1) + [0.0]
+        h[bisect.bisect_left(BUCKETS, value)] += 1
+        h[-1] += value
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+class timed:
+    """
+    Time a block (`with timed("stage"):`) or every call of a function
+    (`@timed("stage")`) into the `stage_seconds{stage=...}` histogram.
+    """
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        durations = getattr(_durations, "current", None)
+        if durations is not None:
+            with _lock:
+                durations[self.stage] = elapsed
+        observe("stage_seconds", elapsed, stage=self.stage)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.stage):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def collect_durations() -> None:
+    """
+    collect_durations() -> None
+
+    Start a fresh per-iteration breakdown: from now on every `timed` block that
+    finishes on the calling thread records its latest duration there.
+    """
+    _durations.current = {}
+
+def stage_durations() -> Dict[str, float]:
+    """
+    stage_durations() -> dict
+
+    Copy of the calling thread's breakdown since its last collect_durations().
+    """
+    with _lock:
+        return dict(getattr(_durations, "current", None) or {})
+
+# ==============================================================================
+# 2) export
+# ==============================================================================
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def render_prometheus() -> str:
+    """
+    render_prometheus() -> str
+
+    All metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters, gauges = dict(_counters), dict(_gauges)
+
+    for kind, series in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({k[0] for k in series}):
+            lines.append(f"# TYPE {METRICS_PREFIX}{name} {kind}")
+            for (n, labels), value in sorted(series.items()):
+                if n == name:
+                    lines.append(f"{METRICS_PREFIX}{n}{_labels(labels)} {value}")
+
+    for name in sorted({k[0] for k in histograms}):
+        lines.append(f"# TYPE {METRICS_PREFIX}{name} histogram")
+        for (n, labels), h in sorted(histograms.items()):
+            if n != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), h[:-1]):
+                cumulative += count
+                le = _labels(labels, 'le="%s"' % bound)
+                lines.append(f"{METRICS_PREFIX}{n}_bucket{le} {cumulative}")
+            lines.append(f"{METRICS_PREFIX}{n}_sum{_labels(labels)} {h[-1]}")
+            lines.append(f"{METRICS_PREFIX}{n}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def snapshot() -> dict:
+    """
+    snapshot() -> dict
+
+    JSON-friendly view: counters, gauges and per-histogram count/sum/mean.
+    """
+    with _lock:
+        return {
+            "ts": time.time(),
+            "counters": {f"{n}{_labels(l)}": v for (n, l), v in _counters.items()},
+            "gauges": {f"{n}{_labels(l)}": v for (n, l), v in _gauges.items()},
+            "histograms": {
+                f"{n}{_labels(l)}": {"count": sum(h[:-1]), "sum": h[-1], "mean": h[-1] / max(sum(h[:-1]), 1)}
+                for (n, l), h in _histograms.items()
+            },
+        }
+
+def export_metrics(path: str = METRICS_PATH, fmt: str = METRICS_EXPORT) -> None:
+    """
+    export_metrics(path, fmt) -> None
+
+    "prometheus": atomically rewrite `path`; "jsonl": append one snapshot() line.
+    """
+    ensure_dir_exists(os.path.dirname(path) or ".")
+    if fmt == "prometheus":
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+        os.replace(tmp, path)
+    elif fmt == "jsonl":
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot()) + "\n")
+
+_exporter = None
+
+def start_exporter(interval: float = METRICS_EXPORT_INTERVAL_SEC) -> None:
+    """
+    start_exporter(interval) -> None
+
+    Export every `interval` seconds on a daemon thread (no-op if METRICS_EXPORT is None).
+    """
+    global _exporter
+    if not METRICS_EXPORT or _exporter is not None:
+        return
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                export_metrics()
+            except OSError as e:
+                print(f"⚠️  metrics export failed: {e}")
+
+    _exporter = threading.Thread(target=run, name="metrics-exporter", daemon=True)
+    _exporter.start()
@@ -0,0 +1,346 @@
+"""
+numpy_index.py
+
+A small in-process vector index that can stand in for the Chroma collection in
+vector_store (config.VECTOR_BACKEND = "numpy"). It implements the subset of the
+Chroma collection API the project uses: add(), query(), get(), delete() and count().
+
+On disk (all append-only):
+  - vectors.f32  (or vectors.i8 + scales.f32 when quantized)  one row per document
+  - norms.f32    squared L2 norm of each (dequantized) row
+  - docs.jsonl   {"id", "document", "metadata"} per row
+  - ids.jsonl    the id of each row, for the id map of get() / delete()
+  - offsets.u64  byte offsets just past each row of docs.jsonl and of ids.jsonl
+                 (a row counts once this is written)
+  - deleted.u32  row numbers removed by delete() (tombstones)
+
+Opening the index is an mmap; only rows docs.jsonl has past the end of offsets.u64
+(an index written before it existed, or a crash mid-add) are re-read from it.
+Top-k is one matrix-vector product plus argpartition.
+Once tombstones make up half the rows, the live rows are rewritten into a fresh
+directory that replaces the old one.
+"""
+
+import json
+import os
+import shutil
+import threading
+from typing import List
+
+import numpy as np
+
+from utils import ensure_dir_exists
+
+_QUERY_BLOCK_ROWS = 1 << 16  # int8 rows dequantized per block during a query
+_COMPACT_MIN_DELETED = 64      # compact once at least this many rows are tombstoned ...
+_COMPACT_DELETED_FRACTION = 0.5  # ... and they are at least this fraction of all rows
+
+
+def _map_offsets(path: str, rows: int) -> np.ndarray:
+    """
+    Read-only mmap of the first `rows` rows of offsets.u64, as (rows, 2).
+    """
+    if rows == 0:
+        return np.zeros((0, 2), dtype=np.uint64)
+    return np.memmap(path, dtype=np.uint64, mode="r", shape=(rows, 2))
+
+
+class NumpyVectorIndex:
+    """
+    Append-only, memory-mapped float32 / int8 vector index with a JSONL sidecar.
+    Distances are squared L2, matching Chroma's default "l2" space.
+    """
+    def __init__(self, directory: str, quantize: bool = False):
+        if not os.path.exists(directory) and os.path.exists(directory + ".old"):
+            os.replace(directory + ".old", directory)  # crashed mid-compaction: the old copy is complete
+        ensure_dir_exists(directory)
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.docs_path = os.path.join(directory, "docs.jsonl")
+        self.ids_path = os.path.join(directory, "ids.jsonl")
+        self.offsets_path = os.path.join(directory, "offsets.u64")
+        self.norms_path = os.path.join(directory, "norms.f32")
+        self.deleted_path = os.path.join(directory, "deleted.u32")
+        self._lock = threading.Lock()
+        self._default_quantize = quantize
+        self._open()
+
+    def _open(self) -> None:
+        self.dim = None
+        self.quantize = self._default_quantize
+        self._count = 0           # complete rows
+        self._rows_by_id = None   # id -> row, built on the first get()/delete()
+        self._deleted = set()
+        self._mapped_rows = -1
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim, self.quantize = meta["dim"], meta["quantize"]
+            self._load_rows()
+        if os.path.exists(self.deleted_path):
+            rows = np.fromfile(self.deleted_path, dtype=np.uint32)
+            self._deleted = {int(r) for r in rows if r < self._count}
+        self._set_paths()
+
+    # ==============================================================================
+    # 1) files
+    # ==============================================================================
+    def _set_paths(self) -> None:
+        self.vectors_path = os.path.join(self.directory, "vectors.i8" if self.quantize else "vectors.f32")
+        self.scales_path = os.path.join(self.directory, "scales.f32")
+
+    def _load_rows(self) -> None:
+        self._set_paths()
+        for path in (self.docs_path, self.ids_path, self.offsets_path):
+            open(path, "ab").close()
+        # a crash mid-append can leave the files at different lengths; keep complete rows
+        row_bytes = self.dim if self.quantize else 4 * self.dim
+        n = min(os.path.getsize(self.vectors_path) // row_bytes, os.path.getsize(self.norms_path) // 4)
+        if self.quantize:
+            n = min(n, os.path.getsize(self.scales_path) // 4)
+        docs_size, ids_size = os.path.getsize(self.docs_path), os.path.getsize(self.ids_path)
+        offsets = _map_offsets(self.offsets_path, min(n, os.path.getsize(self.offsets_path) // 16))
+        recorded = min(int(np.searchsorted(offsets[:, 0], docs_size, side="right")),
+                       int(np.searchsorted(offsets[:, 1], ids_size, side="right")))
+        doc_end, id_end = (int(offsets[recorded - 1, 0]), int(offsets[recorded - 1, 1])) if recorded else (0, 0)
+        del offsets
+        self._truncate(self.offsets_path, recorded * 16)
+        self._truncate(self.ids_path, id_end)
+
+        # rows that made it into docs.jsonl but not into offsets.u64
+        if n > recorded and docs_size > doc_end:
+            ids, ends = [], []
+            with open(self.docs_path, "rb") as f:
+                f.seek(doc_end)
+                for line in f:
+                    if len(ids) == n - recorded or not line.endswith(b"\n"):
+                        break  # enough rows, or a torn final line
+                    doc_end += len(line)
+                    ids.append(json.loads(line)["id"])
+                    ends.append(doc_end)
+            self._append_ids(ids, ends)
+            recorded += len(ids)
+
+        self._count = recorded
+        self._truncate(self.docs_path, doc_end)
+        self._truncate(self.vectors_path, recorded * row_bytes)
+        self._truncate(self.norms_path, recorded * 4)
+        if self.quantize:
+            self._truncate(self.scales_path, recorded * 4)
+
+    @staticmethod
+    def _truncate(path: str, size: int) -> None:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+    def _append_ids(self, ids: List[str], doc_ends: List[int]) -> None:
+        """
+        Append the ids.jsonl lines and offsets.u64 rows for rows whose docs.jsonl
+        lines end at `doc_ends`; the offsets go last, so the rows count only then.
+        """
+        lines = [(json.dumps(i, ensure_ascii=False) + "\n").encode("utf-8") for i in ids]
+        with open(self.ids_path, "ab") as f:
+            id_end = f.tell()
+            f.write(b"".join(lines))
+        id_ends = np.cumsum([len(line) for line in lines], dtype=np.uint64) + np.uint64(id_end)
+        with open(self.offsets_path, "ab") as f:
+            f.write(np.stack([np.asarray(doc_ends, dtype=np.uint64), id_ends], axis=1).tobytes())
+
+    def _write_meta(self) -> None:
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "quantize": self.quantize}, f)
+        self._set_paths()
+        paths = ([self.vectors_path, self.norms_path, self.docs_path, self.ids_path, self.offsets_path]
+                 + ([self.scales_path] if self.quantize else []))
+        for path in paths:
+            open(path, "ab").close()
+
+    def _map(self) -> None:
+        n = self._count
+        if self._mapped_rows == n:
+            return
+        self._offsets = _map_offsets(self.offsets_path, n)
+        if n == 0:
+            self._vectors = self._scales = self._norms = None
+        else:
+            dtype = np.int8 if self.quantize else np.float32
+            self._vectors = np.memmap(self.vectors_path, dtype=dtype, mode="r", shape=(n, self.dim))
+            self._norms = np.memmap(self.norms_path, dtype=np.float32, mode="r", shape=(n,))
+            self._scales = (np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(n,))
+                            if self.quantize else None)
+        self._mapped_rows = n
+
+    def _id_map(self) -> dict:
+        if self._rows_by_id is None:
+            self._rows_by_id = {}
+            if not self._count:
+                return self._rows_by_id
+            with open(self.ids_path, "rb") as f:
+                for row, line in zip(range(self._count), f):
+                    if row not in self._deleted:
+                        self._rows_by_id[json.loads(line)] = row
+        return self._rows_by_id
+
+    def _read_rows(self, rows: List[int]) -> List[dict]:
+        out = []
+        if not rows:
+            return out
+        self._map()
+        with open(self.docs_path, "rb") as f:
+            for r in rows:
+                f.seek(int(self._offsets[r - 1, 0]) if r else 0)
+                out.append(json.loads(f.readline()))
+        return out
+
+    # ==============================================================================
+    # 2) chroma-compatible surface
+    # ==============================================================================
+    def count(self) -> int:
+        return self._count - len(self._deleted)
+
+    def add(self, ids: List[str], documents: List[str], metadatas: List[dict] = None,
+            embeddings=None) -> None:
+        """
+        Append documents with precomputed `embeddings` (the index never embeds text).
+        """
+        if embeddings is None:
+            raise ValueError("NumpyVectorIndex.add needs precomputed embeddings")
+        if metadatas is None:
+            metadatas = [{} for _ in ids]
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} != index dimension {self.dim}")
+
+            if self.quantize:
+                scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+                stored = np.round(vectors / scales[:, None]).astype(np.int8)
+                dequantized = stored.astype(np.float32) * scales[:, None]
+            else:
+                stored = dequantized = vectors
+            norms = np.einsum("ij,ij->i", dequantized, dequantized).astype(np.float32)
+
+            lines = [
+                (json.dumps({"id": i, "document": d, "metadata": m}, ensure_ascii=False) + "\n").encode("utf-8")
+                for i, d, m in zip(ids, documents, metadatas)
+            ]
+            # vectors and docs first: rows only count once their offsets are written
+            with open(self.vectors_path, "ab") as f:
+                f.write(stored.tobytes())
+            if self.quantize:
+                with open(self.scales_path, "ab") as f:
+                    f.write(scales.astype(np.float32).tobytes())
+            with open(self.norms_path, "ab") as f:
+                f.write(norms.tobytes())
+            with open(self.docs_path, "ab") as f:
+                doc_end = f.tell()
+                f.write(b"".join(lines))
+            self._append_ids(ids, np.cumsum([len(line) for line in lines], dtype=np.uint64) + np.uint64(doc_end))
+            if self._rows_by_id is not None:
+                for row, i in enumerate(ids, self._count):
+                    self._rows_by_id[i] = row
+            self._count += len(ids)
+
+    def get(self, ids: List[str], include=None, **_) -> dict:
+        """
+        Documents and metadata of the given ids (unknown ids are skipped).
+        """
+        with self._lock:
+            id_map = self._id_map()
+            rows = self._read_rows([id_map[i] for i in ids if i in id_map])
+        return {
+            "ids": [r["id"] for r in rows],
+            "documents": [r["document"] for r in rows],
+            "metadatas": [r["metadata"] for r in rows],
+        }
+
+    def delete(self, ids: List[str], **_) -> None:
+        """
+        Tombstone the given ids; compacts the files once enough rows are dead.
+        """
+        with self._lock:
+            id_map = self._id_map()
+            rows = [id_map.pop(i) for i in ids if i in id_map]
+            if not rows:
+                return
+            with open(self.deleted_path, "ab") as f:
+                f.write(np.asarray(rows, dtype=np.uint32).tobytes())
+            self._deleted.update(rows)
+            if (len(self._deleted) >= _COMPACT_MIN_DELETED
+                    and len(self._deleted) >= _COMPACT_DELETED_FRACTION * self._count):
+                self._compact()
+
+    def _compact(self) -> None:
+        """
+        Rewrite the live rows into <dir>.tmp, then swap it in for <dir>.
+        """
+        self._map()
+        live = np.asarray([r for r in range(self._count) if r not in self._deleted], dtype=np.int64)
+        tmp, old = self.directory + ".tmp", self.directory + ".old"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "quantize": self.quantize}, f)
+        if len(live):
+            np.asarray(self._vectors[live]).tofile(os.path.join(tmp, os.path.basename(self.vectors_path)))
+            np.asarray(self._norms[live]).tofile(os.path.join(tmp, "norms.f32"))
+            if self.quantize:
+                np.asarray(self._scales[live]).tofile(os.path.join(tmp, "scales.f32"))
+        offsets = np.zeros((len(live), 2), dtype=np.uint64)
+        with open(self.docs_path, "rb") as src, open(os.path.join(tmp, "docs.jsonl"), "wb") as dst, \
+                open(os.path.join(tmp, "ids.jsonl"), "wb") as ids:
+            for j, row in enumerate(live.tolist()):
+                src.seek(int(self._offsets[row - 1, 0]) if row else 0)
+                line = src.readline()
+                dst.write(line)
+                ids.write((json.dumps(json.loads(line)["id"], ensure_ascii=False) + "\n").encode("utf-8"))
+                offsets[j] = dst.tell(), ids.tell()
+        offsets.tofile(os.path.join(tmp, "offsets.u64"))
+        for name in (os.path.basename(self.vectors_path), "norms.f32") + (("scales.f32",) if self.quantize else ()):
+            open(os.path.join(tmp, name), "ab").close()
+
+        self._vectors = self._scales = self._norms = self._offsets = None  # drop the mmaps before moving files
+        os.replace(self.directory, old)
+        os.replace(tmp, self.directory)
+        shutil.rmtree(old, ignore_errors=True)
+        self._open()
+
+    def _dots(self, q: np.ndarray) -> np.ndarray:
+        if not self.quantize:
+            return self._vectors @ q  # one BLAS gemv over the whole mmap
+        out = np.empty(self._count, dtype=np.float32)
+        for start in range(0, len(out), _QUERY_BLOCK_ROWS):
+            block = self._vectors[start:start + _QUERY_BLOCK_ROWS]
+            out[start:start + len(block)] = block.astype(np.float32) @ q
+        return out * self._scales
+
+    def query(self, query_embeddings, n_results: int = 3, include=None, **_) -> dict:
+        """
+        Top-`n_results` rows by squared L2 distance for each query embedding.
+        """
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            self._map()
+            for q in query_embeddings:
+                if self.count() == 0:
+                    for key in results:
+                        results[key].append([])
+                    continue
+                q = np.asarray(q, dtype=np.float32)
+                distances = np.maximum(self._norms + float(q @ q) - 2.0 * self._dots(q), 0.0)
+                if self._deleted:
+                    distances[list(self._deleted)] = np.inf
+                k = min(n_results, self.count())
+                top = np.argpartition(distances, k - 1)[:k]
+                top = top[np.argsort(distances[top])]
+                rows = self._read_rows(top.tolist())
+                results["ids"].append([r["id"] for r in rows])
+                results["documents"].append([r["document"] for r in rows])
+                results["metadatas"].append([r["metadata"] for r in rows])
+                results["distances"].append(distances[top].tolist())
+        return results
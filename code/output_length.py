@@ -0,0 +1,154 @@
+"""
+output_length.py
+
+Picks max_tokens for the next generation (config.OUTPUT_LENGTH_POLICY):
+  - "random":   draw_max_tokens(), the original fixed weighted draw (clamped to the
+    room left in the context window);
+  - "adaptive": the shortest output that reaches the throughput target, within what
+    the context window, the next STM compression and the latency cap allow.
+
+The target is OUTPUT_LENGTH_TARGET: "tokens_per_dollar" (the prompt is paid once per
+call, so longer outputs amortize it) or "tokens_per_sec" (same for the time to first
+token). Both improve with length, so the target is a floor: past it, shorter
+iterations keep STM, LTM and the prompts fresher. Time to first token, decode rate,
+prompt-cache hit rate and how much of max_tokens the model actually uses are
+measured live (exponential moving averages over the last generations).
+
+    scheduler = OutputLengthScheduler()
+    max_tokens = scheduler.next_max_tokens(context_tokens, until_compression)
+    ...
+    scheduler.observe(stats, max_tokens)   # stats as filled by main._record_generation
+"""
+
+import math
+import random
+from typing import Optional
+
+from config import (
+    GENERATION_BACKEND,
+    CONTEXT_WINDOW_TOKENS,
+    MEMORY_CHUNK_TOKENS,
+    INPUT_COST_PER_TOKEN,
+    CACHED_INPUT_COST_PER_TOKEN,
+    OUTPUT_COST_PER_TOKEN,
+    OUTPUT_LENGTH_POLICY,
+    OUTPUT_LENGTH_TARGET,
+    OUTPUT_TOKENS_PER_DOLLAR_TARGET,
+    OUTPUT_TOKENS_PER_SEC_TARGET,
+    OUTPUT_LENGTH_MIN_TOKENS,
+    OUTPUT_LENGTH_MAX_TOKENS,
+    OUTPUT_LENGTH_MAX_SEC,
+)
+from metrics import set_gauge
+
+_EWMA = 0.2                 # weight of the newest generation in the moving averages
+_PROMPT_MARGIN_TOKENS = 64  # the max_tokens note and message framing around the context
+
+
+def draw_max_tokens() -> int:
+    """
+    draw_max_tokens() -> int
+
+    Random output budget for the next iteration, mostly short with a long tail.
+    """
+    return random.choices(
+                [128, 512, 1_024, 2_048, 32_000],
+        weights=[0.5, 0.3,  0.15,  0.04,  0.01],
+        k=1
+    )[0]
+
+
+class OutputLengthScheduler:
+    """
+    OutputLengthScheduler(policy=OUTPUT_LENGTH_POLICY, target=OUTPUT_LENGTH_TARGET)
+
+    One per generating loop; `last_decision` holds the inputs of the latest choice.
+    """
+    def __init__(self, policy: str = OUTPUT_LENGTH_POLICY, target: str = OUTPUT_LENGTH_TARGET):
+        if policy not in ("adaptive", "random"):
+            raise ValueError(f"Unknown OUTPUT_LENGTH_POLICY: {policy!r}")
+        if target not in ("tokens_per_dollar", "tokens_per_sec"):
+            raise ValueError(f"Unknown OUTPUT_LENGTH_TARGET: {target!r}")
+        if target == "tokens_per_dollar" and GENERATION_BACKEND == "llama":
+            target = "tokens_per_sec"  # the local model is free: every length meets a $ target
+        self.policy = policy
+        self.target = target
+        # None until the first generation is observed
+        self.ttft: Optional[float] = None
+        self.tokens_per_sec: Optional[float] = None
+        self.cached_fraction = 0.0  # share of the prompt served from the provider's cache
+        self.fill = 1.0             # completion_tokens / max_tokens
+        self.last_decision = {}
+
+    def _average(self, name: str, value: float) -> None:
+        old = getattr(self, name)
+        setattr(self, name, value if old is None else old + _EWMA * (value - old))
+
+    def observe(self, stats: dict, max_tokens: int) -> None:
+        """
+        Fold one generation's timings and usage into the estimates.
+        """
+        completion = stats.get("completion_tokens") or 0
+        if stats.get("tokens_per_sec"):
+            self._average("ttft", stats["ttft"])
+            self._average("tokens_per_sec", stats["tokens_per_sec"])
+        elif completion and stats.get("latency"):
+            # not streamed: first and last token arrive together
+            self._average("tokens_per_sec", completion / stats["latency"])
+        if stats.get("prompt_tokens"):
+            self._average("cached_fraction", stats.get("cached_tokens", 0) / stats["prompt_tokens"])
+        if max_tokens:
+            self._average("fill", min(1.0, max(0.05, completion / max_tokens)))
+
+    def _needed_output(self, context_tokens: int) -> float:
+        """
+        Output tokens at which one call reaches the target (inf if it never does).
+        """
+        if self.target == "tokens_per_dollar":
+            # output / (prompt cost + output * OUTPUT_COST_PER_TOKEN) >= target
+            prompt_cost = context_tokens * ((1 - self.cached_fraction) * INPUT_COST_PER_TOKEN
+                                            + self.cached_fraction * CACHED_INPUT_COST_PER_TOKEN)
+            rate, per_output, fixed = OUTPUT_TOKENS_PER_DOLLAR_TARGET, OUTPUT_COST_PER_TOKEN, prompt_cost
+        else:
+            # output / (ttft + output / tokens_per_sec) >= target
+            if self.tokens_per_sec is None:
+                return 0.0  # nothing measured yet: start short
+            rate, per_output, fixed = OUTPUT_TOKENS_PER_SEC_TARGET, 1.0 / self.tokens_per_sec, self.ttft or 0.0
+        if rate * per_output >= 1.0:
+            return math.inf
+        return rate * fixed / (1.0 - rate * per_output)
+
+    def next_max_tokens(self, context_tokens: int, until_compression: int,
+                        window: int = CONTEXT_WINDOW_TOKENS) -> int:
+        """
+        next_max_tokens(context_tokens, until_compression, window=CONTEXT_WINDOW_TOKENS) -> int
+
+        `context_tokens` is the prompt about to be sent, `until_compression` how many
+        more STM tokens fit before the next compression.
+        """
+        if self.policy == "random":
+            max_tokens = min(draw_max_tokens(), max(1, window - context_tokens - _PROMPT_MARGIN_TOKENS))
+            self.last_decision = {"max_tokens": max_tokens, "limited_by": "random"}
+            set_gauge("output_max_tokens", max_tokens)
+            return max_tokens
+
+        # hard limits: what fits next to the prompt, and what the model may emit
+        room = max(1, min(window - context_tokens - _PROMPT_MARGIN_TOKENS, OUTPUT_LENGTH_MAX_TOKENS))
+        # soft limits, never below OUTPUT_LENGTH_MIN_TOKENS: at most one STM compression
+        # per output (a longer one is evicted, and summarized, in several chunks at
+        # once), and the latency cap
+        caps = {"compression": max(0, until_compression) + MEMORY_CHUNK_TOKENS}
+        if self.tokens_per_sec is not None:
+            caps["latency"] = int((OUTPUT_LENGTH_MAX_SEC - (self.ttft or 0.0)) * self.tokens_per_sec)
+
+        needed = self._needed_output(context_tokens) / self.fill  # the model stops short of max_tokens
+        bounds = {"room": room, **{name: max(OUTPUT_LENGTH_MIN_TOKENS, cap) for name, cap in caps.items()}}
+        limited_by = min(bounds, key=bounds.get)
+        if max(needed, OUTPUT_LENGTH_MIN_TOKENS) < bounds[limited_by]:
+            max_tokens, limited_by = max(math.ceil(needed), OUTPUT_LENGTH_MIN_TOKENS), "target"
+        else:
+            max_tokens = bounds[limited_by]
+        self.last_decision = {"max_tokens": max_tokens, "needed": needed, "room": room,
+                              "limited_by": limited_by, **{f"{k}_cap": v for k, v in caps.items()}}
+        set_gauge("output_max_tokens", max_tokens)
+        return max_tokens
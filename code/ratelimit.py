@@ -0,0 +1,269 @@
+"""
+ratelimit.py
+
+One scheduler in front of every OpenAI call:
+  - token buckets for requests/minute and tokens/minute (RATE_LIMIT_RPM / _TPM),
+    re-calibrated from the x-ratelimit-* response headers;
+  - a priority queue, so a waiting generation call always goes before a waiting
+    summarization call;
+  - retries with jittered exponential backoff on 429s, 5xx and connection errors
+    (honouring Retry-After).
+
+    response = scheduled_create(client, "generation", est_tokens, model=..., messages=...)
+"""
+
+import heapq
+import itertools
+import random
+import re
+import threading
+import time
+from typing import Optional
+
+from config import (
+    RATE_LIMIT_RPM,
+    RATE_LIMIT_TPM,
+    API_MAX_RETRIES,
+    API_BACKOFF_BASE_SEC,
+    API_BACKOFF_MAX_SEC,
+)
+from metrics import inc, observe, set_gauge
+
+PRIORITIES = {"generation": 0, "summary": 1}
+_RETRY_STATUS = {408, 409, 429}
+_DURATION_RE = re.compile(r"([\d.]+)(ms|s|m|h)")
+_UNIT_SEC = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """
+    "1s" / "6m0s" / "120ms" (x-ratelimit-reset-*) -> seconds
+    """
+    parts = _DURATION_RE.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SEC[u] for n, u in parts)
+
+
+class _Bucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.stamp = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.stamp) * self.capacity / 60.0)
+        self.stamp = now
+
+    def wait_for(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it already is)."""
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing * 60.0 / self.capacity
+
+
+class RateLimiter:
+    """
+    Requests and tokens buckets shared by all threads, served in priority order.
+    """
+    def __init__(self, rpm: float = RATE_LIMIT_RPM, tpm: float = RATE_LIMIT_TPM):
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+
+    def acquire(self, est_tokens: int, priority: str = "generation") -> None:
+        """
+        Block until this call may go out: it is the highest-priority waiter and
+        both buckets can cover one request plus `est_tokens`.
+        """
+        ticket = (PRIORITIES.get(priority, len(PRIORITIES)), next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    if self._waiting[0] == ticket:
+                        delay = max(self._paused_until - now,
+                                    self.requests.wait_for(1),
+                                    self.tokens.wait_for(est_tokens))
+                        if delay <= 0:
+                            self.requests.level -= 1
+                            self.tokens.level -= min(est_tokens, self.tokens.capacity)
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        observe("rate_limit_wait_seconds", time.monotonic() - start, priority=priority)
+
+    def settle(self, est_tokens: int, actual_tokens: int) -> None:
+        """Refund (or charge) the difference once the real usage is known."""
+        with self._cond:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + est_tokens - actual_tokens)
+            self._cond.notify_all()
+
+    def update_from_headers(self, headers) -> None:
+        """Adopt the server's view of our limits from x-ratelimit-* headers."""
+        if headers is None:
+            return
+        with self._cond:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                try:
+                    if limit is not None:
+                        bucket.capacity = float(limit)
+                    if remaining is not None:
+                        bucket.level = min(bucket.level, float(remaining))
+                except ValueError:
+                    continue
+                if bucket.level <= 0:
+                    reset = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                    if reset:
+                        self._paused_until = max(self._paused_until, time.monotonic() + reset)
+                set_gauge("rate_limit_capacity", bucket.capacity, kind=kind)
+            self._cond.notify_all()
+
+    def paused_for(self) -> float:
+        """Seconds left of a pause() (0 if callers are not held back)."""
+        with self._cond:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for `seconds` (after a 429)."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.requests.level = min(self.requests.level, 0.0)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RateLimiter()
+        return _scheduler
+
+
+def _retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    Backoff for a retryable `error`, or None if it should be raised.
+    """
+    status = getattr(error, "status_code", None)
+    transient = type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+    if not transient and not (status in _RETRY_STATUS or (status is not None and status >= 500)):
+        return None
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # "full jitter": uniform in [0, base * 2^attempt], capped
+    return random.uniform(0, min(API_BACKOFF_MAX_SEC, API_BACKOFF_BASE_SEC * (2 ** attempt)))
+
+
+def _retry_status(error: Exception) -> str:
+    if type(error).__name__ == "APITimeoutError":
+        return "timeout"
+    return str(getattr(error, "status_code", "conn"))
+
+
+def scheduled_create(client, priority: str, est_tokens: int, on_latency=None, on_send=None, **kwargs):
+    """
+    scheduled_create(client, priority, est_tokens, on_latency=None, on_send=None, **create_kwargs) -> completion or stream
+
+    `client.chat.completions.create(**kwargs)` behind the rate limiter, with retries.
+    Uses `with_raw_response` when the client has it so limits track the headers.
+    `on_latency(seconds)` gets the duration of the successful attempt alone (no
+    rate-limit wait, no failed attempts). `on_send(stamp)` gets time.monotonic()
+    as each attempt goes out, once the limiter let it, and None when that attempt
+    failed and the call is backing off.
+    """
+    limiter = get_rate_limiter()
+    completions = client.chat.completions
+    raw = getattr(completions, "with_raw_response", None)
+
+    for attempt in range(API_MAX_RETRIES + 1):
+        limiter.acquire(est_tokens, priority)
+        sent = time.time()
+        if on_send is not None:
+            on_send(time.monotonic())
+        try:
+            if raw is not None:
+                response = raw.create(**kwargs)
+                limiter.update_from_headers(response.headers)
+                result = response.parse()
+            else:
+                result = completions.create(**kwargs)
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == API_MAX_RETRIES:
+                raise
+            if on_send is not None:
+                on_send(None)
+            inc("api_retries_total", priority=priority, status=_retry_status(e))
+            if getattr(e, "status_code", None) == 429:
+                limiter.pause(delay)
+            print(f"⚠️  {priority} call failed ({type(e).__name__}), retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+
+        if on_latency is not None:
+            on_latency(time.time() - sent)
+        usage = getattr(result, "usage", None)
+        if usage is not None:
+            limiter.settle(est_tokens, usage.prompt_tokens + usage.completion_tokens)
+        return result
+
+
+def scheduled_stream(client, priority: str, est_tokens: int, on_latency=None, on_send=None, **kwargs):
+    """
+    scheduled_stream(client, priority, est_tokens, on_latency=None, on_send=None, **create_kwargs) -> (stream, events)
+
+    scheduled_create(..., stream=True), then read up to the first event with content.
+    A retryable error before that (e.g. a read timeout while waiting for the first
+    token) retries the whole call. `events` replays what was read and continues
+    with the rest of the stream; `stream.close()` still cancels it.
+    `on_latency(seconds)` gets the time to first token of the successful attempt;
+    `on_send` is called as in scheduled_create().
+    """
+    for attempt in range(API_MAX_RETRIES + 1):
+        opened = []
+        stream = scheduled_create(client, priority, est_tokens, on_latency=opened.append, on_send=on_send,
+                                  stream=True, **kwargs)
+        opened_at = time.time()
+        events = iter(stream)
+        head = []
+        try:
+            for event in events:
+                head.append(event)
+                if event.choices and event.choices[0].delta.content:
+                    break
+        except Exception as e:
+            stream.close()
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt == API_MAX_RETRIES:
+                raise
+            if on_send is not None:
+                on_send(None)
+            inc("api_retries_total", priority=priority, status=_retry_status(e))
+            print(f"⚠️  {priority} stream failed ({type(e).__name__}), retry {attempt + 1}/{API_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        if on_latency is not None:
+            on_latency(opened[0] + time.time() - opened_at)
+        return stream, itertools.chain(head, events)
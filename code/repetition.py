@@ -0,0 +1,72 @@
+"""
+repetition.py
+
+Streaming degeneration check for generations. A RepetitionDetector is passed as
+`should_stop` to generate_next_chunk(): every call only scans the text added
+since the previous one, hashing word n-grams the same way as
+utils.shingle_hashes, so the reference set can come straight from STM/LTM text
+(MemoryManager.reference_shingles). Once most of the last REPETITION_WINDOW
+n-grams repeat either this output or the reference, it stops the stream, and
+`trim_at` marks where the repeated tail starts.
+"""
+
+import re
+from collections import deque
+
+from config import REPETITION_NGRAM, REPETITION_WINDOW, REPETITION_THRESHOLD
+
+_WORD_RE = re.compile(r"\S+")
+
+
+class RepetitionDetector:
+    """
+    RepetitionDetector(reference=(), ngram=REPETITION_NGRAM, window=REPETITION_WINDOW,
+                       threshold=REPETITION_THRESHOLD)
+
+    Call it with the text so far (it must only ever grow); returns True once the
+    share of repeated n-grams in the window reaches `threshold`, and from then on.
+    """
+    def __init__(self, reference=(), ngram: int = REPETITION_NGRAM, window: int = REPETITION_WINDOW,
+                 threshold: float = REPETITION_THRESHOLD):
+        self.reference = reference
+        self.ngram = ngram
+        self.threshold = threshold
+        self.trim_at = None  # offset of the first repeated n-gram in the window that tripped
+        self._seen = set()  # n-gram hashes of this output
+        self._words = deque(maxlen=ngram)  # lower-cased words of the current n-gram
+        self._offsets = deque(maxlen=ngram)  # and where each starts
+        self._window = deque(maxlen=window)  # (repeated, offset of the n-gram's first word)
+        self._repeats = 0
+        self._scanned = 0  # text[:_scanned] is done; a word is only read once whitespace follows it
+
+    @property
+    def triggered(self) -> bool:
+        return self.trim_at is not None
+
+    def __call__(self, text: str) -> bool:
+        if self.trim_at is not None:
+            return True
+        end = len(text)
+        while end > self._scanned and not text[end - 1].isspace():
+            end -= 1
+        if end <= self._scanned:
+            return False
+
+        window, words, offsets, seen = self._window, self._words, self._offsets, self._seen
+        for match in _WORD_RE.finditer(text, self._scanned, end):
+            words.append(match.group().lower())
+            offsets.append(match.start())
+            if len(words) < self.ngram:
+                continue
+            h = hash(tuple(words))
+            repeated = h in seen or h in self.reference
+            seen.add(h)
+            if len(window) == window.maxlen:
+                self._repeats -= window[0][0]
+            window.append((repeated, offsets[0]))
+            self._repeats += repeated
+            if len(window) == window.maxlen and self._repeats >= self.threshold * window.maxlen:
+                self.trim_at = next(offset for rep, offset in window if rep)
+                break
+        self._scanned = end
+        return self.trim_at is not None
@@ -0,0 +1,245 @@
+"""
+runner.py
+
+Many infinite loops in one process. Each session has its own prompts, its own
+MemoryManager (with its own vector store namespace), stream log (logs/<name>/)
+and checkpoint (checkpoints/<name>.jsonl); all of them share the OpenAI client
+and rate limiter, the tokenizer and the embedding backend.
+
+    python runner.py --count 8                  # 8 sessions with the default prompts
+    python runner.py --sessions sessions.json   # [{"name": ..., "initial_prompt": ...,
+                                                #   "rand_pool": [...], "continuous_prompt": ...}]
+
+Sessions are asyncio tasks; the blocking work (retrieval, the API call,
+compression backpressure) runs on a thread pool. At most
+RUNNER_MAX_CONCURRENT_GENERATIONS generations are in flight at once, and every
+session stops once their combined spend reaches RUNNER_COST_CAP_USD.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from config import (
+    CONTEXT_LAYOUT,
+    GENERATION_BACKEND,
+    STREAM_GENERATION,
+    CHECKPOINT_PATH,
+    INITIAL_PROMPT,
+    RAND_POOL,
+    DEFAULT_CONTINOUS_PROMPT,
+    RUNNER_MAX_CONCURRENT_GENERATIONS,
+    RUNNER_COST_CAP_USD,
+    SUMMARIZE_THRESHOLD_TOKENS,
+)
+from memory_manager import MemoryManager
+from checkpoint import Checkpointer, load_checkpoint
+from metrics import inc, set_gauge, start_exporter, export_metrics
+from vector_store import flush_vector_store
+from logger import log_text, flush_log
+from main import (
+    generate_next_chunk, generation_cost, with_token_note, repetition_guard, trim_repetition,
+)
+from output_length import OutputLengthScheduler
+
+# used for collection names and directories
+_SESSION_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,39}$")
+
+
+class CostBudget:
+    """
+    Spend shared by all sessions; `exhausted` once it reaches `cap` USD.
+    """
+    def __init__(self, cap: float = RUNNER_COST_CAP_USD):
+        self.cap = cap
+        self.spent = 0.0
+        self._lock = threading.Lock()
+
+    def charge(self, usd: float) -> float:
+        with self._lock:
+            self.spent += usd
+            set_gauge("cost_usd", self.spent)
+            return self.spent
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent >= self.cap
+
+
+class Session:
+    """
+    One infinite loop: prompts, memory, counters and checkpointer.
+    """
+    def __init__(self, name: str, initial_prompt: str = INITIAL_PROMPT,
+                 rand_pool: List[str] = RAND_POOL, continuous_prompt: str = DEFAULT_CONTINOUS_PROMPT):
+        if not _SESSION_NAME_RE.match(name):
+            raise ValueError(f"Invalid session name {name!r} (letters, digits, '_' and '-', max 40)")
+        self.name = name
+        self.initial_prompt = initial_prompt
+        self.rand_pool = list(rand_pool)
+        self.continuous_prompt = continuous_prompt
+        self.memory = MemoryManager(namespace=name)
+        self.lengths = OutputLengthScheduler()  # max_tokens, from this session's own measurements
+        self.checkpoint_path = os.path.join(os.path.dirname(CHECKPOINT_PATH) or ".", f"{name}.jsonl")
+        self.checkpointer = Checkpointer(path=self.checkpoint_path, before_write=flush_vector_store)
+        self.iteration = 0
+        self.input_tokens = self.output_tokens = self.cached_tokens = 0
+        self.last_stats = {}  # _record_generation stats of the latest step
+
+    def counters(self) -> dict:
+        return {"input_tokens": self.input_tokens, "output_tokens": self.output_tokens,
+                "cached_tokens": self.cached_tokens}
+
+    def start(self, resume: bool = False) -> None:
+        """
+        Seed memory with the initial prompt, or restore this session's checkpoint.
+        """
+        if CONTEXT_LAYOUT == "cache":
+            self.memory.pinned_prefix = self.initial_prompt
+        state = load_checkpoint(self.checkpoint_path) if resume else None
+        if state is not None:
+            self.memory.restore(state["memory"])
+            self.iteration = state["iteration"]
+            self.input_tokens = state["counters"]["input_tokens"]
+            self.output_tokens = state["counters"]["output_tokens"]
+            self.cached_tokens = state["counters"].get("cached_tokens", 0)
+        elif CONTEXT_LAYOUT != "cache":
+            self.memory.add_to_STM(self.initial_prompt)
+
+    def next_prompt(self) -> str:
+        if self.rand_pool and random.randint(1, 2) == 1:
+            return random.choice(self.rand_pool)
+        return self.continuous_prompt
+
+    # one iteration, split so only the API call holds a generation slot (all blocking)
+    def prepare(self) -> tuple:
+        """
+        prepare() -> (context, max_tokens)
+        """
+        self.iteration += 1
+        context = self.memory.build_context(user_prompt=self.next_prompt())
+        max_tokens = self.lengths.next_max_tokens(self.memory.last_context_tokens,
+                                                  SUMMARIZE_THRESHOLD_TOKENS - self.memory.STM_token_count)
+        return with_token_note(context, max_tokens) + "in this iteration", max_tokens
+
+    def generate(self, context: str, max_tokens: int) -> str:
+        stats = {}
+        detector = repetition_guard(self.memory)
+        text, input_tokens, output_tokens = generate_next_chunk(
+            context, max_tokens, stream=STREAM_GENERATION, should_stop=detector, iteration=self.iteration,
+            session=self.name, stats=stats,
+        )
+        text = trim_repetition(text, detector, self.name, logged=STREAM_GENERATION)
+        if not STREAM_GENERATION:
+            log_text(text, self.iteration, session=self.name)  # streamed output is already logged
+        self.lengths.observe(stats, max_tokens)
+        self.last_stats = stats
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cached_tokens += stats["cached_tokens"]
+        return text
+
+    def commit(self, text: str) -> None:
+        """
+        Add `text` to STM (may wait for compression to catch up) and maybe checkpoint.
+        """
+        if text.strip():
+            self.memory.add_to_STM(text)
+        self.checkpointer.maybe_save(self.iteration, self.memory, self.counters())
+
+
+async def run_session(session: Session, budget: CostBudget, generations: asyncio.Semaphore) -> None:
+    """
+    Loop `session` until the shared budget is spent. Only the API call holds one of
+    the `generations` slots, so a session waiting on its compressor stalls no one else.
+    """
+    while not budget.exhausted:
+        start = time.time()
+        context, max_tokens = await asyncio.to_thread(session.prepare)
+        async with generations:
+            if budget.exhausted:
+                break
+            text = await asyncio.to_thread(session.generate, context, max_tokens)
+        await asyncio.to_thread(session.commit, text)
+        stats = session.last_stats
+        input_tokens, output_tokens = stats["prompt_tokens"], stats["completion_tokens"]
+        spent = budget.charge(generation_cost(input_tokens, stats["cached_tokens"], output_tokens))
+        inc("tokens_total", input_tokens - stats["cached_tokens"], kind="input", session=session.name)
+        inc("tokens_total", stats["cached_tokens"], kind="cached_input", session=session.name)
+        inc("tokens_total", output_tokens, kind="output", session=session.name)
+        inc("iterations_total", session=session.name)
+        print(f"[{session.name} #{session.iteration}] {len(text.split())} words | "
+              f"{time.time() - start:.2f} sec | {stats['tokens_per_sec']:.1f} tok/s | 💰 total ${spent:.4f}")
+
+
+async def run_sessions(sessions: List[Session], resume: bool = False,
+                       max_concurrent: int = RUNNER_MAX_CONCURRENT_GENERATIONS,
+                       cost_cap: float = RUNNER_COST_CAP_USD) -> CostBudget:
+    """
+    run_sessions(sessions, resume, max_concurrent, cost_cap) -> CostBudget
+
+    Run every session until the combined cost cap is reached.
+    """
+    if GENERATION_BACKEND == "llama":
+        raise ValueError("runner.py needs an API backend: one local llama model cannot serve concurrent sessions")
+    budget = CostBudget(cost_cap)
+    generations = asyncio.Semaphore(max_concurrent)
+    # each session has at most one blocking call outstanding at a time
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=len(sessions), thread_name_prefix="session"))
+    for session in sessions:
+        await asyncio.to_thread(session.start, resume)
+    start_exporter()
+    try:
+        await asyncio.gather(*(run_session(s, budget, generations) for s in sessions))
+        print(f"💸 Reached combined cost cap of ${cost_cap:.2f}. Stopping.")
+    finally:
+        # final snapshots so --resume loses nothing
+        for session in sessions:
+            session.checkpointer.save(session.iteration, session.memory, session.counters())
+        for session in sessions:
+            session.checkpointer.wait()
+        export_metrics()
+    return budget
+
+
+def load_sessions(path: str) -> List[Session]:
+    with open(path, "r", encoding="utf-8") as f:
+        specs = json.load(f)
+    return [
+        Session(
+            spec["name"],
+            initial_prompt=spec.get("initial_prompt", INITIAL_PROMPT),
+            rand_pool=spec.get("rand_pool", RAND_POOL),
+            continuous_prompt=spec.get("continuous_prompt", DEFAULT_CONTINOUS_PROMPT),
+        )
+        for spec in specs
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several infinite loops in one process")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--sessions", help="JSON list of session specs")
+    source.add_argument("--count", type=int, help="N sessions with the default prompts")
+    parser.add_argument("--resume", action="store_true", help="continue every session from its checkpoint")
+    parser.add_argument("--max-concurrent", type=int, default=RUNNER_MAX_CONCURRENT_GENERATIONS)
+    parser.add_argument("--cost-cap", type=float, default=RUNNER_COST_CAP_USD)
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.sessions) if args.sessions else [Session(f"session-{i}") for i in range(args.count)]
+    try:
+        print(f"🚀 {len(sessions)} infinite loops started. Press Ctrl+C to stop.")
+        asyncio.run(run_sessions(sessions, args.resume, args.max_concurrent, args.cost_cap))
+    except KeyboardInterrupt:
+        print("\n⏹️  Keyboard interrupt received. Saving vector store...")
+        flush_vector_store()
+        flush_log()
+        print("👋 Goodbye!")
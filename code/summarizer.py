@@ -4,25 +4,84 @@ summarizer.py
 Functions to compress large text into a concise “memory chunk” using GPT.
 """
 
-from openai import OpenAI
-client = OpenAI()
-from config import SUMMARY_MODEL, OPENAI_API_KEY
-from utils import count_tokens, chunk_text_by_tokens
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from config import (
+    SUMMARY_MODEL,
+    SUMMARY_INPUT_LIMIT_TOKENS,
+    SUMMARY_CHUNK_TOKENS,
+    SUMMARY_CONCURRENCY,
+)
+from utils import count_tokens, chunk_text_by_tokens, tokenized
+from metrics import inc, timed
+from clients import get_openai_client
+from hedging import hedged_create
 
-# Initialize the OpenAI client
-OpenAI.api_key = OPENAI_API_KEY
+def _complete(prompt: str, max_tokens: int) -> str:
+    """
+    _complete(prompt, max_tokens) -> str
+
+    One summarization call against SUMMARY_MODEL.
+    """
+    response = hedged_create(
+        get_openai_client("summary"), "summary",
+        est_tokens=len(prompt) // 4 + max_tokens,  # ~4 chars per token; settled on usage
+        model=SUMMARY_MODEL,  # or whatever summarization model you're using
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.3,
+        max_tokens=max_tokens
+    )
+    inc("summary_calls_total")
+    inc("tokens_total", response.usage.prompt_tokens, kind="summary_input")
+    inc("tokens_total", response.usage.completion_tokens, kind="summary_output")
+    return response.choices[0].message.content.strip()
+
+def _group_by_tokens(texts: List[str], limit: int) -> List[List[str]]:
+    """
+    _group_by_tokens(texts, limit) -> List of groups
+
+    Greedily pack consecutive `texts` into groups of at most `limit` tokens.
+    Every group takes at least two texts (when available) so each reduce level shrinks.
+    """
+    groups, current, current_tokens = [], [], 0
+    for t in texts:
+        t_tokens = count_tokens(t)
+        if len(current) >= 2 and current_tokens + t_tokens > limit:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(t)
+        current_tokens += t_tokens
+    if current:
+        groups.append(current)
+    return groups
 
-def summarize_text(text: str, max_tokens: int = 512) -> str:
+def _report_level(timings: Optional[list], level: int, calls: int, seconds: float) -> None:
     """
-    summarize_text(text, max_tokens) -> str
+    _report_level(timings, level, calls, seconds) -> None
+
+    Record (in `timings`, if given) and print the wall time of one map/reduce level.
+    """
+    if timings is not None:
+        timings.append((level, calls, seconds))
+    print(f"🧾 summarize level {level}: {calls} call(s) in {seconds:.2f} sec")
+
+@timed("summarize")
+def summarize_text(text, max_tokens: int = 512, level_timings: Optional[list] = None) -> str:
+    """
+    summarize_text(text, max_tokens, level_timings=None) -> str
 
     Summarize `text` into a short, cohesive paragraph that captures the gist.
     - We break `text` into smaller chunks if it exceeds the model’s input limit.
-    - Then we summarize each chunk and combine.
+    - Then we summarize the chunks in parallel (map) and combine the partial
+      summaries level by level (tree reduce), so no prompt exceeds the input limit.
 
     Args:
-      text: Original long text to compress.
-      max_tokens: The maximum length of the summary output.
+      text: Original long text to compress (str or TokenizedText; either way it is
+        encoded at most once, and the shards are views of those token ids).
+      max_tokens: The maximum length of the summary output (and of each partial).
+      level_timings: Optional list that gets one (level, calls, seconds) per
+        map/reduce level of this call (nothing for a direct summary).
 
     Returns:
       A string that is the approximate summary of `text`.
@@ -31,44 +90,54 @@ def summarize_text(text: str, max_tokens: int = 512) -> str:
     # ==============================================================================
     # PART 1: small enough to just summarize directly
     # ==============================================================================
-    if count_tokens(text) < 6_000:  # choose a threshold comfortably under the model’s input limit
+    text = tokenized(text)
+    if count_tokens(text) < SUMMARY_INPUT_LIMIT_TOKENS:  # comfortably under the model’s input limit
         prompt = f"Please provide a concise summary (1–2 paragraphs) of the following text:\n\n{text}"
-        response = client.chat.completions.create(
-            model=SUMMARY_MODEL,  # or whatever summarization model you're using
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3,
-            max_tokens=max_tokens
-        )
-        return response.choices[0].message.content.strip()
+        return _complete(prompt, max_tokens)
 
     # ==============================================================================
-    # PART 2: break into sub-chunks, summarize each, then concatenate and re-summarize:
+    # PART 2: map -- summarize every sub-chunk concurrently
     # ==============================================================================
-    chunks = chunk_text_by_tokens(text, max_tokens=4_000)
-    partial_summaries = []
-    for i, c in enumerate(chunks):
-        prompt_chunk = (
-            f"Chunk {i+1}/{len(chunks)}: "
-            "Summarize the following text into 1 paragraph:\n\n" + c
-        )
-        resp = client.chat.completions.create(
-            model=SUMMARY_MODEL,
-            messages=[{"role": "user", "content": prompt_chunk}],
-            temperature=0.3,
-            max_tokens=max_tokens // len(chunks)
-        )
-        partial_summaries.append(resp.choices[0].message.content.strip())
-
-    # Combine partial summaries into one final summary
-    combined = "\n\n".join(partial_summaries)
+    chunks = chunk_text_by_tokens(text, max_tokens=SUMMARY_CHUNK_TOKENS)
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as pool:
+        t0 = time.time()
+        partial_summaries = list(pool.map(
+            lambda ic: _complete(
+                f"Chunk {ic[0]+1}/{len(chunks)}: "
+                "Summarize the following text into 1 paragraph:\n\n" + str(ic[1]),
+                max_tokens,
+            ),
+            enumerate(chunks),
+        ))
+        _report_level(level_timings, 0, len(chunks), time.time() - t0)
+
+        # ==============================================================================
+        # PART 3: reduce -- combine groups that fit the input limit until one group is left
+        # ==============================================================================
+        level = 0
+        groups = _group_by_tokens(partial_summaries, SUMMARY_CHUNK_TOKENS)
+        while len(groups) > 1:
+            level += 1
+            t0 = time.time()
+            partial_summaries = list(pool.map(
+                lambda g: _complete(
+                    "The following are partial summaries of a longer document. "
+                    "Please combine them into a single, concise paragraph:\n\n" + "\n\n".join(g),
+                    max_tokens,
+                ),
+                groups,
+            ))
+            _report_level(level_timings, level, len(groups), time.time() - t0)
+            groups = _group_by_tokens(partial_summaries, SUMMARY_CHUNK_TOKENS)
+
+    # Combine the last group of partial summaries into one final summary
+    if len(groups[0]) == 1:
+        return groups[0][0]  # already a single summary: another call would only rephrase it
+    t0 = time.time()
     final_prompt = (
         "The following are partial summaries of a longer document. "
-        "Please combine them into a single, concise summary:\n\n" + combined
-    )
-    final_resp = client.chat.completions.create(
-        model=SUMMARY_MODEL,
-        messages=[{"role": "user", "content": final_prompt}],
-        temperature=0.3,
-        max_tokens=max_tokens
+        "Please combine them into a single, concise summary:\n\n" + "\n\n".join(groups[0])
     )
-    return final_resp.choices[0].message.content.strip()
+    summary = _complete(final_prompt, max_tokens)
+    _report_level(level_timings, level + 1, 1, time.time() - t0)
+    return summary
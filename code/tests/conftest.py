@@ -0,0 +1,21 @@
+"""
+tests/conftest.py
+
+The modules under code/ import each other flat (`from config import ...`), so the
+tests put that directory on sys.path, and run in a temporary working directory
+so logs, checkpoints and indexes never touch the real ones.
+"""
+
+import os
+import sys
+
+import pytest
+
+CODE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, CODE_DIR)
+
+
+@pytest.fixture(autouse=True)
+def _workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,110 @@
+"""
+tests/fake_openai_server.py
+
+A local HTTP server speaking enough of the OpenAI chat completions API
+(POST /v1/chat/completions, JSON or server-sent events) for the real SDK, so
+timeouts and hedging go through the actual httpx request path.
+
+    with FakeOpenAIServer(models={"slow": 2.0}) as server:   # "slow" stalls 2 s
+        client = OpenAI(base_url=server.base_url, api_key="test", max_retries=0)
+
+Every request sleeps its injected delay before answering (before the first
+event for streams): `models[model]`, or `latency` for the models not listed.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+
+class FakeOpenAIServer:
+    def __init__(self, latency: float = 0.0, models: Dict[str, float] = None, text: str = "one two three four"):
+        self.latency = latency
+        self.models = dict(models or {})
+        self.text = text
+        self.requests: List[dict] = []  # request bodies, in arrival order
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/v1"
+
+    def _delay(self, body: dict) -> float:
+        with self._lock:
+            self.requests.append(body)
+        return self.models.get(body.get("model"), self.latency)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+                if self.path.rstrip("/") != "/v1/chat/completions":
+                    self.send_error(404)
+                    return
+                time.sleep(server._delay(body))
+                try:
+                    if body.get("stream"):
+                        self._stream(body)
+                    else:
+                        self._complete(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client timed out or closed the losing hedge
+
+            def _complete(self, body: dict) -> None:
+                words = server.text.split()
+                payload = json.dumps({
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": server.text}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": len(words),
+                              "total_tokens": 10 + len(words)},
+                }).encode()
+                self.send_response(200)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, body: dict) -> None:
+                self.send_response(200)
+                self.send_header("content-type", "text/event-stream")
+                self.send_header("connection", "close")
+                self.end_headers()
+                for word in server.text.split():
+                    chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0,
+                             "model": body["model"],
+                             "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    words = len(server.text.split())
+                    usage = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0,
+                             "model": body["model"], "choices": [],
+                             "usage": {"prompt_tokens": 10, "completion_tokens": words, "total_tokens": 10 + words}}
+                    self.wfile.write(f"data: {json.dumps(usage)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+    def __enter__(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
@@ -0,0 +1,154 @@
+import sys
+import threading
+
+import pytest
+
+import memory_manager
+from benchmarks.fakes import fake_text, install_fake_vector_store
+from checkpoint import Checkpointer, load_checkpoint, save_checkpoint
+from memory_manager import MemoryManager
+
+
+def _state(iteration: int = 7) -> dict:
+    return {
+        "iteration": iteration,
+        "counters": {"input_tokens": 1200, "output_tokens": 300, "cached_tokens": 800},
+        "memory": {"STM": [("first piece", 2), ("second piece, with ünïcode", 5)],
+                   "LTM_index": [("chunk-a", 0), ("chunk-b", 1)]},
+    }
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / "checkpoints" / "memory.jsonl")
+    save_checkpoint(_state(), path)
+
+    assert load_checkpoint(path) == _state()
+    assert not (tmp_path / "checkpoints" / "memory.jsonl.tmp").exists()
+    assert load_checkpoint(str(tmp_path / "missing.jsonl")) is None
+
+
+def test_unknown_version_is_rejected(tmp_path):
+    path = tmp_path / "memory.jsonl"
+    path.write_text('{"kind": "header", "version": 99, "iteration": 1, "counters": {}}\n')
+    with pytest.raises(ValueError):
+        load_checkpoint(str(path))
+
+
+def test_memory_snapshot_survives_checkpointer_and_restore(tmp_path):
+    path = str(tmp_path / "memory.jsonl")
+    memory = MemoryManager(background=False)
+    memory.restore(_state()["memory"])
+    checkpointer = Checkpointer(path=path, every=5)
+
+    checkpointer.maybe_save(4, memory, {"input_tokens": 1})  # not a multiple of `every`
+    checkpointer.wait()
+    assert load_checkpoint(path) is None
+    checkpointer.maybe_save(5, memory, {"input_tokens": 1})
+    checkpointer.wait()
+
+    restored = MemoryManager(background=False)
+    restored.restore(load_checkpoint(path)["memory"])
+    assert restored.snapshot() == memory.snapshot()
+    assert restored.STM_token_count == 7
+
+
+def test_resume_continues_from_the_checkpoint(monkeypatch):
+    openai = pytest.importorskip("openai")
+    import clients
+    import main
+    from fake_openai_server import FakeOpenAIServer
+
+    # one iteration per main_loop call, no warm-up calls, no vector store
+    monkeypatch.setattr(main, "COST_CAP_USD", 0.0)
+    monkeypatch.setattr(main, "OPENAI_WARMUP_CONNECTIONS", 0)
+    monkeypatch.setattr(main, "API_CALL_SLEEP_SEC", 0)
+    monkeypatch.setattr(memory_manager, "LEXICAL_ARCHIVE", False)
+    monkeypatch.setattr(memory_manager, "query_similar_memory",
+                        lambda query, k, namespace=None: {"documents": [[]], "metadatas": [[]], "distances": [[]]})
+
+    with FakeOpenAIServer(text="a fresh paragraph about the mill") as server:
+        monkeypatch.setitem(clients._overrides, "generation",
+                            openai.OpenAI(base_url=server.base_url, api_key="test", max_retries=0))
+        monkeypatch.setattr(main, "memory", None)
+        main.main_loop(resume=False, pipeline=False)
+        first = load_checkpoint()
+
+        monkeypatch.setattr(main, "memory", None)  # a new process: nothing in RAM
+        main.main_loop(resume=True, pipeline=False)
+        second = load_checkpoint()
+
+    assert first["iteration"] == 1
+    assert second["iteration"] == 2
+    assert [text for text, _ in second["memory"]["STM"]][:len(first["memory"]["STM"])] == \
+        [text for text, _ in first["memory"]["STM"]]
+    assert len(second["memory"]["STM"]) == len(first["memory"]["STM"]) + 1
+    assert second["counters"]["output_tokens"] == 2 * first["counters"]["output_tokens"]
+    assert len(server.requests) == 2
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setitem(sys.modules, "vector_store", sys.modules["vector_store"])
+    fake = install_fake_vector_store()
+    for name, function in (("add_memory_chunk", fake.add_to_vector_store),
+                           ("query_similar_memory", fake.retrieve_similar_memories),
+                           ("get_memories", fake.get_memories), ("delete_memories", fake.delete_memories),
+                           ("embed_documents", fake.embed_documents)):
+        monkeypatch.setattr(memory_manager, name, function)
+    monkeypatch.setattr(memory_manager, "LEXICAL_ARCHIVE", False)
+    # ~40-token pieces, one per chunk, compressed from the third on
+    monkeypatch.setattr(memory_manager, "SUMMARIZE_THRESHOLD_TOKENS", 100)
+    monkeypatch.setattr(memory_manager, "MEMORY_CHUNK_TOKENS", 50)
+    return fake
+
+
+def _pending_snapshot(monkeypatch, path: str) -> tuple:
+    """A checkpoint taken while the summarizer is stuck on one chunk; (memory, summaries) after it answers."""
+    release, summaries = threading.Event(), []
+
+    def slow_summary(text, **_):
+        release.wait(10)
+        summaries.append(str(text))
+        return "summary of " + str(text).split()[0]
+
+    monkeypatch.setattr(memory_manager, "summarize_text", slow_summary)
+    memory = MemoryManager(background=True)
+    for i in range(3):
+        memory.add_to_STM(fake_text(40, seed=i))
+    checkpointer = Checkpointer(path=path)
+    checkpointer.save(3, memory, {})
+    checkpointer.wait()
+    release.set()
+    memory.wait_for_compression()
+    return memory, summaries
+
+
+def test_a_chunk_stored_after_the_checkpoint_is_not_summarized_again(store, monkeypatch, tmp_path):
+    path = str(tmp_path / "memory.jsonl")
+    memory, _ = _pending_snapshot(monkeypatch, path)
+    state = load_checkpoint(path)
+    (chunk_id, pieces), = state["memory"]["pending"]
+    assert pieces == 1 and state["memory"]["LTM_index"] == []
+    assert memory.LTM_index == [(chunk_id, 0)]  # stored under the id the checkpoint recorded
+
+    monkeypatch.setattr(memory_manager, "summarize_text", lambda text, **_: pytest.fail("summarized again"))
+    resumed = MemoryManager(background=False)
+    resumed.restore(state["memory"])
+    assert resumed.LTM_index == [(chunk_id, 0)]
+    assert [str(piece) for piece, _ in resumed.STM_buffer] == [fake_text(40, seed=i) for i in (1, 2)]
+    assert resumed.STM_pending_token_count == 0 and len(store.namespaces[None]) == 1
+
+
+def test_a_chunk_lost_with_the_process_is_summarized_again_under_its_id(store, monkeypatch, tmp_path):
+    path = str(tmp_path / "memory.jsonl")
+    _, summaries = _pending_snapshot(monkeypatch, path)
+    state = load_checkpoint(path)
+    (chunk_id, _), = state["memory"]["pending"]
+    store.namespaces[None].clear()  # the process died before the summary was stored
+
+    resumed = MemoryManager(background=False)
+    resumed.restore(state["memory"])
+    assert summaries[-1] == summaries[0] == fake_text(40, seed=0)
+    assert resumed.LTM_index == [(chunk_id, 0)]
+    assert [doc_id for doc_id, _, _ in store.namespaces[None]] == [chunk_id]
+    assert resumed.STM_pending_token_count == 0 and len(resumed.STM_buffer) == 2
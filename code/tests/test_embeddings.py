@@ -0,0 +1,85 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import embeddings
+from embeddings import CachedEmbedder, EmbeddingCache, HashingEmbedder
+
+
+class _CountingEmbedder(HashingEmbedder):
+    name = "counting"
+
+    def __init__(self):
+        super().__init__(dim=16)
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return super().__call__(texts)
+
+
+def test_cached_vectors_survive_a_restart(tmp_path):
+    backend = _CountingEmbedder()
+    first = CachedEmbedder(backend, cache_dir=str(tmp_path))(["a lighthouse", "a storm", "a lighthouse"])
+    assert backend.texts == ["a lighthouse", "a storm"]  # repeats embedded once
+
+    backend.texts.clear()
+    reopened = CachedEmbedder(backend, cache_dir=str(tmp_path))
+    again = reopened(["a storm", "a lighthouse"])
+    assert backend.texts == [] and reopened.hits == 2
+    np.testing.assert_array_equal(again, first[[1, 0]])
+    reopened(["a keeper"])
+    assert backend.texts == ["a keeper"]
+
+
+def test_meta_json_is_written_after_the_first_rows(tmp_path, monkeypatch):
+    written = []
+    real_open = open
+
+    def recording_open(path, mode="r", *args, **kwargs):
+        if "w" in mode or "a" in mode:
+            written.append(os.path.basename(path))
+        return real_open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(embeddings, "open", recording_open, raising=False)
+    cache = EmbeddingCache(str(tmp_path / "cache"))
+    cache.put_many([EmbeddingCache.key("a")], np.ones((1, 4), dtype=np.float32))
+    cache.put_many([EmbeddingCache.key("b")], np.zeros((1, 4), dtype=np.float32))
+    assert written == ["vectors.f32", "keys.bin", "meta.json.tmp", "vectors.f32", "keys.bin"]
+    assert json.load(real_open(tmp_path / "cache" / "meta.json")) == {"dim": 4}
+
+
+def test_rows_without_meta_json_or_with_a_torn_write_are_dropped(tmp_path):
+    directory = str(tmp_path / "cache")
+    # a crash before meta.json: the rows have no known dim and are ignored
+    cache = EmbeddingCache(directory)
+    with open(cache.vectors_path, "wb") as f:
+        f.write(b"\0" * 12)
+    with open(cache.keys_path, "wb") as f:
+        f.write(EmbeddingCache.key("old"))
+    cache = EmbeddingCache(directory)
+    assert cache.get_many([EmbeddingCache.key("old")]) == [None]
+    cache.put_many([EmbeddingCache.key("a"), EmbeddingCache.key("b")], np.eye(2, 4, dtype=np.float32))
+    assert os.path.getsize(cache.vectors_path) == 2 * 16  # started over
+
+    # a crash halfway through appending a row
+    with open(cache.vectors_path, "ab") as f:
+        f.write(np.ones(4, dtype=np.float32).tobytes()[:10])
+    reopened = EmbeddingCache(directory)
+    a, b = reopened.get_many([EmbeddingCache.key("a"), EmbeddingCache.key("b")])
+    np.testing.assert_array_equal(a, [1, 0, 0, 0])
+    np.testing.assert_array_equal(b, [0, 1, 0, 0])
+    assert os.path.getsize(reopened.vectors_path) == 2 * 16
+
+
+def test_callable_backends_need_a_usable_name():
+    with pytest.raises(ValueError):
+        CachedEmbedder(lambda texts: np.zeros((len(texts), 2)), cache_dir=None)
+
+    def my_model(texts):
+        return np.zeros((len(texts), 2))
+
+    my_model.name = "team/model:v2"
+    assert CachedEmbedder(my_model, cache_dir=None).name == "team_model_v2"
@@ -0,0 +1,124 @@
+"""
+Hedging and per-call deadlines through the real OpenAI SDK against a local fake
+server (tests/fake_openai_server.py) with injected latency.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+openai = pytest.importorskip("openai")
+
+import hedging  # noqa: E402
+import ratelimit  # noqa: E402
+from config import HEDGE_MIN_SAMPLES  # noqa: E402
+from fake_openai_server import FakeOpenAIServer  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "continue"}]
+
+
+@pytest.fixture(autouse=True)
+def _fresh_window(monkeypatch):
+    monkeypatch.setattr(hedging, "latencies", hedging.LatencyWindow())
+    monkeypatch.setattr(hedging, "HEDGE_REQUESTS", True)  # off by default
+    monkeypatch.setattr(hedging, "HEDGE_FALLBACK_MODEL", "fallback")  # tells the two attempts apart
+    monkeypatch.setattr(ratelimit, "API_MAX_RETRIES", 0)
+
+
+def _client(server: FakeOpenAIServer):
+    return openai.OpenAI(base_url=server.base_url, api_key="test", max_retries=0)
+
+
+def _seed(model: str, phase: str, seconds: float = 0.05, max_tokens: int = 16) -> None:
+    # enough fast samples for the window to set a hedge delay and a deadline
+    for _ in range(HEDGE_MIN_SAMPLES):
+        hedging.latencies.observe(hedging.latency_key(model, max_tokens, phase), seconds)
+
+
+def test_slow_call_is_hedged_and_the_duplicate_wins():
+    _seed("hedge-create", "total")
+    before = dict(hedging.hedge_stats)
+    with FakeOpenAIServer(models={"hedge-create": 2.0}) as server:
+        start = time.perf_counter()
+        response = hedging.hedged_create(_client(server), "summary", 100, model="hedge-create",
+                                         messages=MESSAGES, max_tokens=16)
+        elapsed = time.perf_counter() - start
+
+    assert response.choices[0].message.content == server.text
+    assert response.model == "fallback"
+    assert elapsed < 1.0
+    assert sorted(body["model"] for body in server.requests) == ["fallback", "hedge-create"]
+    assert hedging.hedge_stats["hedged"] == before["hedged"] + 1
+    assert hedging.hedge_stats["hedge_wins"] == before["hedge_wins"] + 1
+
+
+def test_fast_call_is_not_hedged():
+    _seed("hedge-fast", "total", seconds=0.5)
+    before = dict(hedging.hedge_stats)
+    with FakeOpenAIServer(latency=0.0) as server:
+        hedging.hedged_create(_client(server), "summary", 100, model="hedge-fast", messages=MESSAGES, max_tokens=16)
+
+    assert len(server.requests) == 1
+    assert hedging.hedge_stats["hedged"] == before["hedged"]
+
+
+def test_stalled_stream_is_hedged_on_time_to_first_token():
+    _seed("hedge-stream", "ttft")
+    before = dict(hedging.hedge_stats)
+    with FakeOpenAIServer(models={"hedge-stream": 2.0}) as server:
+        start = time.perf_counter()
+        stream, events = hedging.hedged_stream(_client(server), "generation", 100, model="hedge-stream",
+                                               messages=MESSAGES, max_tokens=16)
+        text = "".join(e.choices[0].delta.content or "" for e in events if e.choices)
+        elapsed = time.perf_counter() - start
+        stream.close()
+
+    assert text.split() == server.text.split()
+    assert elapsed < 1.0
+    assert hedging.hedge_stats["hedge_wins"] == before["hedge_wins"] + 1
+
+
+def test_deadline_is_enforced_by_the_sdk(monkeypatch):
+    monkeypatch.setattr(hedging, "HEDGE_REQUESTS", False)
+    monkeypatch.setattr(hedging, "HEDGE_TIMEOUT_MIN_SEC", 0.2)
+    _seed("deadline", "total")  # 3 * p99 = 0.15 s, clamped up to 0.2 s
+    with FakeOpenAIServer(latency=2.0) as server:
+        start = time.perf_counter()
+        with pytest.raises(openai.APITimeoutError):
+            hedging.hedged_create(_client(server), "summary", 100, model="deadline", messages=MESSAGES, max_tokens=16)
+        elapsed = time.perf_counter() - start
+
+    assert elapsed < 1.5
+
+
+def test_time_queued_for_a_worker_does_not_count_toward_the_hedge_delay(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(hedging, "_executor", pool)
+    _seed("queued", "total")
+    before = dict(hedging.hedge_stats)
+    try:
+        pool.submit(time.sleep, 0.5)  # the only worker is busy: the primary waits in the queue
+        with FakeOpenAIServer(latency=0.0) as server:
+            hedging.hedged_create(_client(server), "summary", 100, model="queued", messages=MESSAGES, max_tokens=16)
+    finally:
+        pool.shutdown(wait=True)
+
+    assert len(server.requests) == 1
+    assert hedging.hedge_stats["hedged"] == before["hedged"]
+
+
+def test_rate_limit_waits_do_not_count_toward_the_hedge_delay(monkeypatch):
+    limiter = ratelimit.RateLimiter(rpm=10_000, tpm=6_000)  # 100 tokens a second
+    limiter.tokens.level = 0.0  # the primary waits ~0.5 s for its 50 tokens
+    monkeypatch.setattr(ratelimit, "_scheduler", limiter)
+    _seed("throttled", "total")
+    before = dict(hedging.hedge_stats)
+    with FakeOpenAIServer(latency=0.0) as server:
+        start = time.perf_counter()
+        hedging.hedged_create(_client(server), "summary", 50, model="throttled", messages=MESSAGES, max_tokens=16)
+        elapsed = time.perf_counter() - start
+
+    assert elapsed > 0.3
+    assert len(server.requests) == 1
+    assert hedging.hedge_stats["hedged"] == before["hedged"]
@@ -0,0 +1,78 @@
+import memory_manager
+from lexical_index import LexicalIndex
+from memory_manager import MemoryManager
+
+FILLER = "the river ran past the old mill and the road went on toward the hills"
+
+
+def _corpus() -> list:
+    return [
+        FILLER,
+        "Treaty of Alvarenga signed in 1742 " + FILLER,              # 1: rare name once, long
+        "Alvarenga Alvarenga the Alvarenga archive " + FILLER,        # 2: rare name three times
+        "Alvarenga",                                                  # 3: rare name once, very short
+        "a ledger of the mill accounts " + FILLER,
+    ]
+
+
+def test_bm25_ranks_by_term_frequency_and_length(tmp_path):
+    index = LexicalIndex(str(tmp_path / "archive"))
+    assert index.add(_corpus(), [{"n": i} for i in range(5)]) == [0, 1, 2, 3, 4]
+
+    hits = index.search("alvarenga", k=10)
+    assert hits["ids"] == [3, 2, 1]  # short doc, then tf 3 over tf 1 at similar length
+    assert hits["scores"] == sorted(hits["scores"], reverse=True)
+    assert hits["documents"][0] == "Alvarenga"
+    assert hits["metadatas"][1] == {"n": 2}
+    assert index.search("nothing matches this", k=10)["ids"] == []
+
+
+def test_rarer_query_terms_outweigh_common_ones(tmp_path):
+    index = LexicalIndex(str(tmp_path / "archive"))
+    index.add(_corpus())
+
+    # "mill" is in four documents, "ledger" in one
+    assert index.search("mill ledger", k=1)["ids"] == [4]
+    # terms in more than max_df of the documents are not scored at all
+    assert index.search("the 1742", k=10, max_df=0.5)["ids"] == [1]
+
+
+def test_segments_merges_and_reopen_give_the_same_results(tmp_path):
+    directory = str(tmp_path / "archive")
+    index = LexicalIndex(directory, segment_docs=4, merge_fanout=2)
+    texts = [f"entry {i} " + ("Alvarenga " * (i % 3)) + FILLER for i in range(37)]
+    for start in range(0, len(texts), 3):
+        index.add(texts[start:start + 3])
+    expected = index.search("alvarenga entry 12", k=8)
+    assert index.count() == 37
+    assert len(index.segments) < 37 // 4  # flushed every 4 documents, then merged pairwise
+
+    in_memory = LexicalIndex(str(tmp_path / "one-segment"), segment_docs=10_000)
+    in_memory.add(texts)
+    assert in_memory.search("alvarenga entry 12", k=8)["ids"] == expected["ids"]
+
+    reopened = LexicalIndex(directory, segment_docs=4, merge_fanout=2)
+    assert reopened.count() == 37
+    assert reopened.search("alvarenga entry 12", k=8) == expected
+
+
+def test_archive_hits_are_fused_by_reciprocal_rank(tmp_path, monkeypatch):
+    archive = LexicalIndex(str(tmp_path / "archive"))
+    archive.add(["Alvarenga Alvarenga treaty", "Alvarenga treaty " + FILLER, FILLER],
+                [{"tokens": 5}, {"tokens": 20}, {"tokens": 15}])
+    summaries = {"documents": [["summary A", "summary B", "summary C"]],
+                 "metadatas": [[{"tokens": 3}, {"tokens": 3}, {"tokens": 3}]],
+                 "distances": [[0.1, 0.2, 0.3]]}
+    monkeypatch.setattr(memory_manager, "query_similar_memory", lambda query, k, namespace=None: summaries)
+    monkeypatch.setattr(memory_manager, "LEXICAL_ARCHIVE", True)
+    monkeypatch.setattr(memory_manager, "LTM_MMR_LAMBDA", 1.0)  # plain relevance, no embedding calls
+    memory = MemoryManager(background=False)
+    monkeypatch.setattr(memory, "_archive", lambda: archive)
+
+    texts, tokens, stats = memory._select_LTM("Alvarenga treaty", top_k=5)
+
+    # 1 / (K + rank): equal ranks tie, and the vector store's candidate comes first
+    assert texts == ["summary A", "Alvarenga Alvarenga treaty", "summary B",
+                     "Alvarenga treaty " + FILLER, "summary C"]
+    assert tokens == [3, 5, 3, 20, 3]
+    assert stats["candidates"] == 5 and stats["archived"] == 2 and stats["injected_archived"] == 2
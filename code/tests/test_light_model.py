@@ -0,0 +1,67 @@
+from benchmarks.fakes import FakeLlama
+from gaslighting.light_model import LlamaBackend
+
+
+class _RecordingLlama(FakeLlama):
+    """FakeLlama that keeps every batch it evaluates."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.evals = []
+
+    def _eval(self, tokens):
+        self.evals.append(list(tokens))
+        super()._eval(tokens)
+
+
+def _backend(n_ctx: int = 256) -> LlamaBackend:
+    return LlamaBackend(n_ctx=n_ctx, system_prefix="you are the narrator", llm=_RecordingLlama())
+
+
+def _words(llm: FakeLlama, text: str) -> list:
+    return llm.tokenize(text.encode("utf-8"), add_bos=False)
+
+
+def test_a_shared_prefix_is_not_evaluated_again():
+    backend = _backend()
+    llm = backend.llm
+    backend.complete("the keeper lit the lamp", max_tokens=3)
+    first = backend.tokens[:-3]
+    assert llm.evals[0] == first  # the whole prompt, once
+
+    llm.evals.clear()
+    backend.complete("the keeper lit the lamp and waited", max_tokens=3)
+    assert llm.evals[0] == _words(llm, "and waited")
+    assert backend.last_stats["reused_tokens"] == len(first)
+    assert backend.last_stats["prefilled_tokens"] == 2
+
+    # continuing the sequence: only the last generated token (never evaluated) and the new text
+    llm.evals.clear()
+    sequence = list(backend.tokens)
+    backend.complete("go on", max_tokens=3, continue_sequence=True)
+    assert llm.evals[0] == sequence[-1:] + _words(llm, "go on")
+    assert backend.tokens[:len(sequence)] == sequence
+
+
+def test_a_diverging_prompt_resets_the_cache_after_the_pinned_prefix():
+    backend = _backend()
+    llm = backend.llm
+    prefix = llm.tokenize(b"you are the narrator")
+    backend.complete("the keeper lit the lamp", max_tokens=3)
+
+    llm.evals.clear()
+    backend.complete("a storm took the lantern", max_tokens=3)
+    assert llm.evals[0] == _words(llm, "a storm took the lantern")
+    assert backend.last_stats["reused_tokens"] == len(prefix)
+    assert llm.input_ids == backend.tokens[:-1]  # nothing of the old prompt is left in the cache
+    assert sum(len(batch) for batch in llm.evals) == len(backend.tokens) - len(prefix) - 1
+
+
+def test_a_full_window_keeps_the_prefix_and_evicts_the_oldest_half():
+    backend = _backend(n_ctx=32)
+    llm = backend.llm
+    prefix = llm.tokenize(b"you are the narrator")
+    backend.complete("the keeper lit the lamp", max_tokens=60, stop_at_eos=False)
+
+    assert backend.last_stats["completion_tokens"] == 60 and backend.last_stats["evictions"] >= 2
+    assert backend.tokens[:len(prefix)] == prefix and len(backend.tokens) < 32
+    assert all(batch[:len(prefix)] != prefix for batch in llm.evals[1:])  # the prefix stays cached
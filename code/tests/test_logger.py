@@ -0,0 +1,68 @@
+import os
+import time
+
+import logger
+from logger import LogWriter, find_iteration, read_iteration
+
+
+def _writer(tmp_path) -> LogWriter:
+    # find_iteration resolves the active segment by STREAM_LOG_FILE's name, next to the index
+    return LogWriter(path=str(tmp_path / os.path.basename(logger.STREAM_LOG_FILE)),
+                     index_path=str(tmp_path / "stream.index.jsonl"))
+
+
+def _log(writer: LogWriter, entries) -> None:
+    for iteration, text in entries:
+        writer.start_entry(f"header {iteration}\n", iteration)
+        writer.write(text + "\n\n")
+    writer.flush()
+
+
+def test_find_iteration_returns_the_byte_range_of_each_entry(tmp_path):
+    writer = _writer(tmp_path)
+    _log(writer, [(1, "first entry"), (2, "second entry, ünïcode"), (3, "third entry")])
+    writer.close()
+    index = str(tmp_path / "stream.index.jsonl")
+
+    path, start, end = find_iteration(2, index)
+    assert path == writer.path
+    with open(path, "rb") as f:
+        f.seek(start)
+        assert f.read(end - start).decode("utf-8") == "header 2\nsecond entry, ünïcode\n\n"
+    assert find_iteration(3, index)[2] is None  # the last entry runs to the end of the segment
+    assert find_iteration(99, index) is None
+    assert read_iteration(1, index) == "header 1\nfirst entry"
+
+
+def test_the_latest_entry_of_a_repeated_iteration_wins(tmp_path):
+    writer = _writer(tmp_path)
+    _log(writer, [(1, "one"), (2, "two, first try"), (2, "two, after resume"), (3, "three")])
+    writer.close()
+
+    assert read_iteration(2, str(tmp_path / "stream.index.jsonl")) == "header 2\ntwo, after resume"
+
+
+def test_entries_in_rotated_and_compressed_segments_are_found(tmp_path, monkeypatch):
+    monkeypatch.setattr(logger, "LOG_ROTATE_BYTES", 40)
+    monkeypatch.setattr(logger, "LOG_COMPRESSION", "gzip")
+    writer = _writer(tmp_path)
+    texts = {i: f"entry number {i} " + "x" * 30 for i in range(1, 6)}
+    _log(writer, texts.items())
+    writer.close()
+    index = str(tmp_path / "stream.index.jsonl")
+
+    for _ in range(100):  # compression runs on its own thread
+        if not any(name.endswith(".txt") and name != "stream.txt" for name in os.listdir(tmp_path)):
+            break
+        time.sleep(0.01)
+    assert find_iteration(1, index)[0].endswith(".gz")
+    assert find_iteration(5, index)[0] == writer.path
+    for iteration, text in texts.items():
+        assert read_iteration(iteration, index) == f"header {iteration}\n{text}"
+
+    # a new writer continues the segment numbering instead of reusing closed names
+    reopened = _writer(tmp_path)
+    _log(reopened, [(6, "after restart")])
+    reopened.close()
+    assert read_iteration(6, index) == "header 6\nafter restart"
+    assert read_iteration(1, index) == f"header 1\n{texts[1]}"
@@ -0,0 +1,278 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import memory_manager
+import metrics
+from benchmarks.fakes import fake_text, install_fake_vector_store
+from config import LTM_SHINGLE_WORDS
+from memory_manager import MemoryManager
+from utils import TokenizedText, get_encoder, shingle_hashes
+
+
+@pytest.fixture
+def store(monkeypatch):
+    # the in-memory vector store from benchmarks/fakes.py, and a summarizer that keeps the first words
+    monkeypatch.setitem(sys.modules, "vector_store", sys.modules["vector_store"])
+    fake = install_fake_vector_store()
+    monkeypatch.setattr(memory_manager, "add_memory_chunk", fake.add_to_vector_store)
+    monkeypatch.setattr(memory_manager, "query_similar_memory", fake.retrieve_similar_memories)
+    monkeypatch.setattr(memory_manager, "get_memories", fake.get_memories)
+    monkeypatch.setattr(memory_manager, "delete_memories", fake.delete_memories)
+    monkeypatch.setattr(memory_manager, "embed_documents", fake.embed_documents)
+    monkeypatch.setattr(memory_manager, "summarize_text", lambda text, **_: " ".join(str(text).split()[:20]))
+    monkeypatch.setattr(memory_manager, "LEXICAL_ARCHIVE", False)
+    return fake
+
+
+@pytest.fixture
+def small(monkeypatch):
+    # ~40-token pieces: one per compressed chunk, compression after the third
+    monkeypatch.setattr(memory_manager, "SUMMARIZE_THRESHOLD_TOKENS", 100)
+    monkeypatch.setattr(memory_manager, "MEMORY_CHUNK_TOKENS", 50)
+    monkeypatch.setattr(memory_manager, "COMPRESSION_HIGH_WATER_TOKENS", 100)
+
+
+def _count(name: str, **labels) -> float:
+    return metrics._counters.get(metrics._key(name, labels), 0)
+
+
+def _wait_until(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _add_all(memory: MemoryManager, n: int, timeout: float = 10.0) -> None:
+    # on a thread, so a wedged worker fails the test instead of hanging it
+    adder = threading.Thread(target=lambda: [memory.add_to_STM(fake_text(40, seed=i)) for i in range(n)],
+                             daemon=True)
+    adder.start()
+    adder.join(timeout)
+    assert not adder.is_alive(), "add_to_STM is stuck behind the compression worker"
+
+
+def test_a_failing_consolidation_fetch_does_not_stop_the_worker(store, small, monkeypatch):
+    def unavailable(ids, namespace=None):
+        raise ConnectionError("vector store unavailable")
+
+    monkeypatch.setattr(memory_manager, "get_memories", unavailable)
+    monkeypatch.setattr(memory_manager, "LTM_CONSOLIDATION_FANOUT", 1)
+    memory = MemoryManager(background=True)
+
+    _add_all(memory, 30)
+    memory.wait_for_compression()
+    assert memory._worker.is_alive()
+    assert memory.STM_pending_token_count == 0
+    assert all(tier == 0 for _, tier in memory.LTM_index)  # nothing consolidated, nothing lost
+    assert len(memory.LTM_index) == len(store.namespaces[None])
+
+
+def test_the_worker_survives_an_unexpected_error(store, small, monkeypatch):
+    def broken(self):
+        raise RuntimeError("bug in consolidation")
+
+    monkeypatch.setattr(MemoryManager, "_consolidate", broken)
+    memory = MemoryManager(background=True)
+
+    _add_all(memory, 30)
+    memory.wait_for_compression()
+    assert memory._worker.is_alive()
+    assert memory.STM_pending_token_count == 0
+    assert len(memory.LTM_index) > 1
+
+
+def test_evicted_pieces_stay_in_context_and_backpressure_holds_the_loop(store, small, monkeypatch):
+    release = threading.Event()
+
+    def slow_summary(text, **_):
+        release.wait(10)
+        return " ".join(str(text).split()[:20])
+
+    monkeypatch.setattr(memory_manager, "summarize_text", slow_summary)
+    memory = MemoryManager(background=True)
+    pieces = [fake_text(40, seed=i) for i in range(8)]
+    adder = threading.Thread(target=lambda: [memory.add_to_STM(p) for p in pieces], daemon=True)
+    adder.start()
+
+    # the summarizer is stuck: eviction hands pieces to STM_pending until the high-water mark
+    _wait_until(lambda: memory.STM_pending_token_count > memory_manager.COMPRESSION_HIGH_WATER_TOKENS)
+    time.sleep(0.1)
+    assert adder.is_alive()
+    added = len(memory.STM_pending) + len(memory.STM_buffer)
+    assert added < len(pieces)
+    context = memory.build_context(layout="classic")
+    assert all(piece in context for piece in pieces[:added])  # nothing leaves context before LTM has it
+
+    release.set()
+    adder.join(10)
+    assert not adder.is_alive()
+    memory.wait_for_compression()
+    assert memory.STM_pending_token_count == 0 and not memory.STM_pending
+    assert len(memory.LTM_index) == len(store.namespaces[None]) > 0
+
+
+def test_a_failed_summary_is_retried(store, small, monkeypatch):
+    monkeypatch.setattr(memory_manager, "COMPRESSION_RETRY_BACKOFF_SEC", 0)
+    calls = []
+
+    def flaky(text, **_):
+        calls.append(str(text))
+        if len(calls) < 3:
+            raise ConnectionError("summarizer unavailable")
+        return "a summary"
+
+    monkeypatch.setattr(memory_manager, "summarize_text", flaky)
+    memory = MemoryManager(background=False)
+    for i in range(3):
+        memory.add_to_STM(fake_text(40, seed=i))
+
+    assert len(calls) == 3 and calls[0] == calls[2]
+    assert [text for _, text, _ in store.namespaces[None]] == ["a summary"]
+    assert len(memory.LTM_index) == 1 and memory.STM_pending_token_count == 0
+
+
+def test_pieces_are_dropped_only_after_the_retries(store, small, monkeypatch):
+    monkeypatch.setattr(memory_manager, "COMPRESSION_RETRY_BACKOFF_SEC", 0)
+    monkeypatch.setattr(memory_manager, "COMPRESSION_MAX_RETRIES", 2)
+    calls = []
+
+    def down(text, **_):
+        calls.append(text)
+        raise ConnectionError("summarizer unavailable")
+
+    monkeypatch.setattr(memory_manager, "summarize_text", down)
+    dropped = _count("compressions_total", result="dropped")
+    memory = MemoryManager(background=False)
+    for i in range(3):
+        memory.add_to_STM(fake_text(40, seed=i))
+
+    assert len(calls) == 3
+    assert memory.LTM_index == [] and memory.STM_pending_token_count == 0
+    assert _count("compressions_total", result="dropped") == dropped + 1
+
+
+def test_context_packs_the_newest_pieces_from_cached_counts(store, monkeypatch):
+    memory = MemoryManager(background=False)
+    pieces = [fake_text(40, seed=i) for i in range(6)]
+    for piece in pieces:
+        memory.add_to_STM(piece)
+    counts = [memory_manager.count_tokens(piece) for piece in pieces]
+    prompt = "remember who you are"
+    fits = memory_manager.count_tokens(prompt) + 1 + sum(c + 1 for c in counts[-3:])
+    monkeypatch.setattr(memory_manager, "CONTEXT_WINDOW_TOKENS", fits + counts[2] // 2)
+    counted = []
+    real_count = memory_manager.count_tokens
+    monkeypatch.setattr(memory_manager, "count_tokens", lambda text: counted.append(str(text)) or real_count(text))
+
+    context = memory.build_context(user_prompt=prompt, layout="classic")
+
+    assert context == "\n".join([prompt] + pieces[-3:])
+    assert [str(piece) for piece, _ in memory.STM_buffer] == pieces[-3:]  # the rest no longer fits
+    assert memory.STM_token_count == sum(counts[-3:])
+    assert memory.last_context_tokens == fits
+    assert not set(pieces) & set(counted)  # STM pieces are never re-encoded
+
+
+def test_cache_layout_keeps_everything_before_the_stm_tail_identical(store, monkeypatch):
+    queries = []
+    monkeypatch.setattr(memory_manager, "query_similar_memory",
+                        lambda text, **kw: queries.append(text) or store.retrieve_similar_memories(text, **kw))
+    store.add_to_vector_store("the lighthouse keeper kept a log of every ship", {"tier": 0})
+    memory = MemoryManager(background=False)
+    memory.pinned_prefix = "You are the narrator."
+    memory.add_to_STM(fake_text(40, seed=1))
+
+    first = memory.build_context(user_prompt="Continue the story.", layout="cache")
+    memory.add_to_STM(fake_text(40, seed=2))
+    second = memory.build_context(user_prompt="And then?", layout="cache")
+
+    head = "You are the narrator.\nthe lighthouse keeper kept a log of every ship\n"
+    assert first.startswith(head + fake_text(40, seed=1)) and second.startswith(head + fake_text(40, seed=1))
+    assert first.endswith("\nContinue the story.") and second.endswith("\nAnd then?")
+    assert len(queries) == 1  # the LTM block was reused
+
+    store.add_to_vector_store("a storm took the lantern", {"tier": 0})
+    memory._LTM_version += 1  # as a commit to LTM does
+    third = memory.build_context(user_prompt="And then?", layout="cache")
+    assert len(queries) == 2 and "a storm took the lantern" in third
+
+
+def test_ltm_selection_drops_stm_repeats_near_duplicates_and_what_does_not_fit(store, monkeypatch):
+    stm = fake_text(40, seed=1)
+    alpha = "the lighthouse keeper kept a log of every ship that passed"
+    beta = "a storm took the lantern and the keeper rowed out to fetch it"
+    candidates = [(stm, 40), (alpha, 12), (alpha, 12), (fake_text(200, seed=3), 200), (beta, 14)]
+    results = {"documents": [[text for text, _ in candidates]],
+               "metadatas": [[{"tier": 0, "tokens": tokens} for _, tokens in candidates]],
+               "distances": [[0.1 * (i + 1) for i in range(len(candidates))]]}
+    monkeypatch.setattr(memory_manager, "query_similar_memory", lambda text, **kw: results)
+    memory = MemoryManager(background=False)
+
+    exclude = shingle_hashes(stm, LTM_SHINGLE_WORDS)
+    texts, tokens, stats = memory._select_LTM(stm, top_k=3, token_budget=100, exclude=exclude)
+
+    assert texts == [alpha, beta] and tokens == [12, 14]
+    assert (stats["stm_duplicates"], stats["similar"], stats["over_budget"]) == (1, 1, 1)
+    assert stats["injected_tokens"] == 13 + 15
+    assert stats["saved_tokens"] == (41 + 13 + 13) - (13 + 15)  # against the plain top 3
+
+
+def test_compression_summarizes_the_pieces_ids_without_re_encoding(store, small, monkeypatch):
+    received = []
+    monkeypatch.setattr(memory_manager, "summarize_text", lambda text, **_: received.append(text) or "a summary")
+    pieces = [TokenizedText(fake_text(40, seed=i)) for i in range(4)]
+    for piece in pieces:
+        piece.ids  # as the generation loop hands them over
+    encoded = []
+    encoder = get_encoder()
+    real_encode = encoder.encode
+    monkeypatch.setattr(encoder, "encode", lambda text, *a, **kw: encoded.append(text) or real_encode(text, *a, **kw))
+
+    memory = MemoryManager(background=False)
+    for piece in pieces:
+        memory.add_to_STM(piece)
+
+    assert set(encoded) <= {"\n", "a summary"}  # separators and the stored summary only
+    assert [str(text) for text in received] == [str(pieces[0]), str(pieces[1])]
+    assert all(isinstance(text, TokenizedText) for text in received)
+    assert received[1].ids.tolist() == pieces[1].ids.tolist()
+
+
+def test_a_prefetched_block_drops_summaries_that_stm_now_repeats(store, monkeypatch):
+    lighthouse = "the lighthouse keeper kept a log of every ship that passed the point"
+    storm = "a storm took the lantern and the keeper rowed out to fetch it back"
+    for text in (lighthouse, storm):
+        store.add_to_vector_store(text, {"tier": 0})
+    memory = MemoryManager(background=False)
+    memory.add_to_STM(fake_text(40, seed=1))
+    skeleton = memory.prefetch_context(layout="classic")
+    assert sorted(skeleton["LTM"][0]) == [storm, lighthouse]
+
+    memory.add_to_STM(storm)  # the generation in flight while prefetching
+    rechecked = _count("context_prefetch_rechecked_total", result="dropped")
+    context = memory.build_context(skeleton=skeleton)
+
+    assert context.count(storm) == 1 and lighthouse in context
+    assert memory.last_LTM_stats["stm_duplicates"] == 1 and memory.last_LTM_stats["injected"] == 1
+    assert _count("context_prefetch_rechecked_total", result="dropped") == rechecked + 1
+    # the dropped summary's tokens go back to STM
+    assert memory._recheck_LTM(skeleton)["budget"] == skeleton["budget"] + memory_manager.count_tokens(storm) + 1
+
+
+def test_a_prefetch_from_before_an_ltm_change_is_rebuilt(store, monkeypatch):
+    memory = MemoryManager(background=False)
+    memory.add_to_STM(fake_text(40, seed=1))
+    skeleton = memory.prefetch_context(user_prompt="Continue.", layout="classic")
+    assert skeleton["LTM"][0] == []
+
+    store.add_to_vector_store("the lighthouse keeper kept a log of every ship", {"tier": 0})
+    memory._LTM_version += 1  # the compression worker committed meanwhile
+    stale = _count("context_prefetch_total", result="stale")
+    context = memory.build_context(skeleton=skeleton)
+
+    assert context.startswith("Continue.\nthe lighthouse keeper kept a log of every ship\n")
+    assert _count("context_prefetch_total", result="stale") == stale + 1
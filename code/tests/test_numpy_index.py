@@ -0,0 +1,160 @@
+import os
+
+import numpy as np
+import pytest
+
+from numpy_index import NumpyVectorIndex
+
+
+def _vectors(n: int, dim: int = 8, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def _fill(index: NumpyVectorIndex, vectors: np.ndarray) -> list:
+    ids = [f"id{i}" for i in range(len(vectors))]
+    index.add(ids, [f"doc {i}" for i in ids], [{"n": i} for i in range(len(vectors))], embeddings=vectors)
+    return ids
+
+
+def test_query_returns_nearest_rows_by_squared_l2(tmp_path):
+    vectors = _vectors(50)
+    index = NumpyVectorIndex(str(tmp_path / "index"))
+    _fill(index, vectors)
+
+    result = index.query([vectors[7]], n_results=3)
+    expected = np.argsort(((vectors - vectors[7]) ** 2).sum(axis=1))[:3]
+    assert result["ids"][0] == [f"id{i}" for i in expected]
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=1e-4)
+    assert result["documents"][0][0] == "doc id7"
+    assert result["metadatas"][0][0] == {"n": 7}
+    assert index.count() == 50
+
+
+def test_add_rejects_missing_embeddings_and_other_dimensions(tmp_path):
+    index = NumpyVectorIndex(str(tmp_path / "index"))
+    with pytest.raises(ValueError):
+        index.add(["a"], ["doc"])
+    index.add(["a"], ["doc"], embeddings=_vectors(1, dim=4))
+    with pytest.raises(ValueError):
+        index.add(["b"], ["doc"], embeddings=_vectors(1, dim=5))
+
+
+def test_deleted_rows_disappear_from_query_get_and_count(tmp_path):
+    vectors = _vectors(20)
+    index = NumpyVectorIndex(str(tmp_path / "index"))
+    _fill(index, vectors)
+
+    index.delete(["id3", "id4", "unknown"])
+    assert index.count() == 18
+    assert index.get(["id3", "id5"])["ids"] == ["id5"]
+    assert "id3" not in index.query([vectors[3]], n_results=20)["ids"][0]
+
+
+def test_reopen_keeps_rows_and_tombstones(tmp_path):
+    directory = str(tmp_path / "index")
+    vectors = _vectors(30)
+    index = NumpyVectorIndex(directory)
+    _fill(index, vectors)
+    index.delete(["id1"])
+    before = index.query([vectors[2]], n_results=5)
+
+    reopened = NumpyVectorIndex(directory)
+    assert reopened.count() == 29
+    assert reopened.query([vectors[2]], n_results=5) == before
+    assert reopened.get(["id1", "id2"])["ids"] == ["id2"]
+
+
+def test_compaction_rewrites_live_rows(tmp_path):
+    directory = str(tmp_path / "index")
+    vectors = _vectors(100)
+    index = NumpyVectorIndex(directory)
+    ids = _fill(index, vectors)
+
+    index.delete(ids[:60])  # under the minimum: tombstones only
+    assert os.path.getsize(os.path.join(directory, "norms.f32")) == 100 * 4
+    index.delete(ids[60:64])  # 64 dead rows, over half of them: rewritten
+    assert os.path.getsize(os.path.join(directory, "norms.f32")) == 36 * 4
+    assert not os.path.exists(directory + ".old") and not os.path.exists(directory + ".tmp")
+
+    for reader in (index, NumpyVectorIndex(directory)):
+        assert reader.count() == 36
+        assert reader.query([vectors[80]], n_results=1)["ids"][0] == ["id80"]
+        assert reader.get(["id10", "id70"])["ids"] == ["id70"]
+
+
+def test_quantized_index_ranks_like_float32(tmp_path):
+    vectors = _vectors(200, dim=32)
+    exact = NumpyVectorIndex(str(tmp_path / "f32"))
+    quantized = NumpyVectorIndex(str(tmp_path / "i8"), quantize=True)
+    _fill(exact, vectors)
+    _fill(quantized, vectors)
+
+    assert os.path.exists(str(tmp_path / "i8" / "vectors.i8"))
+    assert os.path.getsize(str(tmp_path / "i8" / "vectors.i8")) == 200 * 32
+    for q in vectors[:10]:
+        top_exact = exact.query([q], n_results=5)
+        top_quantized = quantized.query([q], n_results=5)
+        assert top_quantized["ids"][0][0] == top_exact["ids"][0][0]
+        assert len(set(top_quantized["ids"][0]) & set(top_exact["ids"][0])) >= 4
+    reopened = NumpyVectorIndex(str(tmp_path / "i8"))
+    assert reopened.quantize and reopened.query([vectors[0]], n_results=1)["ids"][0] == ["id0"]
+
+
+def test_open_reads_the_offsets_sidecar_not_the_documents(tmp_path, monkeypatch):
+    import numpy_index
+    directory = str(tmp_path / "index")
+    vectors = _vectors(40)
+    _fill(NumpyVectorIndex(directory), vectors)
+    reads = []
+
+    def recording_open(path, mode="r", *args, **kwargs):
+        if "r" in mode and "+" not in mode:
+            reads.append(os.path.basename(path))
+        return open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(numpy_index, "open", recording_open, raising=False)
+    reopened = NumpyVectorIndex(directory)
+    assert reads == ["meta.json"]
+    assert reopened.count() == 40
+    assert reopened.get(["id5"])["documents"] == ["doc id5"]
+    assert reopened.query([vectors[9]], n_results=1)["ids"][0] == ["id9"]
+
+
+def test_a_missing_sidecar_is_rebuilt_from_the_documents(tmp_path):
+    directory = str(tmp_path / "index")
+    vectors = _vectors(25)
+    index = NumpyVectorIndex(directory)
+    _fill(index, vectors)
+    index.delete(["id2"])
+    sizes = {name: os.path.getsize(os.path.join(directory, name)) for name in ("offsets.u64", "ids.jsonl")}
+    for name in sizes:
+        os.remove(os.path.join(directory, name))  # an index from before the sidecar
+
+    reopened = NumpyVectorIndex(directory)
+    assert {name: os.path.getsize(os.path.join(directory, name)) for name in sizes} == sizes
+    assert reopened.count() == 24
+    assert reopened.get(["id2", "id24"])["ids"] == ["id24"]
+    assert reopened.query([vectors[17]], n_results=1)["ids"][0] == ["id17"]
+
+
+def test_rows_past_the_sidecar_are_recovered_and_torn_ones_dropped(tmp_path):
+    directory = str(tmp_path / "index")
+    vectors = _vectors(11)
+    index = NumpyVectorIndex(directory)
+    _fill(index, vectors[:10])
+    offsets_size = os.path.getsize(os.path.join(directory, "offsets.u64"))
+    # a crash after the row's vector, norm and docs line, before its offsets
+    with open(os.path.join(directory, "vectors.f32"), "ab") as f:
+        f.write(vectors[10].tobytes())
+    with open(os.path.join(directory, "norms.f32"), "ab") as f:
+        f.write(np.float32(vectors[10] @ vectors[10]).tobytes())
+    with open(os.path.join(directory, "docs.jsonl"), "ab") as f:
+        f.write(b'{"id": "id10", "document": "doc id10", "metadata": {}}\n{"id": "torn')
+
+    reopened = NumpyVectorIndex(directory)
+    assert reopened.count() == 11
+    assert reopened.query([vectors[10]], n_results=1)["ids"][0] == ["id10"]
+    assert os.path.getsize(os.path.join(directory, "offsets.u64")) == offsets_size + 16
+    assert open(os.path.join(directory, "docs.jsonl"), "rb").read().endswith(b"{}}\n")
+    reopened.add(["id11"], ["doc id11"], embeddings=_vectors(1, seed=1))
+    assert NumpyVectorIndex(directory).get(["id10", "id11"])["ids"] == ["id10", "id11"]
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+import output_length
+from output_length import OutputLengthScheduler
+
+WINDOW = 32_000
+
+
+def _stats(ttft: float, tokens_per_sec: float, completion: int, prompt: int = 8_000, cached: int = 0) -> dict:
+    return {"ttft": ttft, "tokens_per_sec": tokens_per_sec, "latency": ttft + completion / tokens_per_sec,
+            "completion_tokens": completion, "prompt_tokens": prompt, "cached_tokens": cached}
+
+
+def test_unknown_policy_or_target_is_rejected():
+    with pytest.raises(ValueError):
+        OutputLengthScheduler("longest")
+    with pytest.raises(ValueError):
+        OutputLengthScheduler("adaptive", "tokens_per_joule")
+
+
+@pytest.mark.parametrize("policy,target", [("adaptive", "tokens_per_dollar"),
+                                           ("adaptive", "tokens_per_sec"),
+                                           ("random", "tokens_per_dollar")])
+def test_max_tokens_always_fits_next_to_the_context(policy, target):
+    rng = random.Random(0)
+    scheduler = OutputLengthScheduler(policy, target)
+    for _ in range(300):
+        context = rng.randrange(0, WINDOW)
+        max_tokens = scheduler.next_max_tokens(context, rng.randrange(-500, 5_000), WINDOW)
+        room = max(1, min(WINDOW - context - 64, output_length.OUTPUT_LENGTH_MAX_TOKENS))
+        assert 1 <= max_tokens <= room
+        if policy == "adaptive" and room >= output_length.OUTPUT_LENGTH_MIN_TOKENS:
+            assert max_tokens >= output_length.OUTPUT_LENGTH_MIN_TOKENS
+        scheduler.observe(_stats(rng.uniform(0.2, 3.0), rng.uniform(20, 200), rng.randrange(1, max_tokens + 1)),
+                          max_tokens)
+
+
+def test_dollar_target_grows_with_the_uncached_prompt():
+    scheduler = OutputLengthScheduler("adaptive", "tokens_per_dollar")
+    short = scheduler.next_max_tokens(2_000, 10_000, WINDOW)
+    long = scheduler.next_max_tokens(20_000, 10_000, WINDOW)
+    assert short < long
+    assert scheduler.last_decision["limited_by"] in ("target", "room", "compression")
+
+    # once most of the prompt comes from the provider's cache, less output reaches the target
+    for _ in range(30):
+        scheduler.observe(_stats(0.5, 100, long, prompt=20_000, cached=19_000), long)
+    assert scheduler.next_max_tokens(20_000, 10_000, WINDOW) < long
+
+
+def test_speed_target_from_measured_ttft_and_decode_rate():
+    scheduler = OutputLengthScheduler("adaptive", "tokens_per_sec")
+    assert scheduler.next_max_tokens(1_000, 10_000, WINDOW) == output_length.OUTPUT_LENGTH_MIN_TOKENS
+
+    scheduler.observe(_stats(ttft=2.0, tokens_per_sec=120, completion=1_000), 1_000)
+    # output / (2 s + output / 120) >= 60  ->  output >= 240
+    assert scheduler.next_max_tokens(1_000, 10_000, WINDOW) == 240
+    assert scheduler.last_decision["limited_by"] == "target"
+
+
+def test_caps_apply_when_the_target_asks_for_more():
+    scheduler = OutputLengthScheduler("adaptive", "tokens_per_sec")
+    scheduler.observe(_stats(ttft=10.0, tokens_per_sec=61, completion=1_000), 1_000)  # needs ~36k tokens
+
+    assert scheduler.next_max_tokens(1_000, 0, WINDOW) == output_length.MEMORY_CHUNK_TOKENS
+    assert scheduler.last_decision["limited_by"] == "compression"
+    assert scheduler.next_max_tokens(WINDOW - 564, 100_000, WINDOW) == 500
+    assert scheduler.last_decision["limited_by"] == "room"
+    assert scheduler.next_max_tokens(WINDOW - 10, 100_000, WINDOW) == 1  # never more than fits
+
+
+def test_the_model_stopping_short_raises_max_tokens():
+    scheduler = OutputLengthScheduler("adaptive", "tokens_per_sec")
+    scheduler.observe(_stats(ttft=2.0, tokens_per_sec=120, completion=1_000), 1_000)
+    full = scheduler.next_max_tokens(1_000, 10_000, WINDOW)
+    for _ in range(30):
+        scheduler.observe(_stats(ttft=2.0, tokens_per_sec=120, completion=500), 1_000)
+    assert scheduler.next_max_tokens(1_000, 10_000, WINDOW) > full
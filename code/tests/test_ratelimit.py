@@ -0,0 +1,153 @@
+import threading
+import time
+import types
+
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter, scheduled_create
+
+
+class _APIError(Exception):
+    # what _retry_delay looks at on openai's errors: status_code and response.headers
+    def __init__(self, status_code: int, headers: dict = None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(headers=headers or {})
+
+
+class _Client:
+    """
+    Duck-types client.chat.completions.create: raises `errors` in order, then
+    answers with `usage_tokens` of usage.
+    """
+    def __init__(self, errors=(), usage_tokens: int = 30):
+        self.errors = list(errors)
+        self.usage_tokens = usage_tokens
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=self)
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        usage = types.SimpleNamespace(prompt_tokens=self.usage_tokens - 10, completion_tokens=10)
+        return types.SimpleNamespace(usage=usage, kwargs=kwargs)
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = RateLimiter(rpm=60_000, tpm=60_000)
+    monkeypatch.setattr(limiter.tokens, "refill", lambda now: None)  # levels stay exact
+    monkeypatch.setattr(ratelimit, "_scheduler", limiter)
+    monkeypatch.setattr(ratelimit, "API_BACKOFF_BASE_SEC", 0.01)
+    return limiter
+
+
+def test_buckets_charge_and_refill():
+    limiter = RateLimiter(rpm=600, tpm=6_000)  # 10 requests, 100 tokens a second
+    limiter.acquire(1_000)
+    assert limiter.requests.level == pytest.approx(599, abs=0.1)
+    assert limiter.tokens.level == pytest.approx(5_000, abs=1)
+
+    limiter.tokens.level = 0.0
+    start = time.monotonic()
+    limiter.acquire(50)  # 50 tokens at 100 a second
+    assert time.monotonic() - start == pytest.approx(0.5, abs=0.15)
+    # a call larger than the whole bucket waits for a full bucket, not forever
+    assert RateLimiter(rpm=600, tpm=6_000).tokens.wait_for(10 ** 9) == 0.0
+
+
+def test_generation_goes_before_a_summary_that_waited_longer():
+    limiter = RateLimiter(rpm=600, tpm=10 ** 9)
+    limiter.requests.level = 0.0  # the next request is 0.1 s away
+    order = []
+
+    def call(priority: str) -> None:
+        limiter.acquire(1, priority)
+        order.append(priority)
+
+    summary = threading.Thread(target=call, args=("summary",))
+    summary.start()
+    time.sleep(0.02)
+    generation = threading.Thread(target=call, args=("generation",))
+    generation.start()
+    summary.join(5)
+    generation.join(5)
+    assert order == ["generation", "summary"]
+
+
+def test_settle_refunds_the_estimate_up_to_capacity():
+    limiter = RateLimiter(rpm=600, tpm=6_000)
+    limiter.acquire(1_000)
+    limiter.settle(1_000, 200)
+    assert limiter.tokens.level == pytest.approx(5_800, abs=1)
+    limiter.settle(1_000, 0)
+    assert limiter.tokens.level == 6_000
+    limiter.settle(0, 2_000)  # used more than estimated: charged
+    assert limiter.tokens.level == pytest.approx(4_000, abs=1)
+
+
+def test_scheduled_create_settles_from_usage(limiter):
+    client = _Client(usage_tokens=30)
+    response = scheduled_create(client, "summary", 1_000, model="m", messages=[])
+    assert response.kwargs == {"model": "m", "messages": []}
+    assert limiter.tokens.level == 60_000 - 30
+
+
+def test_retryable_errors_back_off_and_retry(limiter):
+    client = _Client(errors=[_APIError(500), _APIError(503)])
+    sends = []
+    scheduled_create(client, "generation", 10, on_send=sends.append, model="m", messages=[])
+    assert client.calls == 3
+    assert [stamp is None for stamp in sends] == [False, True, False, True, False]
+
+
+def test_429_honours_retry_after_and_pauses_every_caller(limiter, monkeypatch):
+    slept = []
+    monkeypatch.setattr(ratelimit.time, "sleep", slept.append)
+    client = _Client(errors=[_APIError(429, {"retry-after": "0.3"})])
+    start = time.monotonic()
+    scheduled_create(client, "generation", 10, model="m", messages=[])
+    assert slept == [0.3]
+    # sleep is stubbed out: the retry waited in acquire() for the pause to end
+    assert time.monotonic() - start >= 0.25
+    assert client.calls == 2
+
+
+def test_other_errors_and_the_last_retry_are_raised(limiter, monkeypatch):
+    monkeypatch.setattr(ratelimit, "API_MAX_RETRIES", 2)
+    client = _Client(errors=[_APIError(400)])
+    with pytest.raises(_APIError):
+        scheduled_create(client, "generation", 10, model="m", messages=[])
+    assert client.calls == 1
+
+    client = _Client(errors=[_APIError(500)] * 3)
+    with pytest.raises(_APIError):
+        scheduled_create(client, "generation", 10, model="m", messages=[])
+    assert client.calls == 3
+
+
+def test_a_streamed_generation_is_settled(limiter, monkeypatch):
+    openai = pytest.importorskip("openai")
+    import clients
+    import main
+    from fake_openai_server import FakeOpenAIServer
+
+    with FakeOpenAIServer(text="one two three four") as server:
+        monkeypatch.setitem(clients._overrides, "generation",
+                            openai.OpenAI(base_url=server.base_url, api_key="test", max_retries=0))
+        stats = {}
+        text = "".join(main.stream_next_chunk("x" * 4_000, max_tokens=2_000, stats=stats))
+
+        # usage event: 10 prompt + 4 completion tokens instead of 1000 + 2000
+        assert text.split() == ["one", "two", "three", "four"]
+        assert stats["prompt_tokens"] == 10 and stats["completion_tokens"] == 4
+        assert limiter.tokens.level == 60_000 - 14
+
+        # cut short: no usage event, so the counted tokens are charged
+        limiter.tokens.level = limiter.tokens.capacity
+        text = "".join(main.stream_next_chunk("a short prompt", max_tokens=2_000, stats=stats,
+                                              should_stop=lambda so_far: True))
+        assert stats["completion_tokens"] == main.count_tokens(text)
+        assert limiter.tokens.level == 60_000 - main.count_tokens("a short prompt") - stats["completion_tokens"]
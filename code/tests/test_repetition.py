@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from repetition import RepetitionDetector
+from utils import shingle_hashes
+
+WORDS = ("archive river signal empire network theory harbor lantern orchard copper "
+         "meadow cipher glacier compass tide forge").split()
+
+
+def _prose(n: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) + str(rng.randrange(1000)) for _ in range(n)) + " "
+
+
+def _feed(detector: RepetitionDetector, text: str, step: int = 7) -> bool:
+    # the text so far, a few characters at a time, as a stream delivers it
+    for end in range(step, len(text) + step, step):
+        if detector(text[:end]):
+            return True
+    return False
+
+
+def test_varied_text_never_stops():
+    detector = RepetitionDetector(ngram=4, window=32, threshold=0.8)
+    assert not _feed(detector, _prose(2000))
+    assert not detector.triggered and detector.trim_at is None
+
+
+def test_a_loop_stops_and_trim_keeps_the_first_occurrence():
+    fresh = _prose(100)
+    loop = "and then the story repeats itself once more "
+    text = fresh + loop * 40
+    detector = RepetitionDetector(ngram=4, window=32, threshold=0.8)
+
+    assert _feed(detector, text)
+    assert detector.triggered
+    assert detector(text + "anything else ")  # stays stopped
+    kept = text[:detector.trim_at]
+    assert kept.startswith(fresh) and loop in kept
+    assert len(kept) < len(fresh) + 3 * len(loop)
+
+
+def test_copying_the_reference_stops_and_is_trimmed_entirely():
+    reference = _prose(200, seed=1)
+    fresh = _prose(50, seed=2)
+    detector = RepetitionDetector(shingle_hashes(reference, 4), ngram=4, window=32, threshold=0.8)
+
+    assert _feed(detector, fresh + reference)
+    assert detector.trim_at == len(fresh)
+
+
+def test_below_the_threshold_does_not_stop():
+    reference = _prose(400, seed=3)
+    copied = reference.split()
+    fresh = _prose(400, seed=4).split()
+    # alternate 8 copied words with 8 new ones: well under 80% repeated n-grams
+    mixed = " ".join(w for i in range(0, 400, 8) for w in copied[i:i + 8] + fresh[i:i + 8]) + " "
+    detector = RepetitionDetector(shingle_hashes(reference, 4), ngram=4, window=32, threshold=0.8)
+
+    assert not _feed(detector, mixed)
+
+
+def test_streamed_and_whole_text_trim_at_the_same_place():
+    text = _prose(60, seed=5) + "the same sentence goes around and around again " * 20
+    whole = RepetitionDetector(ngram=4, window=32, threshold=0.8)
+    streamed = RepetitionDetector(ngram=4, window=32, threshold=0.8)
+
+    assert whole(text) and _feed(streamed, text, step=3)
+    assert streamed.trim_at == whole.trim_at
+
+
+def test_a_trim_after_streaming_is_noted_in_the_log(monkeypatch):
+    pytest.importorskip("openai")
+    import logger
+    import main
+    monkeypatch.setattr(logger, "_writers", {})
+    fresh = _prose(100)
+    text = fresh + "and then the story repeats itself once more " * 40
+    detector = RepetitionDetector(ngram=4, window=32, threshold=0.8)
+
+    streamed = logger.log_stream((text[i:i + 7] for i in range(0, len(text), 7)), iteration=1, session="s1")
+    kept = main.trim_repetition(streamed, detector, "s1", logged=True)
+    logger.log_text("the next iteration", iteration=2, session="s1")
+    logger.flush_log()
+
+    assert kept == text[:detector.trim_at] and len(kept) < len(text)
+    _, index_path = logger.session_log_paths("s1")
+    entry = logger.read_iteration(1, index_path)
+    assert text in entry  # the untrimmed stream stays as it was written
+    assert entry.endswith(f"[repetition: trimmed at character {detector.trim_at}, "
+                          f"{main.count_tokens(text[detector.trim_at:])} tokens after it were not added to memory]")
+    assert logger.read_iteration(2, index_path).endswith("the next iteration")
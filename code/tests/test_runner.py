@@ -0,0 +1,66 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+import pytest
+
+openai = pytest.importorskip("openai")
+
+import clients
+import lexical_index
+import logger
+import memory_manager
+import metrics
+import runner
+import vector_store
+from embeddings import CachedEmbedder
+from fake_openai_server import FakeOpenAIServer
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # every session's generation goes to one local server; LTM goes to per-session numpy indexes
+    monkeypatch.setattr(vector_store, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(vector_store, "_embedder", CachedEmbedder("hashing", cache_dir=None))
+    monkeypatch.setattr(vector_store, "_collections", {})
+    monkeypatch.setattr(vector_store, "_generations", {})
+    monkeypatch.setattr(vector_store, "_result_cache", OrderedDict())
+    monkeypatch.setattr(vector_store, "_pending", [])
+    monkeypatch.setattr(lexical_index, "_archives", {})
+    monkeypatch.setattr(logger, "_writers", {})
+    monkeypatch.setattr(metrics, "METRICS_EXPORT", None)
+    monkeypatch.setattr(runner, "CONTEXT_LAYOUT", "classic")
+    # every piece goes to LTM at once, verbatim
+    monkeypatch.setattr(memory_manager, "SUMMARIZE_THRESHOLD_TOKENS", 5)
+    monkeypatch.setattr(memory_manager, "summarize_text", lambda text, **_: str(text))
+    with FakeOpenAIServer(latency=0.3, text="the tide came in") as fake:
+        monkeypatch.setitem(clients._overrides, "generation",
+                            openai.OpenAI(base_url=fake.base_url, api_key="test", max_retries=0))
+        yield fake
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_sessions_keep_their_own_memory_logs_and_checkpoints(server, monkeypatch, stream):
+    monkeypatch.setattr(runner, "STREAM_GENERATION", stream)
+    names = ["alpha", "beta", "gamma"]
+    sessions = [runner.Session(name, initial_prompt=f"You keep the {name} lighthouse.", rand_pool=[])
+                for name in names]
+
+    # a cap the first round of generations exhausts
+    asyncio.run(runner.run_sessions(sessions, max_concurrent=3, cost_cap=1e-12))
+    for session in sessions:
+        session.memory.wait_for_compression()
+    vector_store.flush_vector_store()
+    logger.flush_log()
+
+    assert len(server.requests) == sum(s.iteration for s in sessions) >= len(sessions)
+    for session in sessions:
+        assert session.memory.namespace == session.name
+        documents = vector_store.get_collection(session.name).get(
+            ids=[chunk_id for chunk_id, _ in session.memory.LTM_index])["documents"]
+        assert any(f"You keep the {session.name} lighthouse." in doc for doc in documents)
+        assert not any(other in doc for doc in documents for other in names if other != session.name)
+
+        with open(os.path.join("logs", session.name, "stream.txt"), encoding="utf-8") as f:
+            assert f.read().count("the tide came in") == session.iteration  # logged once, either way
+        assert os.path.exists(os.path.join("checkpoints", f"{session.name}.jsonl"))
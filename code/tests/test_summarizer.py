@@ -0,0 +1,41 @@
+import pytest
+
+openai = pytest.importorskip("openai")
+
+import clients  # noqa: E402
+import summarizer  # noqa: E402
+from fake_openai_server import FakeOpenAIServer  # noqa: E402
+
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeOpenAIServer(text="a short summary") as server:
+        monkeypatch.setitem(clients._overrides, "summary",
+                            openai.OpenAI(base_url=server.base_url, api_key="test", max_retries=0))
+        yield server
+
+
+def test_level_timings_belong_to_each_call(server, monkeypatch):
+    monkeypatch.setattr(summarizer, "SUMMARY_INPUT_LIMIT_TOKENS", 50)
+    monkeypatch.setattr(summarizer, "SUMMARY_CHUNK_TOKENS", 40)
+    long_text = " ".join(f"word{i}" for i in range(400))
+
+    levels = []
+    assert summarizer.summarize_text(long_text, level_timings=levels) == server.text
+    assert [level for level, _, _ in levels] == list(range(len(levels)))
+    assert levels[0][1] > 1  # the map level ran several calls
+    assert sum(calls for _, calls, _ in levels) == len(server.requests)
+
+    direct = []
+    summarizer.summarize_text("short text", level_timings=direct)
+    assert direct == []  # a direct summary has no levels, and the previous call's stay its own
+    assert len(levels) >= 2
+
+
+def test_a_single_partial_summary_is_returned_without_a_final_call(server, monkeypatch):
+    monkeypatch.setattr(summarizer, "SUMMARY_INPUT_LIMIT_TOKENS", 50)
+    monkeypatch.setattr(summarizer, "SUMMARY_CHUNK_TOKENS", 1_000)  # the whole text is one chunk
+    levels = []
+    assert summarizer.summarize_text(" ".join(f"word{i}" for i in range(100)), level_timings=levels) == server.text
+    assert len(server.requests) == 1
+    assert [(level, calls) for level, calls, _ in levels] == [(0, 1)]
@@ -0,0 +1,48 @@
+import pytest
+
+from benchmarks.fakes import fake_text
+from utils import TokenizedText, count_tokens, get_encoder, tokenized
+
+
+def test_slices_and_chunks_decode_back_to_the_text():
+    text = fake_text(100, seed=4)
+    t = TokenizedText(text)
+    assert str(t[0:len(t)]) == text
+    assert str(t[:10]) + str(t[10:]) == text
+
+    chunks = t.chunks(7)
+    assert len(chunks) == -(-len(t) // 7)
+    assert all(len(chunk) <= 7 for chunk in chunks)
+    assert "".join(str(chunk) for chunk in chunks) == text
+    assert chunks[1].ids.obj is t.ids.obj  # views over the same buffer, not copies
+
+    with pytest.raises(TypeError):
+        t[3]
+    with pytest.raises(TypeError):
+        t[::2]
+
+
+def test_join_concatenates_ids_and_round_trips():
+    parts = [TokenizedText(fake_text(30, seed=i)) for i in range(3)]
+    joined = TokenizedText.join(parts)
+    sep = get_encoder().encode("\n")
+
+    assert joined.text == "\n".join(str(p) for p in parts)
+    assert joined.ids.tolist() == parts[0].ids.tolist() + sep + parts[1].ids.tolist() + sep + parts[2].ids.tolist()
+    assert len(joined) == sum(len(p) for p in parts) + 2 * len(sep)
+    assert str(TokenizedText(ids=joined.ids)) == joined.text
+    assert TokenizedText.join(["a b", parts[0]], sep="").text == "a b" + str(parts[0])
+
+
+def test_known_counts_and_ids_are_not_re_encoded(monkeypatch):
+    encoded = []
+    encoder = get_encoder()
+    real_encode = encoder.encode
+    monkeypatch.setattr(encoder, "encode", lambda text, *a, **kw: encoded.append(text) or real_encode(text, *a, **kw))
+
+    restored = TokenizedText("three short words", count=3)
+    assert len(restored) == 3 and count_tokens(restored) == 3
+    piece = tokenized("a piece of text")
+    assert tokenized(piece) is piece
+    len(piece), len(piece), piece.ids, piece[1:3]
+    assert encoded == ["a piece of text"]
@@ -0,0 +1,136 @@
+import sys
+import types
+from collections import OrderedDict
+
+import pytest
+
+import vector_store
+from embeddings import CachedEmbedder, HashingEmbedder
+
+
+class _CountingEmbedder(HashingEmbedder):
+    name = "counting"
+
+    def __init__(self):
+        super().__init__(dim=32)
+        self.texts = []
+
+    def __call__(self, texts):
+        self.texts.extend(texts)
+        return super().__call__(texts)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    # a fresh module state over the numpy backend; no background flusher, tests flush explicitly
+    embedder = _CountingEmbedder()
+    monkeypatch.setattr(vector_store, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(vector_store, "_embedder", CachedEmbedder(embedder, cache_dir=None))
+    monkeypatch.setattr(vector_store, "_collections", {})
+    monkeypatch.setattr(vector_store, "_generations", {})
+    monkeypatch.setattr(vector_store, "_result_cache", OrderedDict())
+    monkeypatch.setattr(vector_store, "_embedding_cache", OrderedDict())
+    monkeypatch.setattr(vector_store, "_pending", [])
+    monkeypatch.setattr(vector_store, "_flusher", "disabled")
+    monkeypatch.setattr(vector_store, "cache_stats", dict.fromkeys(vector_store.cache_stats, 0))
+    return embedder
+
+
+def _ids(results) -> list:
+    return results["ids"][0]
+
+
+def test_repeated_queries_are_served_from_the_cache(store):
+    vector_store.add_to_vector_store("the lighthouse keeper", doc_id="a")
+    vector_store.flush_vector_store()
+
+    first = vector_store.retrieve_similar_memories("who kept the light", k=2)
+    store.texts.clear()
+    assert vector_store.retrieve_similar_memories("who kept the light", k=2) is first
+    assert store.texts == []
+    assert vector_store.cache_stats["result_hits"] == 1 and vector_store.cache_stats["result_misses"] == 1
+
+    vector_store.retrieve_similar_memories("who kept the light", k=3)  # another k: another entry
+    assert vector_store.cache_stats["result_misses"] == 2
+    assert store.texts == []  # but the query embedding is cached
+
+
+def test_writes_to_a_namespace_invalidate_only_its_results(store):
+    vector_store.add_to_vector_store("the lighthouse keeper", doc_id="a")
+    assert _ids(vector_store.retrieve_similar_memories("lighthouse", k=5)) == ["a"]
+
+    vector_store.add_to_vector_store("the lighthouse lantern", doc_id="b")
+    assert sorted(_ids(vector_store.retrieve_similar_memories("lighthouse", k=5))) == ["a", "b"]
+    vector_store.delete_memories(["a"])
+    assert _ids(vector_store.retrieve_similar_memories("lighthouse", k=5)) == ["b"]
+    assert vector_store.cache_stats["result_hits"] == 0
+
+    vector_store.add_to_vector_store("a lighthouse elsewhere", doc_id="c", namespace="other")
+    vector_store.retrieve_similar_memories("lighthouse", k=5)
+    assert vector_store.cache_stats["result_hits"] == 1
+
+
+def test_results_expire_and_the_least_recently_used_are_evicted(store, monkeypatch):
+    vector_store.add_to_vector_store("the lighthouse keeper", doc_id="a")
+    monkeypatch.setattr(vector_store, "RETRIEVAL_CACHE_SIZE", 2)
+    for query in ("one", "two", "one", "three"):  # "two" is the oldest use when "three" comes in
+        vector_store.retrieve_similar_memories(query)
+    assert list(vector_store._result_cache) == [(None, "one", 3), (None, "three", 3)]
+    assert vector_store.cache_stats["result_hits"] == 1
+
+    monkeypatch.setattr(vector_store, "RETRIEVAL_CACHE_TTL_SEC", 0)
+    vector_store.retrieve_similar_memories("one")
+    assert vector_store.cache_stats["result_hits"] == 1
+
+
+def test_buffered_documents_are_readable_before_the_flush(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "VECTOR_FLUSH_BATCH_SIZE", 100)
+    for doc_id in ("a", "b", "c"):
+        vector_store.add_to_vector_store(f"the lighthouse keeper {doc_id}", {"n": doc_id}, doc_id=doc_id)
+    collection = vector_store.get_collection()
+    assert collection.count() == 0
+
+    results = vector_store.retrieve_similar_memories("the lighthouse keeper b", k=2)
+    assert _ids(results)[0] == "b" and results["metadatas"][0][0] == {"n": "b"}
+    assert vector_store.get_memories(["a", "x"]) == {"a": "the lighthouse keeper a"}
+    vector_store.delete_memories(["c"])  # never written
+
+    vector_store.flush_vector_store()
+    assert collection.count() == 2 and vector_store._pending == []
+    assert vector_store.get_memories(["a", "c"]) == {"a": "the lighthouse keeper a"}
+    assert sorted(_ids(vector_store.retrieve_similar_memories("the lighthouse keeper", k=5))) == ["a", "b"]
+
+
+def test_a_full_buffer_is_written_in_one_batch(store, monkeypatch):
+    monkeypatch.setattr(vector_store, "VECTOR_FLUSH_BATCH_SIZE", 4)
+    collection = vector_store.get_collection()
+    adds = []
+    real_add = collection.add
+    monkeypatch.setattr(collection, "add", lambda **kw: adds.append(kw["ids"]) or real_add(**kw))
+
+    for i in range(6):
+        vector_store.add_to_vector_store(f"piece {i}", doc_id=str(i))
+    assert adds == [["0", "1", "2", "3"]]
+    assert [item[0] for item in vector_store._pending] == ["4", "5"]
+    assert len(store.texts) == 4  # embedded once, in the flush's batch
+
+
+def test_the_chroma_client_persists_to_the_configured_directory(store, monkeypatch):
+    opened = []
+
+    class _Client:
+        def __init__(self, path):
+            opened.append(path)
+
+        def get_or_create_collection(self, name, embedding_function=None):
+            return name
+
+    monkeypatch.setitem(sys.modules, "chromadb", types.SimpleNamespace(PersistentClient=_Client))
+    monkeypatch.setattr(vector_store, "VECTOR_BACKEND", "chroma")
+    monkeypatch.setattr(vector_store, "EMBEDDING_BACKEND", "hashing")
+    monkeypatch.setattr(vector_store, "CHROMA_PERSIST_DIR", "/data/chroma")
+    monkeypatch.setattr(vector_store, "_chroma_client", None)
+
+    assert vector_store.get_collection("s1") == "infinite_memory_counting-s1"
+    vector_store.get_collection("s2")
+    assert opened == ["/data/chroma"]
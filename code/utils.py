@@ -4,46 +4,145 @@ utils.py
 Helper functions, especially for token counting using tiktoken.
 """
 
-import tiktoken
+from array import array
+from functools import lru_cache
 from config import SUMMARY_MODEL
 
 # ------------------------------------------------------------------------------
-# 1) Load the tiktoken encoding for our chosen model
+# 1) Load the tiktoken encoding for our chosen model (on first use, not on import)
 # ------------------------------------------------------------------------------
-try:
-    ENCODER = tiktoken.encoding_for_model(SUMMARY_MODEL)
-except KeyError:
-    # If the model name isn’t recognized, fall back to a default, e.g., "gpt-3.5-turbo"
-    ENCODER = tiktoken.get_encoding("cl100k_base")
+@lru_cache(maxsize=None)
+def get_encoder():
+    """
+    get_encoder() -> tiktoken.Encoding
+
+    The shared tokenizer; tiktoken is imported and its BPE ranks loaded on the first call.
+    """
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(SUMMARY_MODEL)
+    except KeyError:
+        # If the model name isn’t recognized, fall back to a default, e.g., "gpt-3.5-turbo"
+        return tiktoken.get_encoding("cl100k_base")
+
+# ------------------------------------------------------------------------------
+# 2) Text that carries its token ids, so each piece is encoded once
+# ------------------------------------------------------------------------------
+class TokenizedText:
+    """
+    TokenizedText(text=None, ids=None, count=None)
+
+    A text and its token ids. The ids are encoded on first use and kept in an
+    array("I"); slicing by token range (`t[a:b]`) returns a view over the same
+    buffer, whose text is decoded on first use. `count` is an already known token
+    count, so len() does not need to encode (e.g. pieces restored from a checkpoint).
+    """
+    __slots__ = ("_text", "_ids", "_count")
+
+    def __init__(self, text: str = None, ids: memoryview = None, count: int = None):
+        if text is None and ids is None:
+            raise ValueError("TokenizedText needs a text or token ids")
+        self._text = text
+        self._ids = ids
+        self._count = count
+
+    @property
+    def ids(self) -> memoryview:
+        if self._ids is None:
+            self._ids = memoryview(array("I", get_encoder().encode(self._text)))
+        return self._ids
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = get_encoder().decode(self._ids.tolist())
+        return self._text
+
+    def __str__(self) -> str:
+        return self.text
 
-def count_tokens(text: str) -> int:
+    def __len__(self) -> int:
+        if self._ids is not None:
+            return len(self._ids)
+        if self._count is None:
+            self._count = len(self.ids)
+        return self._count
+
+    def __getitem__(self, key: slice) -> "TokenizedText":
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("TokenizedText only supports contiguous token slices")
+        return TokenizedText(ids=self.ids[key])
+
+    def chunks(self, max_tokens: int) -> list["TokenizedText"]:
+        """
+        Consecutive views of at most `max_tokens` tokens each.
+        """
+        return [self[start:start + max_tokens] for start in range(0, len(self), max_tokens)]
+
+    @staticmethod
+    def join(parts: list, sep: str = "\n") -> "TokenizedText":
+        """
+        join(parts, sep="\n") -> TokenizedText
+
+        Concatenate texts and their ids without re-encoding anything but `sep`. The
+        result decodes to exactly sep.join(parts), though BPE may have merged a
+        token or two across the seams of a fresh encode.
+        """
+        parts = [tokenized(p) for p in parts]
+        sep_ids = array("I", get_encoder().encode(sep)) if sep else array("I")
+        ids = array("I")
+        for i, part in enumerate(parts):
+            if i:
+                ids.extend(sep_ids)
+            ids.frombytes(part.ids.cast("B"))
+        return TokenizedText(sep.join(p.text for p in parts), memoryview(ids))
+
+
+def tokenized(text) -> TokenizedText:
+    """
+    tokenized(text) -> `text` itself if it is a TokenizedText, else a new (lazy) one.
+    """
+    return text if isinstance(text, TokenizedText) else TokenizedText(text)
+
+def count_tokens(text) -> int:
     """
     count_tokens(text) -> int
 
-    Count how many tokens `text` uses for the chosen LLM model.
+    Count how many tokens `text` uses for the chosen LLM model. A TokenizedText
+    answers from its cached ids.
 
     Example:
         >>> count_tokens("Hello, world!")
         3
     """
-    return len(ENCODER.encode(text))
+    if isinstance(text, TokenizedText):
+        return len(text)
+    return len(get_encoder().encode(text))
 
-def chunk_text_by_tokens(text: str, max_tokens: int) -> list[str]:
+def chunk_text_by_tokens(text, max_tokens: int) -> list:
     """
     chunk_text_by_tokens(text, max_tokens) -> List of text shards
 
     Split `text` into chunks, each no more than `max_tokens` tokens when encoded.
     This helps when you need to summarize or embed text in parts.
+    A TokenizedText is split into views (no decode until a shard's text is used);
+    a str is encoded once and its shards are returned as str.
+    """
+    if isinstance(text, TokenizedText):
+        return text.chunks(max_tokens)
+    return [str(chunk) for chunk in TokenizedText(text).chunks(max_tokens)]
+
+def shingle_hashes(text: str, size: int = 5) -> set:
+    """
+    shingle_hashes(text, size=5) -> set of ints
+
+    Hashes of every run of `size` consecutive (lower-cased) words in `text`; two texts
+    sharing most of their shingles share most of their wording. Valid within one process.
     """
-    tokens = ENCODER.encode(text)
-    chunks = []
-    start = 0
-    while start < len(tokens):
-        end = min(start + max_tokens, len(tokens))
-        piece_tokens = tokens[start:end]
-        chunks.append(ENCODER.decode(piece_tokens))
-        start = end
-    return chunks
+    words = text.lower().split()
+    if len(words) < size:
+        return {hash(tuple(words))} if words else set()
+    return {hash(tuple(words[i:i + size])) for i in range(len(words) - size + 1)}
 
 def ensure_dir_exists(path: str) -> None:
     """
@@ -1,15 +1,96 @@
+import atexit
+import threading
+import time
 import uuid
-from chromadb import PersistentClient
+from collections import OrderedDict
+import os
+from config import (
+    CHROMA_PERSIST_DIR,
+    VECTOR_BACKEND,
+    NUMPY_INDEX_DIR,
+    NUMPY_INDEX_QUANTIZE,
+    EMBEDDING_BACKEND,
+    RETRIEVAL_CACHE_SIZE,
+    RETRIEVAL_CACHE_TTL_SEC,
+    EMBEDDING_CACHE_SIZE,
+    VECTOR_FLUSH_BATCH_SIZE,
+    VECTOR_FLUSH_INTERVAL_SEC,
+)
+from metrics import inc, timed
 
-chroma_client = PersistentClient(path="chromadb_data")
+# ✅ Embedder and collection are created on first use (importing this module is free)
+_init_lock = threading.Lock()
+_embedder = None
+_collections = {}      # namespace -> collection; None is the single-loop default
+_chroma_client = None
 
-# ✅ Create or load vector collection
-collection = chroma_client.get_or_create_collection("infinite_memory")
+
+def get_embedder():
+    """
+    The CachedEmbedder used for every document and query (see embeddings.py).
+    Embeddings are always computed here and handed to the store explicitly.
+    """
+    global _embedder
+    with _init_lock:
+        if _embedder is None:
+            from embeddings import CachedEmbedder
+            _embedder = CachedEmbedder()
+        return _embedder
+
+
+def embed_documents(texts):
+    """
+    embed_documents(texts) -> np.ndarray, one row per text
+
+    Embeddings of stored documents; these were embedded on insert, so this is
+    normally all embedding-cache hits.
+    """
+    return get_embedder()(list(texts))
+
+
+def get_collection(namespace: str = None):
+    """
+    Create or load the vector collection; non-default embedding backends get their own (dims differ),
+    and every `namespace` (one per session, see runner.py) gets its own collection.
+    """
+    global _chroma_client
+    embedder = get_embedder()
+    with _init_lock:
+        collection = _collections.get(namespace)
+        if collection is None:
+            name = "infinite_memory" if EMBEDDING_BACKEND == "chroma" else f"infinite_memory_{embedder.name}"
+            if namespace is not None:
+                name = f"{name}-{namespace}"
+            if VECTOR_BACKEND == "numpy":
+                from numpy_index import NumpyVectorIndex
+                collection = NumpyVectorIndex(os.path.join(NUMPY_INDEX_DIR, name), quantize=NUMPY_INDEX_QUANTIZE)
+            elif VECTOR_BACKEND == "chroma":
+                if _chroma_client is None:
+                    from chromadb import PersistentClient
+                    _chroma_client = PersistentClient(path=CHROMA_PERSIST_DIR)
+                collection = _chroma_client.get_or_create_collection(name, embedding_function=None)
+            else:
+                raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND!r}")
+            _collections[namespace] = collection
+        return collection
+
+# ✅ Query caches: results are valid for one store generation, embeddings forever
+_cache_lock = threading.Lock()
+_generations = {}                # namespace -> counter bumped by every add_to_vector_store
+_result_cache = OrderedDict()    # (namespace, query, k) -> (generation, stored_at, results)
+_embedding_cache = OrderedDict() # query -> embedding
+cache_stats = {"result_hits": 0, "result_misses": 0, "embedding_hits": 0, "embedding_misses": 0}
+
+# ✅ Write-behind buffer: [doc_id, text, metadata, embedding-or-None, added_at, namespace], oldest first
+_pending = []
+_flush_lock = threading.Lock()   # one batched add at a time
+_flusher = None
 
 
-def add_to_vector_store(text: str, metadata: dict = None, doc_id: str = None):
+def add_to_vector_store(text: str, metadata: dict = None, doc_id: str = None, namespace: str = None):
     """
-    Add a new document to the vector store.
+    Add a new document to the vector store (the `namespace` collection).
+    The document is buffered and written with the next batched flush; queries see it immediately.
     """
     if metadata is None:
         metadata = {}
@@ -17,20 +98,200 @@ def add_to_vector_store(text: str, metadata: dict = None, doc_id: str = None):
     if doc_id is None:
         doc_id = str(uuid.uuid4())
 
-    collection.add(
-        documents=[text],
-        metadatas=[metadata],
-        ids=[doc_id]
-    )
+    with _cache_lock:
+        _pending.append([doc_id, text, metadata, None, time.time(), namespace])
+        _generations[namespace] = _generations.get(namespace, 0) + 1
+        full = len(_pending) >= VECTOR_FLUSH_BATCH_SIZE
+
+    _start_flusher()
+    if full:
+        flush_vector_store()
+
+
+def _embed_pending() -> None:
+    """
+    Embed every buffered document that has no embedding yet, in one batch.
+    """
+    with _cache_lock:
+        missing = [item for item in _pending if item[3] is None]
+    if not missing:
+        return
+    embeddings = get_embedder()([item[1] for item in missing])
+    with _cache_lock:
+        for item, embedding in zip(missing, embeddings):
+            item[3] = embedding
+
+
+def flush_vector_store() -> None:
+    """
+    Write all buffered documents to the store with one batched `add` per namespace.
+    """
+    with _flush_lock:
+        _embed_pending()
+        with _cache_lock:
+            batch = list(_pending)
+        if not batch:
+            return
+
+        by_namespace = {}
+        for item in batch:
+            by_namespace.setdefault(item[5], []).append(item)
+        with timed("vector_insert"):
+            for namespace, items in by_namespace.items():
+                get_collection(namespace).add(
+                    ids=[item[0] for item in items],
+                    documents=[item[1] for item in items],
+                    metadatas=[item[2] for item in items],
+                    embeddings=[item[3].tolist() for item in items],
+                )
+        inc("vector_inserts_total", len(batch))
+        # items stay visible in _pending until the store has them
+        with _cache_lock:
+            del _pending[:len(batch)]
+
+
+def get_memories(ids, namespace: str = None) -> dict:
+    """
+    get_memories(ids, namespace=None) -> {id: document} for the ids that exist.
+    """
+    found = {}
+    with _cache_lock:
+        for item in _pending:
+            if item[5] == namespace and item[0] in ids:
+                found[item[0]] = item[1]
+    missing = [i for i in ids if i not in found]
+    if missing:
+        stored = get_collection(namespace).get(ids=missing, include=["documents"])
+        found.update(zip(stored["ids"], stored["documents"]))
+    return found
+
+
+def delete_memories(ids, namespace: str = None) -> None:
+    """
+    Remove documents from the buffer and the store (unknown ids are ignored).
+    """
+    ids = set(ids)
+    with _flush_lock:  # never while a flush is writing them
+        with _cache_lock:
+            _pending[:] = [item for item in _pending if not (item[5] == namespace and item[0] in ids)]
+            _generations[namespace] = _generations.get(namespace, 0) + 1
+        get_collection(namespace).delete(ids=list(ids))
+    inc("vector_deletes_total", len(ids))
+
 
+def _flush_periodically() -> None:
+    while True:
+        time.sleep(VECTOR_FLUSH_INTERVAL_SEC)
+        with _cache_lock:
+            due = bool(_pending) and time.time() - _pending[0][4] >= VECTOR_FLUSH_INTERVAL_SEC
+        if due:
+            try:
+                flush_vector_store()
+            except Exception as e:
+                print(f"⚠️  vector store flush failed, will retry: {e}")
 
-def retrieve_similar_memories(query: str, k: int = 3):
+
+def _start_flusher() -> None:
+    global _flusher
+    if _flusher is None:
+        _flusher = threading.Thread(target=_flush_periodically, name="vector-store-flusher", daemon=True)
+        _flusher.start()
+
+
+atexit.register(flush_vector_store)
+
+
+def _embed_query(query: str):
     """
-    Retrieve top-k similar memories based on semantic similarity.
+    Embed `query`, reusing the LRU embedding cache.
     """
+    with _cache_lock:
+        if query in _embedding_cache:
+            _embedding_cache.move_to_end(query)
+            cache_stats["embedding_hits"] += 1
+            inc("cache_lookups_total", cache="query_embedding", result="hit")
+            return _embedding_cache[query]
+        cache_stats["embedding_misses"] += 1
+        inc("cache_lookups_total", cache="query_embedding", result="miss")
+
+    embedding = get_embedder()([query])[0]
+    with _cache_lock:
+        _embedding_cache[query] = embedding
+        if len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    return embedding
+
+
+def _squared_l2(a, b) -> float:
+    import numpy as np
+    d = np.asarray(a, dtype=np.float32) - b
+    return float(d @ d)
+
+
+def _merge_pending(results: dict, query_embedding, k: int, namespace: str = None) -> dict:
+    """
+    Brute-force the unflushed buffer of `namespace` against `query_embedding` and merge
+    it into the store's `results` (same "l2" distance), keeping the k nearest.
+    """
+    _embed_pending()
+    with _cache_lock:
+        pending = [item for item in _pending if item[3] is not None and item[5] == namespace]
+    if not pending:
+        return results
+
+    rows = list(zip(
+        results["ids"][0],
+        results["documents"][0],
+        results["metadatas"][0],
+        results["distances"][0],
+    ))
+    seen = {row[0] for row in rows}
+    for doc_id, text, metadata, embedding, _, _ in pending:
+        if doc_id not in seen:  # may already be in the store while its flush finishes
+            rows.append((doc_id, text, metadata, _squared_l2(query_embedding, embedding)))
+    rows.sort(key=lambda row: row[3])
+    rows = rows[:k]
+
+    return {
+        "ids": [[row[0] for row in rows]],
+        "documents": [[row[1] for row in rows]],
+        "metadatas": [[row[2] for row in rows]],
+        "distances": [[row[3] for row in rows]],
+    }
+
+
+@timed("ltm_retrieval")
+def retrieve_similar_memories(query: str, k: int = 3, namespace: str = None):
+    """
+    Retrieve top-k similar memories from the `namespace` collection based on semantic similarity.
+    Identical (query, k) lookups are served from cache until the store changes or the TTL expires.
+    """
+    key = (namespace, query, k)
+    now = time.time()
+    with _cache_lock:
+        entry = _result_cache.get(key)
+        if entry is not None:
+            generation, stored_at, results = entry
+            if generation == _generations.get(namespace, 0) and now - stored_at < RETRIEVAL_CACHE_TTL_SEC:
+                _result_cache.move_to_end(key)
+                cache_stats["result_hits"] += 1
+                inc("cache_lookups_total", cache="ltm_results", result="hit")
+                return results
+            del _result_cache[key]
+        cache_stats["result_misses"] += 1
+        inc("cache_lookups_total", cache="ltm_results", result="miss")
+        generation = _generations.get(namespace, 0)
+
     print('\nfetching from LTM\n')
-    return collection.query(
-        query_texts=[query],
-        n_results=k
+    query_embedding = _embed_query(query)
+    results = get_collection(namespace).query(
+        query_embeddings=[query_embedding.tolist()],
+        n_results=k,
+        include=["documents", "metadatas", "distances"],
     )
-
+    results = _merge_pending(results, query_embedding, k, namespace)
+    with _cache_lock:
+        _result_cache[key] = (generation, now, results)
+        if len(_result_cache) > RETRIEVAL_CACHE_SIZE:
+            _result_cache.popitem(last=False)
+    return results